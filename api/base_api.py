@@ -1,52 +1,1469 @@
 # 创建一个类继承APIRouter，并且在 init 的时候调用一些初始化加载模型的逻辑
 
-from fastapi import APIRouter, Request
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import JSONResponse, Response
 import asyncio
+import base64
+import contextvars
+import gc
+import hashlib
+import importlib.abc
+import importlib.machinery
+import json
+import math
 import os
-from starlette.middleware.base import BaseHTTPMiddleware
+import re
+import shutil
+import socket
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict, defaultdict, deque
+from contextlib import contextmanager
+from functools import wraps
+from io import BytesIO
+from urllib.parse import parse_qsl, urlencode
 from abc import ABC, abstractmethod
 
 
-class InitMiddleware(BaseHTTPMiddleware):
-    def __init__(self, app, routers):
-        super().__init__(app)
-        self.routers = routers  # 这是一个列表，包含所有需要初始化的 router 实例
-        self.init_locks = {id(router): asyncio.Lock() for router in routers}  # 为每个 router 创建一个锁
-
-    async def dispatch(self, request: Request, call_next):
-        # 检查每个 router 是否已初始化
-        for router in self.routers:
-            if not router.initialized:
-                # 获取对应 router 的锁
-                lock = self.init_locks[id(router)]
-                async with lock:
-                    # 双重检查是否已初始化
-                    if not router.initialized:
-                        try:
-                            await router.init_app()  # 执行初始化
-                            router.initialized = True
-                        except Exception as e:
-                            # 如果初始化失败，返回错误响应
-                            return JSONResponse(
-                                status_code=500,
-                                content={"message": f"Initialization failed for {router.app_name}: {str(e)}"}
-                            )
-        # 所有 router 都已初始化，处理请求
-        response = await call_next(request)
-        return response
+EXECUTOR_QUEUE_SIZE = int(os.environ.get('EXECUTOR_QUEUE_SIZE', 16))
+# 同组任务最多连续插队执行的个数，超过后按到达顺序取任务，避免其他组饿死
+EXECUTOR_GROUP_BURST = int(os.environ.get('EXECUTOR_GROUP_BURST', 4))
+# AigcHub 根目录，各应用的资源路径都以此为基准解析，与进程当前工作目录无关
+HUB_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# 应用仓库所在目录，可通过 AIGCHUB_REPO_DIR 指向其他位置（如离线 benchmark 的桩目录）
+REPO_DIR = os.environ.get('AIGCHUB_REPO_DIR', os.path.join(HUB_ROOT, 'repo'))
+# 请求级临时文件的根目录，默认放在 tmpfs（/dev/shm）上；总占用超过 AIGCHUB_TMP_QUOTA_MB 时拒绝写入
+TMP_ROOT = os.environ.get('AIGCHUB_TMP_DIR') or os.path.join(
+    '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(), 'aigchub')
+TMP_QUOTA_MB = int(os.environ.get('AIGCHUB_TMP_QUOTA_MB', 1024))
+# 可复用结果（如确定性的生成结果）的磁盘缓存目录
+CACHE_DIR = os.environ.get('AIGCHUB_CACHE_DIR', os.path.join(HUB_ROOT, 'cache'))
+# 异步任务（async=true）的 SQLite 数据库、结果保留时间（秒）、已完成结果的总容量上限（MB）和每个应用同时执行的任务数
+JOB_DB = os.environ.get('AIGCHUB_JOB_DB', os.path.join(HUB_ROOT, 'jobs.sqlite3'))
+JOB_RESULT_TTL = int(os.environ.get('JOB_RESULT_TTL', 3600))
+JOB_RESULT_MAX_MB = int(os.environ.get('JOB_RESULT_MAX_MB', 512))
+JOB_CONCURRENCY = int(os.environ.get('JOB_CONCURRENCY', 1))
+# 每个应用排队中（尚未开始执行）的异步任务数上限，超出时提交返回 429；为 0 时不限制
+JOB_MAX_QUEUED = int(os.environ.get('JOB_MAX_QUEUED', 64))
+# 执行中的任务每隔 JOB_HEARTBEAT_SECONDS 秒更新一次心跳，超过 JOB_STALE_SECONDS 秒没有心跳的任务视为其进程已退出，重新排队
+JOB_HEARTBEAT_SECONDS = float(os.environ.get('JOB_HEARTBEAT_SECONDS', 10))
+JOB_STALE_SECONDS = float(os.environ.get('JOB_STALE_SECONDS', 60))
+# 每个应用同时处理的请求数和等待处理的请求数上限，超出时返回 429；并发上限为 0 时不限制
+ADMISSION_MAX_CONCURRENCY = int(os.environ.get('ADMISSION_MAX_CONCURRENCY', 8))
+ADMISSION_MAX_QUEUE = int(os.environ.get('ADMISSION_MAX_QUEUE', 32))
+# 启动时预加载（--eager）时，同一设备上最多同时初始化的应用数
+STARTUP_PARALLEL_PER_DEVICE = int(os.environ.get('STARTUP_PARALLEL_PER_DEVICE', 1))
+
+_cwd_lock = threading.RLock()
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    parts = []
+    for key, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{key}="{value}"')
+    return '{' + ','.join(parts) + '}'
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, value=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+
+class Gauge(Counter):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram:
+    type = 'histogram'
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # labels -> [各 bucket 计数..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, state in self._values.items():
+                for bound, count in zip(self.buckets, state):
+                    samples.append((self.name + '_bucket', key + (('le', repr(float(bound))),), count))
+                samples.append((self.name + '_bucket', key + (('le', '+Inf'),), state[-1]))
+                samples.append((self.name + '_sum', key, state[-2]))
+                samples.append((self.name + '_count', key, state[-1]))
+        return samples
+
+
+class MetricsRegistry:
+    """进程内的指标注册表，按 Prometheus 文本格式导出。同名指标重复注册时返回已有实例。"""
+    def __init__(self):
+        self._metrics = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, documentation, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, **kwargs)
+            return metric
+
+    def counter(self, name, documentation):
+        return self._get_or_create(Counter, name, documentation)
+
+    def gauge(self, name, documentation):
+        return self._get_or_create(Gauge, name, documentation)
+
+    def histogram(self, name, documentation, buckets=Histogram.DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, documentation, buckets=buckets)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{_format_labels(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = MetricsRegistry()
+
+REQUEST_LATENCY = metrics.histogram('aigchub_request_duration_seconds', 'HTTP request latency until the response body is sent.')
+EXECUTOR_QUEUE_WAIT = metrics.histogram('aigchub_executor_queue_wait_seconds', 'Time a job waits for the app worker thread.')
+EXECUTOR_COMPUTE = metrics.histogram('aigchub_executor_compute_seconds', 'Time a job runs on the app worker thread.')
+EXECUTOR_QUEUE_DEPTH = metrics.gauge('aigchub_executor_queue_depth', 'Jobs waiting for the app worker thread.')
+APP_INIT_SECONDS = metrics.gauge('aigchub_app_init_seconds', 'Duration of the last init_app call.')
+APP_RESIDENT = metrics.gauge('aigchub_app_resident', 'Whether the app models are loaded (1) or not (0).')
+APP_LOADS = metrics.counter('aigchub_app_loads_total', 'Number of successful init_app calls.')
+APP_WARMUP_SECONDS = metrics.gauge('aigchub_app_warmup_seconds', 'Duration of the last warmup inference at startup.')
+APP_EVICTIONS = metrics.counter('aigchub_app_evictions_total', 'Number of apps unloaded to stay within the memory budget.')
+RESULT_CACHE_LOOKUPS = metrics.counter('aigchub_result_cache_lookups_total', 'Result cache lookups by tier that answered (memory, disk or miss).')
+ADMISSION_REJECTED = metrics.counter('aigchub_admission_rejected_total', 'Requests rejected with 429 because the app is at its concurrency and queue limits.')
+ADMISSION_WAITING = metrics.gauge('aigchub_admission_waiting', 'Requests admitted but waiting for a concurrency slot.')
+JOBS_FINISHED = metrics.counter('aigchub_jobs_finished_total', 'Async jobs that reached a final status (succeeded, failed or cancelled).')
+JOBS_REJECTED = metrics.counter('aigchub_jobs_rejected_total', 'Async job submissions rejected with 429 because the app has too many queued jobs.')
+JOB_QUEUE_WAIT = metrics.histogram('aigchub_job_queue_wait_seconds', 'Time an async job waits before it starts running.')
+
+
+@contextmanager
+def cwd_lease(path):
+    """仅供内部写死相对路径的上游代码使用：持有全局锁期间切换进程工作目录。
+
+    hub 自身的代码只使用绝对路径，不受影响；需要 lease 的应用之间相互串行。
+    """
+    with _cwd_lock:
+        ori_dir = os.getcwd()
+        os.chdir(path)
+        try:
+            yield
+        finally:
+            os.chdir(ori_dir)
+
+
+def _pid_exited(pid):
+    """本机上 pid 对应的进程已不存在时返回 True；pid 被复用时无法区分，视为仍存在。"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+    return False
+
+
+# 当前请求的临时目录，由 ScratchDir.bind() 设置；AppExecutor 据此让目录在该请求提交的任务结束前保留
+_current_scratch = contextvars.ContextVar('aigchub_scratch', default=None)
+
+
+class ScratchDir:
+    """单个请求独占的临时目录，文件名由 hub 生成或清洗，不同请求之间互不覆盖。
+
+    bind() 之后在同一请求中提交到 AppExecutor 的任务会占用该目录：cleanup() 时若仍有任务排队或执行
+    （如客户端已断开），等最后一个任务结束后再删除。
+    """
+    def __init__(self, manager, path):
+        self.manager = manager
+        self.dir = path
+        self.reserved = 0
+        self._lock = threading.Lock()
+        self._jobs = 0
+        self._closed = False
+
+    def bind(self):
+        _current_scratch.set(self)
+        return self
+
+    def path(self, name):
+        """目录下文件的绝对路径；name 只保留文件名部分，防止客户端提供的文件名越出目录。"""
+        name = re.sub(r'[^\w.-]', '_', os.path.basename(name or '')).lstrip('.') or uuid.uuid4().hex
+        return os.path.join(self.dir, name)
+
+    def write(self, name, data: bytes):
+        self.manager.reserve(len(data))
+        self.reserved += len(data)
+        path = self.path(name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def hold(self):
+        with self._lock:
+            self._jobs += 1
+
+    def job_done(self):
+        with self._lock:
+            self._jobs -= 1
+            remove = self._closed and not self._jobs
+        if remove:
+            self._remove()
+
+    def cleanup(self):
+        with self._lock:
+            self._closed = True
+            remove = not self._jobs
+        if remove:
+            self._remove()
+
+    def _remove(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+        self.manager.release(self.reserved)
+        self.reserved = 0
+
+
+class TempArtifactManager:
+    """请求级临时文件管理：每个请求一个独立目录，请求结束后删除。
+
+    上游模型只接受文件路径时才落盘，能直接接受内存数据的应尽量不经过这里。
+    每个进程使用 root 下以 pid 命名的子目录，多个 hub 进程共用 root 时互不影响，进程退出时由 shutdown 删除。
+    返回给客户端路径、需在请求结束后保留的产物放在 outputs/ 下，超出配额时从最旧的开始删除。
+    配额按 hub 写入的字节数（ScratchDir.write 和 output_path 声明的大小）累计，上游代码自行写出的文件不计入。
+    """
+    def __init__(self, root=TMP_ROOT, quota_mb=TMP_QUOTA_MB):
+        self.root = root
+        self.dir = os.path.join(root, str(os.getpid()))
+        self.quota_bytes = quota_mb * 1024 * 1024
+        self.outputs_dir = os.path.join(self.dir, 'outputs')
+        self._lock = threading.Lock()
+        self._used = 0
+        self._outputs = OrderedDict()  # 路径 -> 字节数，按创建先后排列
+
+    def scratch(self):
+        path = os.path.join(self.dir, uuid.uuid4().hex)
+        os.makedirs(path)
+        return ScratchDir(self, path)
+
+    def output_path(self, suffix='', nbytes=0):
+        """需要在响应之后继续保留的产物路径，nbytes 为即将写入的大小，超出配额时先删除最旧的产物。"""
+        self.reserve(nbytes)
+        os.makedirs(self.outputs_dir, exist_ok=True)
+        path = os.path.join(self.outputs_dir, uuid.uuid4().hex + suffix)
+        with self._lock:
+            self._outputs[path] = nbytes
+        return path
+
+    def reserve(self, nbytes):
+        with self._lock:
+            while self._used + nbytes > self.quota_bytes and self._outputs:
+                path, size = self._outputs.popitem(last=False)
+                self._used -= size
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            if self._used + nbytes > self.quota_bytes:
+                raise HTTPException(status_code=507, detail=f"Temporary storage quota of {self.quota_bytes // (1024 * 1024)} MB exceeded")
+            self._used += nbytes
+
+    def release(self, nbytes):
+        with self._lock:
+            self._used = max(0, self._used - nbytes)
+
+    def used_bytes(self):
+        with self._lock:
+            return self._used
+
+    def remove_stale(self):
+        """删除已退出的 hub 进程遗留的目录。"""
+        if not os.path.isdir(self.root):
+            return
+        for name in os.listdir(self.root):
+            if name.isdigit() and int(name) != os.getpid() and _pid_exited(int(name)):
+                shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+
+    def shutdown(self):
+        """删除本进程的所有临时文件，包括未被取走的产物。"""
+        shutil.rmtree(self.dir, ignore_errors=True)
+        with self._lock:
+            self._used = 0
+            self._outputs.clear()
+
+
+temp_artifacts = TempArtifactManager()
+
+
+async def request_scratch():
+    """FastAPI 依赖：为请求创建临时目录，处理函数返回且该请求提交的工作线程任务都结束后删除。
+
+    使用异步生成器，bind() 设置的上下文变量才会在处理函数所在的任务中生效。
+    """
+    scratch = temp_artifacts.scratch().bind()
+    try:
+        yield scratch
+    finally:
+        scratch.cleanup()
+
+
+# output_format -> (PIL 格式名, media type)
+IMAGE_FORMATS = {
+    'jpeg': ('JPEG', 'image/jpeg'),
+    'jpg': ('JPEG', 'image/jpeg'),
+    'png': ('PNG', 'image/png'),
+    'webp': ('WEBP', 'image/webp'),
+}
+_IMAGE_MEDIA_TYPES = {'image/jpeg': 'jpeg', 'image/jpg': 'jpeg', 'image/png': 'png', 'image/webp': 'webp'}
+
+
+def encode_image(image, output_format='jpeg', quality=None):
+    """把 PIL 图像编码为 output_format 格式的字节串；quality 只对 JPEG/WebP 生效。"""
+    pil_format, _ = IMAGE_FORMATS[output_format]
+    # JPEG/WebP 可以直接编码 RGBX（如映射自 numpy 数组的大图），不必先整体拷贝为 RGB
+    if pil_format == 'JPEG' and image.mode not in ('RGB', 'L', 'RGBX'):
+        image = image.convert('RGB')
+    elif pil_format == 'PNG' and image.mode == 'RGBX':
+        image = image.convert('RGB')
+    kwargs = {'quality': quality} if quality is not None and pil_format != 'PNG' else {}
+    buffer = BytesIO()
+    image.save(buffer, format=pil_format, **kwargs)
+    return buffer.getvalue()
+
+
+def _negotiate_accept(accept, default_format):
+    """按 Accept 头的 q 值选择输出：返回图像格式，或 None 表示 JSON。"""
+    best, best_q = None, 0.0
+    for item in accept.split(','):
+        media_type, *params = [part.strip() for part in item.split(';')]
+        media_type = media_type.lower()
+        q = 1.0
+        for param in params:
+            if param.startswith('q='):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        if media_type in ('application/json', '*/*'):
+            image_format = None
+        elif media_type == 'image/*':
+            image_format = default_format
+        elif media_type in _IMAGE_MEDIA_TYPES:
+            image_format = _IMAGE_MEDIA_TYPES[media_type]
+        else:
+            continue
+        if q > best_q:
+            best, best_q = image_format, q
+    return best
+
+
+class ImageOutput:
+    """图像接口的输出方式。
+
+    默认与 OpenAI 一致返回 {"data": [{"b64_json": ...}]}；response_format=binary，
+    或 Accept 头优先请求 image/jpeg、image/png、image/webp、image/* 时，直接返回编码后的图像字节，
+    省去 base64 的体积膨胀和 JSON 包装的额外拷贝。
+    """
+    def __init__(self, request: Request, response_format=None, output_format=None, output_quality=None, default_format='jpeg'):
+        if output_format is not None and output_format.lower() not in IMAGE_FORMATS:
+            raise HTTPException(status_code=400, detail=f"Unsupported output_format {output_format!r}, expected one of {sorted(IMAGE_FORMATS)}")
+        if response_format not in (None, '', 'b64_json', 'binary'):
+            raise HTTPException(status_code=400, detail=f"Unsupported response_format {response_format!r}, expected 'b64_json' or 'binary'")
+        if output_quality is not None and not 1 <= output_quality <= 100:
+            raise HTTPException(status_code=400, detail="output_quality must be between 1 and 100")
+        self.format = output_format.lower() if output_format else default_format
+        self.quality = output_quality
+        if response_format:
+            self.binary = response_format == 'binary'
+        else:
+            accepted = _negotiate_accept(request.headers.get('accept', ''), self.format)
+            self.binary = accepted is not None
+            if accepted is not None and output_format is None:
+                self.format = accepted
+
+    @property
+    def media_type(self):
+        return IMAGE_FORMATS[self.format][1]
+
+    def encode(self, image):
+        """在工作线程中调用：二进制模式返回字节串，否则返回 base64 字符串。"""
+        return self.wrap(encode_image(image, self.format, self.quality))
+
+    def wrap(self, data):
+        """把已编码的图像字节转换为 encode() 的返回形式。"""
+        return data if self.binary else base64.b64encode(data).decode('utf-8')
+
+    def response(self, data):
+        return Response(content=data, media_type=self.media_type)
+
+
+class ResultCache:
+    """按内容寻址的结果缓存：内存 LRU 一级 + 磁盘 LRU 二级，各自按字节数限制。
+
+    key 由 make_key() 对请求中所有影响结果的字段求哈希得到；值为 bytes。
+    磁盘上每个结果一个文件，进程重启后仍然有效；方法均可在任意线程中调用。
+    """
+    def __init__(self, name, memory_mb=64, disk_mb=1024, disk_dir=None):
+        self.name = name
+        self.memory_bytes = memory_mb * 1024 * 1024
+        self.disk_bytes = disk_mb * 1024 * 1024
+        self.disk_dir = disk_dir or os.path.join(CACHE_DIR, name)
+        self._memory = OrderedDict()  # key -> bytes，最近使用的在末尾
+        self._memory_size = 0
+        self._disk = OrderedDict()  # key -> 文件大小
+        self._disk_size = 0
+        self._lock = threading.Lock()
+        self.hits = {'memory': 0, 'disk': 0}
+        self.misses = 0
+        if self.disk_bytes > 0 and os.path.isdir(self.disk_dir):
+            entries = [entry for entry in os.scandir(self.disk_dir) if entry.is_file() and not entry.name.endswith('.tmp')]
+            for entry in sorted(entries, key=lambda entry: entry.stat().st_mtime):
+                self._disk[entry.name] = entry.stat().st_size
+                self._disk_size += entry.stat().st_size
+
+    @staticmethod
+    def make_key(**fields):
+        return hashlib.sha256(json.dumps(fields, sort_keys=True, default=str).encode()).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.hits['memory'] += 1
+                RESULT_CACHE_LOOKUPS.inc(cache=self.name, tier='memory')
+                return data
+            on_disk = key in self._disk
+            if on_disk:
+                self._disk.move_to_end(key)
+        if on_disk:
+            try:
+                with open(os.path.join(self.disk_dir, key), 'rb') as f:
+                    data = f.read()
+            except OSError:
+                data = None
+        with self._lock:
+            if data is None:
+                self.misses += 1
+                RESULT_CACHE_LOOKUPS.inc(cache=self.name, tier='miss')
+                return None
+            self.hits['disk'] += 1
+            RESULT_CACHE_LOOKUPS.inc(cache=self.name, tier='disk')
+            self._put_memory(key, data)
+        return data
+
+    def put(self, key, data: bytes):
+        with self._lock:
+            self._put_memory(key, data)
+        if not 0 < len(data) <= self.disk_bytes:
+            return
+        os.makedirs(self.disk_dir, exist_ok=True)
+        path = os.path.join(self.disk_dir, key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._disk_size += len(data) - self._disk.pop(key, 0)
+            self._disk[key] = len(data)
+            while self._disk_size > self.disk_bytes:
+                victim, size = self._disk.popitem(last=False)
+                self._disk_size -= size
+                try:
+                    os.remove(os.path.join(self.disk_dir, victim))
+                except OSError:
+                    pass
+
+    def _put_memory(self, key, data):
+        if len(data) > self.memory_bytes:
+            return
+        self._memory_size += len(data) - len(self._memory.pop(key, b''))
+        self._memory[key] = data
+        while self._memory_size > self.memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits['memory'] + self.hits['disk'] + self.misses
+            return {"hits": dict(self.hits), "misses": self.misses,
+                    "hit_rate": (lookups - self.misses) / lookups if lookups else 0,
+                    "memory_entries": len(self._memory), "memory_bytes": self._memory_size,
+                    "disk_entries": len(self._disk), "disk_bytes": self._disk_size}
+
+
+def _resolve_future(future, result=None, exception=None):
+    if future.done():
+        return
+    if exception is not None:
+        future.set_exception(exception)
+    else:
+        future.set_result(result)
+
+
+class AppExecutor:
+    """每个应用独占一个工作线程，串行执行该应用的阻塞调用（TPU 推理、子进程、编解码等）。
+
+    事件循环只负责排队和等待结果；同时在等待的任务数由 max_queue 限制，
+    超出的请求在 run() 中异步等待空位，不会占用线程。
+    指定 cwd 时，每个任务都在 cwd_lease(cwd) 中执行。
+    通过 run_grouped() 提交的任务带有分组键（如模型输入形状）：上一个任务执行完后，优先取队列中与其同组的任务，
+    让同组任务连续执行以减少切换开销；连续插队不超过 group_burst 个。
+    """
+    def __init__(self, name, max_queue=EXECUTOR_QUEUE_SIZE, cwd=None, group_burst=EXECUTOR_GROUP_BURST):
+        self.name = name
+        self.max_queue = max_queue
+        self.cwd = cwd
+        self.group_burst = group_burst
+        self._jobs = deque()
+        self._cond = threading.Condition()
+        self._slots = None  # asyncio.Semaphore，首次在事件循环中使用时创建
+        self._thread = None
+        self._last_group = None
+        self._group_run = 0
+
+    @property
+    def queue_depth(self):
+        return len(self._jobs)
+
+    async def run(self, func, *args, **kwargs):
+        return await self.run_grouped(None, func, *args, **kwargs)
+
+    async def run_grouped(self, group, func, *args, **kwargs):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_queue)
+        async with self._slots:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            scratch = _current_scratch.get()
+            with self._cond:
+                if scratch is not None:
+                    scratch.hold()
+                self._jobs.append((func, args, kwargs, future, loop, time.perf_counter(), group, scratch))
+                EXECUTOR_QUEUE_DEPTH.set(len(self._jobs), app=self.name)
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._worker, name=f"{self.name}-worker", daemon=True)
+                    self._thread.start()
+                self._cond.notify()
+            return await future
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._jobs:
+                    self._cond.wait()
+                func, args, kwargs, future, loop, enqueue_time, group, scratch = self._next_job()
+                EXECUTOR_QUEUE_DEPTH.set(len(self._jobs), app=self.name)
+            try:
+                self._run_job(func, args, kwargs, future, loop, enqueue_time)
+            finally:
+                if scratch is not None:
+                    scratch.job_done()
+
+    def _run_job(self, func, args, kwargs, future, loop, enqueue_time):
+        if future.cancelled():
+            # 等待方已放弃（如客户端断开），跳过尚未开始的任务
+            return
+        start = time.perf_counter()
+        EXECUTOR_QUEUE_WAIT.observe(start - enqueue_time, app=self.name)
+        result, exception = None, None
+        try:
+            if self.cwd is None:
+                result = func(*args, **kwargs)
+            else:
+                with cwd_lease(self.cwd):
+                    result = func(*args, **kwargs)
+        except BaseException as e:
+            exception = e
+        EXECUTOR_COMPUTE.observe(time.perf_counter() - start, app=self.name)
+        try:
+            loop.call_soon_threadsafe(_resolve_future, future, result, exception)
+        except RuntimeError:
+            pass  # 事件循环已关闭
+
+    def _next_job(self):
+        # 调用方需持有 self._cond
+        job = None
+        if self._last_group is not None and self._group_run < self.group_burst:
+            for i, queued in enumerate(self._jobs):
+                if queued[6] == self._last_group:
+                    job = queued
+                    del self._jobs[i]
+                    break
+        if job is None:
+            job = self._jobs.popleft()
+        group = job[6]
+        self._group_run = self._group_run + 1 if group is not None and group == self._last_group else 1
+        self._last_group = group
+        return job
+
+
+class MicroBatcher:
+    """把短时间内到达的单样本请求合并成一批，在应用工作线程中用一次 batch_fn 调用处理。
+
+    第一个请求到达后最多等待 max_wait_ms，或凑满 max_batch_size 时立即提交；
+    batch_fn(items) 需返回与 items 等长、顺序一致的结果列表；某一项的结果为异常实例时只传给该项的请求，
+    batch_fn 本身抛出的异常才会传给该批所有请求。
+    """
+    def __init__(self, router, batch_fn, max_batch_size=1, max_wait_ms=5):
+        self.router = router
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._pending = []
+        self._timer = None
+        self._tasks = set()  # 保留执行中批次的引用，避免任务被回收
+        self.batches = 0
+        self.items = 0
+
+    async def submit(self, item):
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_wait_ms / 1000, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._pending:
+            batch = self._pending[:self.max_batch_size]
+            del self._pending[:self.max_batch_size]
+            task = asyncio.ensure_future(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch):
+        # 等待方已取消的请求不再送入引擎
+        batch = [(item, future) for item, future in batch if not future.done()]
+        if not batch:
+            return
+        self.batches += 1
+        self.items += len(batch)
+        try:
+            results = await self.router.execute(self.batch_fn, [item for item, _ in batch])
+        except BaseException as e:
+            for _, future in batch:
+                _resolve_future(future, exception=e)
+            return
+        for (_, future), result in zip(batch, results):
+            if isinstance(result, BaseException):
+                _resolve_future(future, exception=result)
+            else:
+                _resolve_future(future, result)
+
+    def stats(self):
+        return {"batches": self.batches, "items": self.items,
+                "mean_batch_size": self.items / self.batches if self.batches else 0,
+                "max_batch_size": self.max_batch_size, "max_wait_ms": self.max_wait_ms}
+
+
+class ModelResidencyManager:
+    """管理各应用模型的驻留：首次访问时才初始化，超出设备内存预算时按 LRU 卸载空闲应用。
+
+    内存占用使用各 router 的 memory_mb 估计值；budget_mb 为 None 时不做卸载。
+    也可以用 warm_start() 在启动时预先加载全部应用，readiness() 报告各应用的状态。
+    """
+    def __init__(self, routers, budget_mb=None):
+        self.routers = {router.app_name: router for router in routers}
+        self.budget_mb = budget_mb
+        self.init_locks = {name: asyncio.Lock() for name in self.routers}  # 为每个 router 创建一个锁
+        self._budget_lock = asyncio.Lock()
+        self._lru = OrderedDict()  # 已驻留的应用，最近使用的在末尾
+        self._loading = set()
+        self._in_use = {name: 0 for name in self.routers}
+        self.init_seconds = {}
+        self.loads = 0
+        self.evictions = 0
+        self.load_failures = 0
+        # 各应用的状态：not_loaded、loading、warming、ready、failed，以及超出预算而未预加载的 deferred
+        self.states = {name: "not_loaded" for name in self.routers}
+        self.errors = {}
+        self.warmup_seconds = {}
+        self.startup_complete = True
+        self.startup_failures = set()
+
+    def router_for_path(self, path):
+        return self.routers.get(path.split('/', 2)[1])
+
+    def resident_mb(self):
+        names = set(self._lru) | self._loading
+        return sum(self.routers[name].memory_mb for name in names)
+
+    async def acquire(self, router):
+        """确保应用已初始化并标记为使用中，需与 release() 成对调用。"""
+        name = router.app_name
+        if not router.initialized:
+            async with self.init_locks[name]:
+                # 双重检查是否已初始化
+                if not router.initialized:
+                    await self._load(router)
+        self._in_use[name] += 1
+        self._lru[name] = None
+        self._lru.move_to_end(name)
+
+    def release(self, router):
+        self._in_use[router.app_name] -= 1
+
+    async def _load(self, router, evict=True):
+        """初始化应用；evict 为 False 且放不进内存预算时不加载，返回 False。"""
+        name = router.app_name
+        async with self._budget_lock:
+            if not evict and self.budget_mb is not None and self.resident_mb() + router.memory_mb > self.budget_mb:
+                return False
+            await self._make_room(router)
+            self._loading.add(name)
+        self.states[name] = "loading"
+        start = time.time()
+        try:
+            await router.init_app()  # 执行初始化
+            router.initialized = True
+        except Exception as e:
+            self.load_failures += 1
+            self.states[name] = "failed"
+            self.errors[name] = str(e)
+            raise
+        finally:
+            self._loading.discard(name)
+        self.states[name] = "ready"
+        self.errors.pop(name, None)
+        self.init_seconds[name] = time.time() - start
+        self.loads += 1
+        self._lru[name] = None
+        APP_INIT_SECONDS.set(self.init_seconds[name], app=name)
+        APP_LOADS.inc(app=name)
+        APP_RESIDENT.set(1, app=name)
+        return True
+
+    async def warm_start(self, warmup=False, parallel_per_device=STARTUP_PARALLEL_PER_DEVICE):
+        """启动时预加载所有应用，不同设备上的应用并行初始化，同一设备上最多 parallel_per_device 个同时进行。
+
+        放不进内存预算的应用不预加载（状态为 deferred），仍在首次访问时加载；warmup 为 True 时，
+        每个应用加载后再执行一次 router.warmup()，把首次推理的开销留在启动阶段。
+        """
+        self.startup_complete = False
+        devices = {}
+        for router in self.routers.values():
+            devices.setdefault(router.device_id, asyncio.Semaphore(parallel_per_device))
+
+        async def start(router):
+            async with devices[router.device_id]:
+                await self.preload(router, warmup)
+
+        try:
+            await asyncio.gather(*(start(router) for router in self.routers.values()))
+        finally:
+            self.startup_complete = True
+
+    async def preload(self, router, warmup=False):
+        name = router.app_name
+        try:
+            async with self.init_locks[name]:
+                if not router.initialized and not await self._load(router, evict=False):
+                    self.states[name] = "deferred"
+                    print(f"Application {name} does not fit in the memory budget, it will be loaded on first use.")
+                    return
+            if warmup:
+                # 预热期间标记为使用中，避免被其他应用的加载卸载
+                self._in_use[name] += 1
+                self.states[name] = "warming"
+                start = time.time()
+                try:
+                    await router.warmup()
+                finally:
+                    self._in_use[name] -= 1
+                self.warmup_seconds[name] = time.time() - start
+                APP_WARMUP_SECONDS.set(self.warmup_seconds[name], app=name)
+                self.states[name] = "ready"
+        except Exception as e:
+            self.states[name] = "failed"
+            self.errors[name] = str(e)
+            self.startup_failures.add(name)
+            print(f"Application {name} failed to start: {e}")
+
+    def readiness(self):
+        """启动预加载已结束且其中没有应用失败时为 ready；懒加载模式下始终 ready。"""
+        apps = {
+            name: {"state": state, "load_seconds": self.init_seconds.get(name),
+                   "warmup_seconds": self.warmup_seconds.get(name), "error": self.errors.get(name)}
+            for name, state in self.states.items()
+        }
+        ready = self.startup_complete and not self.startup_failures
+        return ready, apps
+
+    async def _make_room(self, router):
+        if self.budget_mb is None:
+            return
+        while self.resident_mb() + router.memory_mb > self.budget_mb:
+            victim = next((self.routers[name] for name in self._lru if self._in_use[name] == 0), None)
+            if victim is None:
+                print(f"Memory budget {self.budget_mb} MB exceeded while loading {router.app_name}, "
+                      f"but all resident apps are busy.")
+                return
+            await self.evict(victim)
+
+    async def evict(self, router):
+        name = router.app_name
+        # 先标记为未初始化，之后到达的请求会等待重新加载，而不会使用正在释放的模型
+        router.initialized = False
+        self._lru.pop(name, None)
+        try:
+            await router.destroy_app()
+        finally:
+            router.models = {}
+            gc.collect()
+        self.evictions += 1
+        self.states[name] = "not_loaded"
+        APP_EVICTIONS.inc(app=name)
+        APP_RESIDENT.set(0, app=name)
+        print(f"Application {name} has been evicted to free device memory.")
+
+    def stats(self):
+        return {
+            "budget_mb": self.budget_mb,
+            "resident_mb": self.resident_mb(),
+            "resident": list(self._lru),
+            "loading": sorted(self._loading),
+            "in_use": {name: n for name, n in self._in_use.items() if n},
+            "init_seconds": self.init_seconds,
+            "loads": self.loads,
+            "evictions": self.evictions,
+            "load_failures": self.load_failures,
+        }
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, app_name, retry_after):
+        super().__init__(f"Application {app_name} is overloaded, retry after {retry_after} seconds.")
+        self.retry_after = retry_after
+
+
+class _AdmissionState:
+    def __init__(self, max_concurrency, max_queue):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.slots = asyncio.Semaphore(max_concurrency) if max_concurrency > 0 else None
+        self.active = 0
+        self.waiting = 0
+        self.service_seconds = None  # 服务时间的指数滑动平均
+        self.admitted = 0
+        self.rejected = 0
+
+
+class AdmissionController:
+    """按应用限制同时处理的请求数（max_concurrency）和等待空位的请求数（max_queue）。
+
+    两者都已满时立即以 AdmissionRejected 拒绝，不再读取请求体或排队；Retry-After 按该应用服务时间的
+    指数滑动平均和前面的请求数估算。各应用可通过 router 的 max_concurrency / max_queue 属性覆盖默认值。
+    """
+    def __init__(self, routers, max_concurrency=ADMISSION_MAX_CONCURRENCY, max_queue=ADMISSION_MAX_QUEUE, alpha=0.2):
+        self.alpha = alpha
+        self._states = {
+            router.app_name: _AdmissionState(
+                router.max_concurrency if router.max_concurrency is not None else max_concurrency,
+                router.max_queue if router.max_queue is not None else max_queue)
+            for router in routers
+        }
+
+    def service_seconds(self, name):
+        """该应用服务时间的指数滑动平均，还没有样本时为 None。"""
+        return self._states[name].service_seconds
+
+    def retry_after(self, name):
+        state = self._states[name]
+        service = state.service_seconds or 1.0
+        return max(1, math.ceil(service * (state.waiting + 1) / state.max_concurrency))
+
+    async def acquire(self, name, wait=False):
+        """占用一个处理名额，需与 release() 成对调用。wait 为 True 时（如后台任务）不受排队长度限制。"""
+        state = self._states[name]
+        if state.slots is None:
+            return
+        if state.slots.locked() and state.waiting >= state.max_queue and not wait:
+            state.rejected += 1
+            ADMISSION_REJECTED.inc(app=name)
+            raise AdmissionRejected(name, self.retry_after(name))
+        state.waiting += 1
+        ADMISSION_WAITING.set(state.waiting, app=name)
+        try:
+            await state.slots.acquire()
+        finally:
+            state.waiting -= 1
+            ADMISSION_WAITING.set(state.waiting, app=name)
+        state.active += 1
+        state.admitted += 1
+
+    def release(self, name, seconds=None):
+        """释放处理名额；seconds 为本次请求的服务时间，为 None 时（如初始化失败）不计入滑动平均。"""
+        state = self._states[name]
+        if state.slots is None:
+            return
+        state.active -= 1
+        state.slots.release()
+        if seconds is None:
+            return
+        if state.service_seconds is None:
+            state.service_seconds = seconds
+        else:
+            state.service_seconds += self.alpha * (seconds - state.service_seconds)
+
+    def stats(self):
+        return {name: {"max_concurrency": state.max_concurrency, "max_queue": state.max_queue,
+                       "active": state.active, "waiting": state.waiting, "admitted": state.admitted,
+                       "rejected": state.rejected, "service_seconds": state.service_seconds}
+                for name, state in self._states.items()}
+
+
+class InitMiddleware:
+    """ASGI 中间件：应用的请求先经过准入控制，再确保应用已初始化，最后记录请求延迟。
+
+    直接转发 receive/send，响应（包括 StreamingResponse）原样逐块发出，不做缓冲；
+    应用已初始化时每个请求只多几次计数操作。流式响应在 body 发送完毕后才算请求结束。
+    """
+    def __init__(self, app, residency, admission=None):
+        self.app = app
+        self.residency = residency
+        self.admission = admission
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        router = self.residency.router_for_path(scope["path"])
+        admitted = False
+        if router is not None:
+            if self.admission is not None:
+                try:
+                    # 后台任务的重放请求只排队，不会被拒绝
+                    await self.admission.acquire(router.app_name, wait=scope.get("aigchub.job", False))
+                except AdmissionRejected as e:
+                    response = JSONResponse(status_code=429, content={"message": str(e)},
+                                            headers={"Retry-After": str(e.retry_after)})
+                    return await response(scope, receive, send)
+                admitted = True
+            try:
+                await self.residency.acquire(router)
+            except BaseException as e:
+                if admitted:
+                    self.admission.release(router.app_name)
+                if not isinstance(e, Exception):
+                    raise
+                # 如果初始化失败，返回错误响应
+                response = JSONResponse(
+                    status_code=500,
+                    content={"message": f"Initialization failed for {router.app_name}: {str(e)}"}
+                )
+                return await response(scope, receive, send)
+        # 服务时间不含模型加载，避免首个请求拉高 Retry-After 的估计
+        service_start = time.perf_counter()
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        # /、/docs 等不属于任何应用的请求不触发模型加载
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            if router is not None:
+                self.residency.release(router)
+                if admitted:
+                    self.admission.release(router.app_name, time.perf_counter() - service_start)
+            REQUEST_LATENCY.observe(
+                time.perf_counter() - start,
+                app=router.app_name if router is not None else "hub",
+                route=getattr(scope.get("route"), "path", "unmatched"),
+                method=scope["method"],
+                status=status_code,
+            )
+
+
+def _owner_exited(owner, host):
+    """owner 为本机上已不存在的进程时返回 True；其他主机的进程只能靠心跳判断。"""
+    owner_host, _, rest = (owner or '').partition(':')
+    pid = rest.partition(':')[0]
+    if owner_host != host or not pid.isdigit():
+        return False
+    # pid 被复用时进程仍“存在”，此时等心跳超时
+    return _pid_exited(int(pid))
+
+
+class JobStore:
+    """异步任务的 SQLite 存储：保存原始请求（路径、查询参数、请求头和请求体）以及执行结果。
+
+    多个 hub 进程可以共用一个数据库：执行中的任务记录所属进程（owner，形如 主机名:pid:启动 ID）和心跳时间，
+    只有心跳超时、或所属进程在本机已不存在的任务才会重新排队，不会抢走其他存活进程正在执行的任务。
+    任务结束后即删除其请求体。
+    """
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS jobs (
+        id TEXT PRIMARY KEY,
+        app TEXT NOT NULL,
+        priority INTEGER NOT NULL,
+        status TEXT NOT NULL,
+        method TEXT NOT NULL,
+        path TEXT NOT NULL,
+        query_string BLOB NOT NULL,
+        headers TEXT NOT NULL,
+        body BLOB,
+        created_at REAL NOT NULL,
+        started_at REAL,
+        finished_at REAL,
+        status_code INTEGER,
+        response_headers TEXT,
+        result BLOB,
+        result_bytes INTEGER NOT NULL DEFAULT 0,
+        error TEXT,
+        owner TEXT,
+        heartbeat_at REAL
+    );
+    CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (app, status, priority DESC, created_at);
+    """
+    FINISHED = ('succeeded', 'failed', 'cancelled')
+    INFO_COLUMNS = ('id', 'app', 'priority', 'status', 'path', 'created_at', 'started_at', 'finished_at',
+                    'status_code', 'result_bytes', 'error')
+
+    def __init__(self, path=JOB_DB, owner=None):
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(self.SCHEMA)
+        # 旧版本创建的数据库没有 owner / heartbeat_at 列
+        columns = {row['name'] for row in self._conn.execute('PRAGMA table_info(jobs)')}
+        for column, column_type in (('owner', 'TEXT'), ('heartbeat_at', 'REAL')):
+            if column not in columns:
+                self._conn.execute(f'ALTER TABLE jobs ADD COLUMN {column} {column_type}')
+        self._lock = threading.Lock()
+
+    def add(self, app, priority, method, path, query_string, headers, body, max_queued=0):
+        """新增排队任务；max_queued 大于 0 且该应用已有这么多排队中的任务时不插入，返回 None。"""
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            # 计数和插入在同一条语句中完成，共用数据库的多个进程也不会超出上限
+            inserted = self._conn.execute(
+                'INSERT INTO jobs (id, app, priority, status, method, path, query_string, headers, body, created_at) '
+                'SELECT ?, ?, ?, \'queued\', ?, ?, ?, ?, ?, ? '
+                'WHERE ? <= 0 OR (SELECT COUNT(*) FROM jobs WHERE app = ? AND status = \'queued\') < ?',
+                (job_id, app, priority, method, path, query_string, json.dumps(headers), body, time.time(),
+                 max_queued, app, max_queued)).rowcount
+        if not inserted:
+            return None
+        return self.info(job_id)
+
+    def queued(self, app):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM jobs WHERE app = ? AND status = \'queued\'', (app,)).fetchone()[0]
+
+    def claim(self, app):
+        """取出 app 中优先级最高、最早提交的排队任务并标记为 running；没有时返回 None。"""
+        with self._lock:
+            while True:
+                row = self._conn.execute(
+                    'SELECT * FROM jobs WHERE app = ? AND status = \'queued\' ORDER BY priority DESC, created_at LIMIT 1',
+                    (app,)).fetchone()
+                if row is None:
+                    return None
+                started_at = time.time()
+                # 只有仍在排队时才能认领；被共用数据库的其他进程抢先认领时取下一个
+                claimed = self._conn.execute(
+                    'UPDATE jobs SET status = \'running\', started_at = ?, owner = ?, heartbeat_at = ? '
+                    'WHERE id = ? AND status = \'queued\'', (started_at, self.owner, started_at, row['id'])).rowcount
+                if claimed:
+                    break
+        return dict(row, status='running', started_at=started_at, owner=self.owner)
+
+    def finish(self, job_id, status, status_code=None, response_headers=None, result=None, error=None):
+        # 任务已被取消，或因心跳超时被重新排队时不再覆盖
+        with self._lock:
+            self._conn.execute(
+                'UPDATE jobs SET status = ?, finished_at = ?, status_code = ?, response_headers = ?, result = ?, '
+                'result_bytes = ?, error = ?, body = NULL WHERE id = ? AND status = \'running\' AND owner = ?',
+                (status, time.time(), status_code, json.dumps(response_headers) if response_headers is not None else None,
+                 result, len(result) if result else 0, error, job_id, self.owner))
+
+    def cancel(self, job_id):
+        """取消排队中或执行中的任务，返回取消前的状态（任务不存在时为 None）。"""
+        with self._lock:
+            row = self._conn.execute('SELECT status FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            if row is None:
+                return None
+            if row['status'] not in self.FINISHED:
+                self._conn.execute('UPDATE jobs SET status = \'cancelled\', finished_at = ?, body = NULL WHERE id = ?',
+                                   (time.time(), job_id))
+            return row['status']
+
+    def info(self, job_id):
+        with self._lock:
+            row = self._conn.execute(f'SELECT {", ".join(self.INFO_COLUMNS)} FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def result(self, job_id):
+        """返回 (status_code, response_headers, result)，任务不存在或尚未完成时返回 None。"""
+        with self._lock:
+            row = self._conn.execute('SELECT status_code, response_headers, result FROM jobs WHERE id = ? AND status IN '
+                                     '(\'succeeded\', \'failed\') AND status_code IS NOT NULL', (job_id,)).fetchone()
+        if row is None:
+            return None
+        return row['status_code'], json.loads(row['response_headers']), row['result'] or b''
+
+    def heartbeat(self):
+        """刷新本进程执行中任务的心跳时间。"""
+        with self._lock:
+            self._conn.execute('UPDATE jobs SET heartbeat_at = ? WHERE status = \'running\' AND owner = ?',
+                               (time.time(), self.owner))
+
+    def requeue_stale(self, stale_seconds):
+        """把心跳超过 stale_seconds 秒的执行中任务，以及所属进程在本机已退出的任务重新排队，返回涉及的应用名。"""
+        host = socket.gethostname()
+        with self._lock:
+            rows = self._conn.execute('SELECT id, app, owner, heartbeat_at FROM jobs WHERE status = \'running\'').fetchall()
+            stale = [row for row in rows if row['owner'] != self.owner and (
+                (row['heartbeat_at'] or 0) < time.time() - stale_seconds or _owner_exited(row['owner'], host))]
+            for row in stale:
+                self._conn.execute('UPDATE jobs SET status = \'queued\', started_at = NULL, owner = NULL, heartbeat_at = NULL '
+                                   'WHERE id = ? AND status = \'running\' AND owner IS ?', (row['id'], row['owner']))
+        return {row['app'] for row in stale}
+
+    def prune(self, ttl, max_bytes):
+        """删除超过保留时间的已完成任务；已完成结果的总大小超过 max_bytes 时从最早完成的开始删除。"""
+        with self._lock:
+            self._conn.execute('DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?', (time.time() - ttl,))
+            rows = self._conn.execute('SELECT id, result_bytes FROM jobs WHERE finished_at IS NOT NULL '
+                                      'ORDER BY finished_at DESC').fetchall()
+            total, expired = 0, []
+            for row in rows:
+                total += row['result_bytes']
+                if total > max_bytes:
+                    expired.append((row['id'],))
+            self._conn.executemany('DELETE FROM jobs WHERE id = ?', expired)
+
+    def stats(self):
+        with self._lock:
+            rows = self._conn.execute('SELECT app, status, COUNT(*) AS n, SUM(result_bytes) AS bytes FROM jobs '
+                                      'GROUP BY app, status').fetchall()
+        stats = {}
+        for row in rows:
+            stats.setdefault(row['app'], {})[row['status']] = row['n']
+        return {"apps": stats, "result_bytes": sum(row['bytes'] or 0 for row in rows)}
+
+
+class JobManager:
+    """把带 async=true 的应用请求转为后台任务：立即返回任务 ID，之后由各应用的任务循环按优先级重放原请求。
+
+    重放的请求经过 JobMiddleware 内层的完整中间件和路由，因此任何应用接口都可以异步调用；
+    每个应用同时执行 concurrency 个任务，结果保存到 JobStore，保留 ttl 秒，总大小不超过 max_result_mb。
+    每个应用排队中的任务不超过 max_queued 个（router 的 max_queued_jobs 属性可覆盖），超出时提交以 AdmissionRejected 拒绝，
+    Retry-After 按 admission 中该应用服务时间的滑动平均估算。
+    """
+    def __init__(self, routers, store=None, ttl=JOB_RESULT_TTL, max_result_mb=JOB_RESULT_MAX_MB, concurrency=JOB_CONCURRENCY,
+                 heartbeat_seconds=JOB_HEARTBEAT_SECONDS, stale_seconds=JOB_STALE_SECONDS, max_queued=JOB_MAX_QUEUED,
+                 admission=None):
+        self.apps = [router.app_name for router in routers]
+        self.max_queued = {
+            router.app_name: router.max_queued_jobs if router.max_queued_jobs is not None else max_queued
+            for router in routers
+        }
+        self.admission = admission
+        self.rejected = {name: 0 for name in self.apps}
+        self.store = store if store is not None else JobStore()
+        self.heartbeat_seconds = heartbeat_seconds
+        self.stale_seconds = stale_seconds
+        self.ttl = ttl
+        self.max_result_bytes = max_result_mb * 1024 * 1024
+        self.concurrency = concurrency
+        self.app = None  # 用于重放请求的内层 ASGI 应用
+        self._scope_template = {}
+        self._wakeup = {}
+        self._running = {}  # job id -> 正在重放该任务的 asyncio.Task
+        self._tasks = []
+
+    def start(self, app, scope):
+        """在事件循环中启动各应用的任务循环，由 JobMiddleware 在收到第一个 ASGI 事件时调用。"""
+        if self._tasks:
+            return
+        self.app = app
+        # 重放请求时沿用框架放入 scope 的对象（如 Starlette 应用本身）
+        self._scope_template = {key: scope[key] for key in ('app', 'state') if key in scope}
+        self.store.requeue_stale(self.stale_seconds)
+        loop = asyncio.get_running_loop()
+        for name in self.apps:
+            self._wakeup[name] = asyncio.Event()
+            self._tasks += [loop.create_task(self._run_loop(name)) for _ in range(self.concurrency)]
+        self._tasks.append(loop.create_task(self._prune_loop()))
+        self._tasks.append(loop.create_task(self._heartbeat_loop()))
+
+    async def check_capacity(self, app):
+        """排队中的任务已达上限时抛出 AdmissionRejected；在读取请求体之前调用，避免缓冲注定被拒绝的上传。"""
+        if self.max_queued[app] > 0 and await asyncio.to_thread(self.store.queued, app) >= self.max_queued[app]:
+            self._reject(app)
+
+    async def submit(self, app, method, path, query_string, headers, body, priority=0):
+        job = await asyncio.to_thread(self.store.add, app, priority, method, path, query_string, headers, body,
+                                      self.max_queued[app])
+        if job is None:
+            self._reject(app)
+        self._wakeup[app].set()
+        return job
+
+    def _reject(self, app):
+        self.rejected[app] += 1
+        JOBS_REJECTED.inc(app=app)
+        # 下一个排队任务开始执行、腾出位置大约需要一个服务时间除以同时执行的任务数
+        service = self.admission.service_seconds(app) if self.admission is not None else None
+        raise AdmissionRejected(app, max(1, math.ceil((service or 1.0) / self.concurrency)))
+
+    async def get(self, job_id):
+        return await asyncio.to_thread(self.store.info, job_id)
+
+    async def result(self, job_id):
+        return await asyncio.to_thread(self.store.result, job_id)
+
+    async def cancel(self, job_id):
+        previous = await asyncio.to_thread(self.store.cancel, job_id)
+        task = self._running.get(job_id)
+        if task is not None:
+            task.cancel()
+        return previous
+
+    async def stats(self):
+        stats = await asyncio.to_thread(self.store.stats)
+        return dict(stats, max_queued=self.max_queued, rejected=self.rejected)
+
+    async def _run_loop(self, name):
+        wakeup = self._wakeup[name]
+        while True:
+            # 先清除再查询，避免漏掉查询期间提交的任务
+            wakeup.clear()
+            job = await asyncio.to_thread(self.store.claim, name)
+            if job is None:
+                await wakeup.wait()
+                continue
+            JOB_QUEUE_WAIT.observe(job['started_at'] - job['created_at'], app=name)
+            task = asyncio.ensure_future(self._replay(job))
+            self._running[job['id']] = task
+            try:
+                await asyncio.wait([task])
+            finally:
+                self._running.pop(job['id'], None)
+            if task.cancelled():
+                JOBS_FINISHED.inc(app=name, status='cancelled')
+                continue
+            if task.exception() is not None:
+                status, finish = 'failed', dict(error=str(task.exception()))
+            else:
+                status_code, headers, body = task.result()
+                status = 'succeeded' if status_code < 400 else 'failed'
+                finish = dict(status_code=status_code, response_headers=headers, result=body)
+                if len(body) > self.max_result_bytes:
+                    status, finish = 'failed', dict(error=f"Result of {len(body)} bytes exceeds the job result limit")
+            await asyncio.to_thread(self.store.finish, job['id'], status, **finish)
+            JOBS_FINISHED.inc(app=name, status=status)
+            await asyncio.to_thread(self.store.prune, self.ttl, self.max_result_bytes)
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_seconds)
+            await asyncio.to_thread(self.store.heartbeat)
+            # 接手已退出的进程遗留的任务
+            for name in await asyncio.to_thread(self.store.requeue_stale, self.stale_seconds):
+                if name in self._wakeup:
+                    self._wakeup[name].set()
+
+    async def _prune_loop(self):
+        while True:
+            await asyncio.sleep(min(self.ttl, 60))
+            await asyncio.to_thread(self.store.prune, self.ttl, self.max_result_bytes)
+
+    async def _replay(self, job):
+        path = job['path']
+        scope = dict(self._scope_template, type='http', asgi={'version': '3.0'}, http_version='1.1', **{'aigchub.job': True},
+                     method=job['method'], scheme='http', path=path, raw_path=path.encode(), root_path='',
+                     query_string=job['query_string'], client=None, server=None,
+                     headers=[(k.encode('latin-1'), v.encode('latin-1')) for k, v in json.loads(job['headers'])])
+        body = job['body'] or b''
+        body_sent = False
+        done = asyncio.Event()
+        start, chunks = {}, []
+
+        async def receive():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {'type': 'http.request', 'body': body, 'more_body': False}
+            # 响应发送完之前不能报告断开，否则流式响应会被提前终止
+            await done.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                start.update(message)
+            elif message['type'] == 'http.response.body':
+                chunks.append(message.get('body', b''))
+                if not message.get('more_body', False):
+                    done.set()
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            done.set()
+        headers = [(k.decode('latin-1'), v.decode('latin-1')) for k, v in start.get('headers', [])]
+        return start.get('status', 500), headers, b''.join(chunks)
+
+
+async def _read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body', False):
+            return b''.join(chunks)
+
+
+class JobMiddleware:
+    """ASGI 中间件：应用接口的 POST 请求带 async=true 查询参数时，保存为后台任务并立即返回 202 和任务信息；
+    该应用排队中的任务已达上限时返回 429 和 Retry-After。
+
+    可选的 priority 查询参数（整数，越大越先执行）决定同一应用内的执行顺序；
+    之后通过 GET /jobs/{id} 查询状态，GET /jobs/{id}/result 取结果，DELETE /jobs/{id} 取消。
+    """
+    def __init__(self, app, jobs):
+        self.app = app
+        self.jobs = jobs
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] in ('http', 'lifespan'):
+            self.jobs.start(self.app, scope)
+        if scope['type'] != 'http' or scope['method'] != 'POST':
+            return await self.app(scope, receive, send)
+        params = parse_qsl(scope['query_string'].decode('latin-1'), keep_blank_values=True)
+        options = dict(params)
+        app_name = scope['path'].split('/', 2)[1]
+        if options.get('async', '').lower() not in ('1', 'true', 'yes') or app_name not in self.jobs.apps:
+            return await self.app(scope, receive, send)
+
+        try:
+            priority = int(options.get('priority', 0))
+        except ValueError:
+            response = JSONResponse(status_code=400, content={"detail": "priority must be an integer"})
+            return await response(scope, receive, send)
+        try:
+            await self.jobs.check_capacity(app_name)
+            body = await _read_body(receive)
+            if body is None:
+                return
+            query_string = urlencode([(k, v) for k, v in params if k not in ('async', 'priority')]).encode('latin-1')
+            headers = [(k.decode('latin-1'), v.decode('latin-1')) for k, v in scope['headers']]
+            job = await self.jobs.submit(app_name, scope['method'], scope['path'], query_string, headers, body, priority)
+        except AdmissionRejected as e:
+            response = JSONResponse(status_code=429, content={"message": str(e)},
+                                    headers={"Retry-After": str(e.retry_after)})
+            return await response(scope, receive, send)
+        response = JSONResponse(status_code=202, content=job, headers={"Location": f"/jobs/{job['id']}"})
+        await response(scope, receive, send)
 
 
 class BaseAPIRouter(APIRouter, ABC):
+    # 上游代码在初始化或推理时依赖相对于应用目录的工作目录时设为 True
+    requires_cwd = False
+    # 模型加载后占用的设备内存估计值（MB），供 ModelResidencyManager 计算预算
+    memory_mb = 0
+    # 同时处理的请求数和排队长度上限，None 时使用 ADMISSION_MAX_CONCURRENCY / ADMISSION_MAX_QUEUE
+    max_concurrency = None
+    max_queue = None
+    # 排队中的异步任务数上限，None 时使用 JOB_MAX_QUEUED
+    max_queued_jobs = None
+    # 模型所在的设备，启动预加载时同一设备上的应用按 STARTUP_PARALLEL_PER_DEVICE 限制并行
+    device_id = int(os.environ.get('DEVICE_ID', 0))
+
     def __init__(self, app_name: str):
         super().__init__()
         self.app_name = app_name
-        self.dir = f'./repo/{app_name}'
+        self.dir = os.path.join(REPO_DIR, app_name)
         if not os.path.exists(self.dir):
             print(f"******** ERROR *********\nApplication {app_name} not found. \nPlease check whether the app has been installed by init_app.sh.\n************************")
             raise NotImplementedError
         self.models = {}
         self.initialized = False
+        self.executor = AppExecutor(app_name, cwd=self.dir if self.requires_cwd else None)
+
+    def path(self, *parts):
+        """返回应用目录下资源的绝对路径。"""
+        return os.path.join(self.dir, *parts)
+
+    async def execute(self, func, *args, **kwargs):
+        """在本应用的工作线程中执行阻塞调用，返回其结果。"""
+        return await self.executor.run(func, *args, **kwargs)
+
+    async def execute_grouped(self, group, func, *args, **kwargs):
+        """同 execute，但同组（group 相等）的排队任务会尽量连续执行，见 AppExecutor。"""
+        return await self.executor.run_grouped(group, func, *args, **kwargs)
 
     @abstractmethod
     def init_app(self):
@@ -56,35 +1473,97 @@ class BaseAPIRouter(APIRouter, ABC):
     def destroy_app(self):
         pass
 
-from functools import wraps
+    async def warmup(self):
+        """init_app 之后执行一次代表性的推理，让首次调用的编译和内存分配在启动时完成；默认不做任何事。"""
+        pass
+
+class _AppImportFinder(importlib.abc.MetaPathFinder):
+    """按当前线程正在初始化的应用目录查找顶层模块，代替修改全局 sys.path。
+
+    排在 sys.meta_path 最后，与原先 sys.path.append 的优先级相同；并行初始化的各应用只能看到自己的目录。
+    """
+    def __init__(self):
+        self.local = threading.local()
+
+    def find_spec(self, fullname, path=None, target=None):
+        app_dir = getattr(self.local, 'dir', None)
+        if path is not None or app_dir is None:
+            return None
+        return importlib.machinery.PathFinder.find_spec(fullname, [app_dir])
+
+
+_app_import_finder = _AppImportFinder()
+sys.meta_path.append(_app_import_finder)
+_app_dirs = set()
+_app_name_locks = defaultdict(threading.Lock)
+_app_name_locks_guard = threading.Lock()
+
+
+def _top_level_names(app_dir):
+    """应用目录下可作为顶层模块导入的名字（包、目录和模块文件）。"""
+    names = set()
+    if not os.path.isdir(app_dir):
+        return names
+    suffixes = importlib.machinery.all_suffixes()
+    for entry in os.scandir(app_dir):
+        if entry.is_dir():
+            names.add(entry.name)
+        elif any(entry.name.endswith(suffix) for suffix in suffixes):
+            names.add(entry.name.partition('.')[0])
+    return {name for name in names if name.isidentifier()}
+
+
+def _module_in(module, app_dir):
+    location = getattr(module, '__file__', None) or next(iter(getattr(module, '__path__', None) or []), None)
+    return bool(location) and os.path.abspath(location).startswith(app_dir + os.sep)
+
+
+@contextmanager
+def app_imports(app_dir):
+    """在当前线程中以 app_dir 为顶层模块目录导入上游代码，用于 init_app 和请求中按需加载的 pipeline。
+
+    与其他应用同名的顶层模块不能同时存在于 sys.modules 中，因此有同名模块的应用依次初始化，
+    初始化期间暂时移出其他应用已导入的同名模块；结束后恢复它们，本应用的同名模块只由已创建的对象引用。
+    没有同名模块的应用仍并行初始化。
+    """
+    app_dir = os.path.abspath(app_dir)
+    names = _top_level_names(app_dir)
+    with _app_name_locks_guard:
+        _app_dirs.add(app_dir)
+        others = [d for d in _app_dirs if d != app_dir]
+        locks = [_app_name_locks[name] for name in sorted(names)]
+    for lock in locks:
+        lock.acquire()
+    hidden = {}
+    try:
+        for key in [key for key in list(sys.modules) if key.partition('.')[0] in names]:
+            if any(_module_in(sys.modules.get(key), d) for d in others):
+                hidden[key] = sys.modules.pop(key)
+        _app_import_finder.local.dir = app_dir
+        yield
+    finally:
+        _app_import_finder.local.dir = None
+        if hidden:
+            for key in [key for key in list(sys.modules) if key.partition('.')[0] in names]:
+                if _module_in(sys.modules.get(key), app_dir):
+                    sys.modules.pop(key, None)
+            sys.modules.update(hidden)
+        for lock in reversed(locks):
+            lock.release()
 
-def change_dir(new_dir):
-    def decorator(func):
-        @wraps(func)
-        async def wrapper(*args, **kwargs):
-            ori_dir = os.getcwd()
-            os.chdir(new_dir)
-            try:
-                result = await func(*args, **kwargs)
-            finally:
-                os.chdir(ori_dir)
-            return result
-        return wrapper
-    return decorator
 
-import sys
 def init_helper(new_dir):
+    """在应用的工作线程中执行 init_app，上游代码可直接导入应用目录下的顶层模块（见 app_imports）。
+
+    应用目录以 router.dir 为准，new_dir 仅为保持各应用的写法一致而保留。
+    """
     def decorator(func):
         @wraps(func)
-        async def wrapper(*args, **kwargs):
-            ori_dir = os.getcwd()
-            sys.path.append(os.path.join(ori_dir, new_dir))
-            os.chdir(new_dir)
-            try:
-                result = await func(*args, **kwargs)
-            finally:
-                os.chdir(ori_dir)
-                sys.path.remove(os.path.join(ori_dir, new_dir))
-            return result
+        async def wrapper(self, *args, **kwargs):
+            def run_init():
+                with app_imports(self.dir):
+                    # init_app 内部都是阻塞调用，放到工作线程中用独立的事件循环执行
+                    return asyncio.run(func(self, *args, **kwargs))
+            return await self.execute(run_init)
         return wrapper
-    return decorator
\ No newline at end of file
+    return decorator
@@ -1,22 +1,22 @@
 from pydantic import BaseModel, Field
 import base64
-from api.base_api import BaseAPIRouter, change_dir, init_helper
+from api.base_api import BaseAPIRouter, init_helper, metrics, ScratchDir, request_scratch
 import os, io
 from typing import Optional
-from fastapi import Response
-import soundfile as sf
-from pydub import AudioSegment
-import uuid
+from fastapi import Depends, Response
+import time
 from fastapi import File, Form, UploadFile
 
 
 app_name = "emotivoice"
+TTS_SPEED = metrics.histogram('aigchub_tts_audio_seconds_per_second', 'Seconds of synthesized audio per second of wall time.',
+                              (0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50))
 
-def convert(src_wav, tgt_wav, tone_color_converter, get_se, save_path="./temp/output.wav", encode_message=""):
+def convert(src_wav, tgt_wav, tone_color_converter, get_se, save_path="./temp/output.wav", encode_message="", processed_dir='processed'):
     try:
         # extract the tone color features of the source speaker and target speaker
-        source_se, _ = get_se(src_wav, tone_color_converter, target_dir='processed', vad=True)
-        target_se, _  = get_se(tgt_wav, tone_color_converter, target_dir='processed', vad=True)
+        source_se, _ = get_se(src_wav, tone_color_converter, target_dir=processed_dir, vad=True)
+        target_se, _  = get_se(tgt_wav, tone_color_converter, target_dir=processed_dir, vad=True)
     except Exception as e:
         return {"error": f"Failed to extract speaker embedding: {e}"}
     tone_color_converter.convert(
@@ -29,6 +29,8 @@ def convert(src_wav, tgt_wav, tone_color_converter, get_se, save_path="./temp/ou
 
 class AppInitializationRouter(BaseAPIRouter):
     dir = f"repo/{app_name}"
+    memory_mb = 1024  # 估计值
+    requires_cwd = True  # demo_page 与 tone_color_conversion 内部按相对路径读取配置和写中间文件
     @init_helper(dir)
     async def init_app(self):
         from repo.emotivoice.demo_page import get_models
@@ -42,39 +44,37 @@ class AppInitializationRouter(BaseAPIRouter):
         return {"message": f"应用 {self.app_name} 已成功初始化。"}
     
     async def destroy_app(self):
-        del models, tone_color_converter, g2p, lexicon, self.models
+        del self.models
 
 router = AppInitializationRouter(app_name=app_name)
 
 
 ### 音色转换；兼容openai api，audio/translation
 @router.post("/v1/audio/translation")
-@change_dir(router.dir)
 async def voice_changer(
     file: UploadFile = File(...),
-    ref_file: UploadFile = File(...) # 比 OpenAI 多一个参数    
+    ref_file: UploadFile = File(...), # 比 OpenAI 多一个参数    
+    scratch: ScratchDir = Depends(request_scratch),
 ):
     from repo.emotivoice.tone_color_conversion import get_se
-    import aiofiles
 
-    src_wav = f"/data/tmpdir/aigchub/{file.filename}"
-    os.makedirs(os.path.dirname(src_wav), exist_ok=True)
-    async with aiofiles.open(src_wav, "wb") as buffer:
-        data = await file.read()
-        await buffer.write(data)
-    
-    tgt_wav = f"/data/tmpdir/aigchub/{ref_file.filename}"
-    os.makedirs(os.path.dirname(tgt_wav), exist_ok=True)
-    async with aiofiles.open(tgt_wav, "wb") as buffer:
-        data = await ref_file.read()
-        await buffer.write(data)
-
-    save_path = convert(src_wav=src_wav, tgt_wav=tgt_wav, tone_color_converter=router.models['tone_color_converter'], get_se=get_se, encode_message='Airbox')
-    if isinstance(save_path, dict):
-        return {"text": save_path['error'], 'info': 'error message'}
-
-    with open(save_path, 'rb') as file:
-        audio_data = file.read()
+    src_data = await file.read()
+    tgt_data = await ref_file.read()
+
+    def run_convert():
+        # 两个文件分别加前缀，避免同名上传互相覆盖
+        src_wav = scratch.write(f"src_{file.filename}", src_data)
+        tgt_wav = scratch.write(f"ref_{ref_file.filename}", tgt_data)
+        save_path = convert(src_wav=src_wav, tgt_wav=tgt_wav, tone_color_converter=router.models['tone_color_converter'], get_se=get_se,
+                            save_path=scratch.path("output.wav"), encode_message='Airbox', processed_dir=scratch.path("processed"))
+        if isinstance(save_path, dict):
+            return save_path
+        with open(save_path, 'rb') as file:
+            return file.read()
+
+    audio_data = await router.execute(run_convert)
+    if isinstance(audio_data, dict):
+        return {"text": audio_data['error'], 'info': 'error message'}
     audio_base64 = base64.b64encode(audio_data).decode()
     return {"text": audio_base64, 'info': 'text is the base64 encoded audio'}
 
@@ -95,31 +95,41 @@ class TTSRequest(BaseModel):
     speed: Optional[float] = Field(1.0, description="（形式参数无意义）")
 
 @router.post("/v1/audio/speech")
-@change_dir(router.dir)
-async def text_to_speech(request: TTSRequest):    
+async def text_to_speech(request: TTSRequest, scratch: ScratchDir = Depends(request_scratch)):    
     from repo.emotivoice.demo_page import tts
     from repo.emotivoice.tone_color_conversion import get_se
 
-    _name = f'./temp/{str(uuid.uuid4())}.wav'
-    src_wav = tts(request.input, request.emotion, request.voice, _name,
-                  router.models['models'], router.models['g2p'], router.models['lexicon'])
-    save_path = _name
-    if request.audio_path and os.path.exists(request.audio_path):
-        save_path = convert(src_wav=src_wav, tgt_wav=request.audio_path, tone_color_converter=router.models['tone_color_converter'], get_se=get_se, encode_message='Airbox')
-        if isinstance(save_path, dict):
-            return {"text": save_path['error'], 'info': 'error message'}
-    np_audio, sr = sf.read(save_path)
-    wav_buffer = io.BytesIO()
-    sf.write(file=wav_buffer, data=np_audio, samplerate=sr, format='WAV')
-    buffer = wav_buffer
     response_format = request.response_format
-    if response_format != 'wav':
-        wav_audio = AudioSegment.from_wav(wav_buffer)
-        wav_audio.frame_rate=sr
-        buffer = io.BytesIO()
-        wav_audio.export(buffer, format=response_format)
 
-    return Response(content=buffer.getvalue(), media_type=f"audio/{response_format}")
+    def run_tts():
+        import soundfile as sf
+        start = time.perf_counter()
+        _name = scratch.path('tts.wav')
+        src_wav = tts(request.input, request.emotion, request.voice, _name,
+                      router.models['models'], router.models['g2p'], router.models['lexicon'])
+        save_path = _name
+        if request.audio_path and os.path.exists(request.audio_path):
+            save_path = convert(src_wav=src_wav, tgt_wav=request.audio_path, tone_color_converter=router.models['tone_color_converter'], get_se=get_se,
+                                save_path=scratch.path('output.wav'), encode_message='Airbox', processed_dir=scratch.path('processed'))
+            if isinstance(save_path, dict):
+                return save_path
+        np_audio, sr = sf.read(save_path)
+        TTS_SPEED.observe(len(np_audio) / sr / (time.perf_counter() - start), app=app_name)
+        wav_buffer = io.BytesIO()
+        sf.write(file=wav_buffer, data=np_audio, samplerate=sr, format='WAV')
+        buffer = wav_buffer
+        if response_format != 'wav':
+            from pydub import AudioSegment
+            wav_audio = AudioSegment.from_wav(wav_buffer)
+            wav_audio.frame_rate=sr
+            buffer = io.BytesIO()
+            wav_audio.export(buffer, format=response_format)
+        return buffer.getvalue()
+
+    audio_data = await router.execute(run_tts)
+    if isinstance(audio_data, dict):
+        return {"text": audio_data['error'], 'info': 'error message'}
+    return Response(content=audio_data, media_type=f"audio/{response_format}")
 
 # 测试用指令
 # curl http://0.0.0.0:8000/emotivoice/v1/audio/speech -H "Content-Type: application/json" \
@@ -1,11 +1,7 @@
-from fastapi import File, UploadFile
-import base64
-import os
-from api.base_api import BaseAPIRouter, change_dir, init_helper
+from fastapi import Depends, File, UploadFile
+from api.base_api import BaseAPIRouter, init_helper, ScratchDir, request_scratch, temp_artifacts
 from fastapi.responses import JSONResponse
 from fastapi.encoders import jsonable_encoder
-import aiofiles
-import soundfile as sf
 import logging
 import numpy as np
 from typing import Optional
@@ -35,13 +31,14 @@ def fm_main(router, audio_path):
 
 class AppInitializationRouter(BaseAPIRouter):
     dir = f"repo/{app_name}"
+    memory_mb = 4375
+    requires_cwd = True  # src_sail 的模型与 hubert 可能按相对路径读取配置和权重，未经核实前在应用目录下执行
     @init_helper(dir)
     async def init_app(self):
         from repo.flowmirror.src_sail.modeling_flow_mirror_bmodel import CNHubert, FlowmirrorForConditionalGeneration, Config
-        flomirror_dir = "repo/flowmirror"
-        self.hubert = CNHubert("models")
-        self.model = FlowmirrorForConditionalGeneration(model_dir = "models", config=Config("configs/config.json"), device_id=0)
-        self.speaker_embedding = np.load("models/speaker_embedding.npz")['speaker_embedding_1']
+        self.hubert = CNHubert(self.path("models"))
+        self.model = FlowmirrorForConditionalGeneration(model_dir = self.path("models"), config=Config(self.path("configs/config.json")), device_id=0)
+        self.speaker_embedding = np.load(self.path("models/speaker_embedding.npz"))['speaker_embedding_1']
         return {"message": f"应用 {self.app_name} 已成功初始化。"}
     
     async def destroy_app(self):
@@ -52,22 +49,23 @@ router = AppInitializationRouter(app_name=app_name)
 
 ### 语音对话；兼容openai api，audio/translation
 @router.post("/v1/audio/translation")
-@change_dir(router.dir)
 async def gptsovits_api(
-    file: UploadFile = File(...)
+    file: UploadFile = File(...),
+    scratch: ScratchDir = Depends(request_scratch),
 ):  
     try:
-        file_path = f"/data/tmpdir/aigchub/{file.filename}"
-        os.makedirs(os.path.dirname(file_path), exist_ok=True)
-        async with aiofiles.open(file_path, "wb") as buffer:
-            data = await file.read()
-            await buffer.write(data)
+        data = await file.read()
 
-        answer = fm_main(router, file_path)
+        def run_flowmirror():
+            import soundfile as sf
+            file_path = scratch.write(file.filename, data)
+            answer = fm_main(router, file_path)
+            # 返回给客户端的是文件路径，需在请求结束后保留，由 temp_artifacts 按配额清理
+            audio_path = temp_artifacts.output_path(".wav", answer.nbytes)
+            sf.write(audio_path, answer, 16000)
+            return audio_path
 
-        os.remove(file_path)
-        audio_path = "/data/tmpdir/aigchub/flowmirror_output.wav"
-        sf.write(audio_path, answer, 16000)
+        audio_path = await router.execute(run_flowmirror)
         logging.info("语音回答已生成")
         content = {"text": audio_path, 'info': 'text is the answer audio path'}
         return content
@@ -1,19 +1,22 @@
 from pydantic import BaseModel, Field
 import os, io
-from pydub import AudioSegment
 from fastapi import Response
-from api.base_api import BaseAPIRouter, change_dir, init_helper
+from api.base_api import BaseAPIRouter, init_helper, metrics
 from fastapi.responses import JSONResponse
 from fastapi.encoders import jsonable_encoder
-import soundfile as sf
 import logging
+import time
 from typing import Optional
 
 app_name = "gptsovits"
+TTS_SPEED = metrics.histogram('aigchub_tts_audio_seconds_per_second', 'Seconds of synthesized audio per second of wall time.',
+                              (0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50))
 logging.basicConfig(level=logging.INFO)
 
 class AppInitializationRouter(BaseAPIRouter):
     dir = f"repo/{app_name}"
+    memory_mb = 2203
+    requires_cwd = True  # web_app 的文本前端与 g2pw 可能按相对路径读取词典和配置，未经核实前在应用目录下执行
     @init_helper(dir)
     async def init_app(self):
         from repo.gptsovits.web_app import GptSovits_long, gptsovits_dir
@@ -41,24 +44,30 @@ class TTSRequest(BaseModel):
 
 
 @router.post("/v1/audio/speech")
-@change_dir(router.dir)
-
 async def gptsovits(request: TTSRequest):  
     try:
-        # 调用 gptsovits_long 函数
-        sr, np_audio = router.gptsovits_long(request.audio_path, request.audio_content, request.input)
-
-        wav_buffer = io.BytesIO()
-        sf.write(file=wav_buffer, data=np_audio, samplerate=sr, format='WAV')
-        buffer = wav_buffer
         response_format = request.response_format
-        if response_format != 'wav':
-            wav_audio = AudioSegment.from_wav(wav_buffer)
-            wav_audio.frame_rate=sr
-            buffer = io.BytesIO()
-            wav_audio.export(buffer, format=response_format)
 
-        return Response(content=buffer.getvalue(), media_type=f"audio/{response_format}")
+        def run_tts():
+            import soundfile as sf
+            # 调用 gptsovits_long 函数
+            start = time.perf_counter()
+            sr, np_audio = router.gptsovits_long(request.audio_path, request.audio_content, request.input)
+            TTS_SPEED.observe(len(np_audio) / sr / (time.perf_counter() - start), app=app_name)
+
+            wav_buffer = io.BytesIO()
+            sf.write(file=wav_buffer, data=np_audio, samplerate=sr, format='WAV')
+            buffer = wav_buffer
+            if response_format != 'wav':
+                from pydub import AudioSegment
+                wav_audio = AudioSegment.from_wav(wav_buffer)
+                wav_audio.frame_rate=sr
+                buffer = io.BytesIO()
+                wav_audio.export(buffer, format=response_format)
+            return buffer.getvalue()
+
+        audio_data = await router.execute(run_tts)
+        return Response(content=audio_data, media_type=f"audio/{response_format}")
 
     except Exception as e:
         return {"error": str(e), "info": "处理过程中出现错误"}
\ No newline at end of file
@@ -1,9 +1,9 @@
-from fastapi import File, Form, UploadFile
+from fastapi import Depends, File, Form, UploadFile
 import base64
 from io import BytesIO
 from PIL import Image
 import numpy as np
-from api.base_api import BaseAPIRouter, change_dir, init_helper
+from api.base_api import BaseAPIRouter, init_helper, ScratchDir, request_scratch
 from fastapi.responses import JSONResponse
 from fastapi.encoders import jsonable_encoder
 from typing import Optional
@@ -12,6 +12,8 @@ app_name = "img2txt"
 
 class AppInitializationRouter(BaseAPIRouter):
     dir = f"repo/{app_name}"
+    memory_mb = 1024  # 估计值
+    requires_cwd = True  # ImageSpeakingPipeline 内部按相对路径加载模型
     @init_helper(dir)
     async def init_app(self):
         from repo.img2txt.img_speaking_pipeline import ImageSpeakingPipeline as ISPipeline
@@ -26,15 +28,20 @@ router = AppInitializationRouter(app_name=app_name)
 
 ### img2txt；兼容openai api，image/variations
 @router.post("/v1/images/variations")
-@change_dir(router.dir)
 async def get_img_caption(
     image: UploadFile = File(...),
     num_of_description: Optional[int] = Form(1),
+    scratch: ScratchDir = Depends(request_scratch),
 ):
     ori_image_bytes = await image.read()
-    image_bytes = BytesIO(ori_image_bytes)
-    Image.open(image_bytes).save("temp.jpg")
-    captions, tags = router.models['pipeline']("temp.jpg", num_return_sequences=num_of_description)
+
+    def run_caption():
+        image_bytes = BytesIO(ori_image_bytes)
+        temp_path = scratch.path("image.jpg")
+        Image.open(image_bytes).save(temp_path)
+        return router.models['pipeline'](temp_path, num_return_sequences=num_of_description)
+
+    captions, tags = await router.execute(run_caption)
     content = {
                 "created": 1589478378, "captions": captions, "tags": tags,
                 "data": []
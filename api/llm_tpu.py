@@ -1,18 +1,30 @@
-from fastapi import Form
 from fastapi.responses import JSONResponse, StreamingResponse
-from api.base_api import BaseAPIRouter, change_dir, init_helper
-from typing import Optional
+from api.base_api import BaseAPIRouter, app_imports, init_helper, metrics, temp_artifacts
 import argparse
+import gc
+import importlib
 import os
 import re
+import subprocess
 import json
 from pydantic import BaseModel, Field
 from difflib import get_close_matches
 import base64
 from io import BytesIO
 from PIL import Image
+from collections import OrderedDict, deque
+import asyncio
+import threading
+import time
 
 app_name = "llm_tpu"
+LLM_MAX_RESIDENT = int(os.environ.get('LLM_MAX_RESIDENT', 1))
+
+TOKENS_PER_SECOND_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+LLM_TTFT = metrics.histogram('aigchub_llm_time_to_first_token_seconds', 'Time from request submission to the first generated token.')
+LLM_PREFILL_TPS = metrics.histogram('aigchub_llm_prefill_tokens_per_second', 'Prefill throughput per request.', TOKENS_PER_SECOND_BUCKETS)
+LLM_DECODE_TPS = metrics.histogram('aigchub_llm_decode_tokens_per_second', 'Decode throughput per request.', TOKENS_PER_SECOND_BUCKETS)
+LLM_QUEUE_DEPTH = metrics.gauge('aigchub_llm_queue_depth', 'Chat requests waiting for their pipeline.')
 
 def match_model(model_name, patterns):
     model_name = re.sub(r'\W', '', model_name.lower().replace('_', ''))
@@ -22,28 +34,358 @@ def match_model(model_name, patterns):
             return x
     return None
 
-class AppInitializationRouter(BaseAPIRouter):
-    dir = f"repo/{app_name}"
-    @init_helper(dir)
-    async def init_app(self):
-        import importlib
+def fetch_image(image_data, scratch):
+    if image_data.startswith("data:"):
+        base64_data = image_data.split(",")[1]  # 去掉前缀
+        image_bytes = base64.b64decode(base64_data)  # 解码
+        image = Image.open(BytesIO(image_bytes))  # 读取图片
+        image_path = scratch.path("image.png")
+        image.save(image_path, format='PNG')
+        return image_path
+    else:
+        image_path = scratch.path(image_data.split('/')[-1])
+        subprocess.run(["wget", image_data, "-O", image_path])
+        return image_path
 
-        self.models = {}
-        self.models_list = os.listdir("llm_bmodels")
-        tokenizer_dict = {}
+class IncrementalDetokenizer:
+    """流式输出的增量解码，做法与 vLLM/TGI 相同。
+
+    每步只解码 prefix_offset 之后的少量 token，与上一步的解码结果比较得到新增文本；
+    结尾是不完整的 UTF-8 序列（解码出 �）时暂不输出，等待后续 token 补全。
+    prefix_offset 之前保留一段已输出的 token 作为上下文，使 sentencepiece 等分词器
+    对词首空格的处理与整段解码一致。
+    """
+    def __init__(self, tokenizer, skip_special_tokens=True):
+        self.tokenizer = tokenizer
+        self.skip_special_tokens = skip_special_tokens
+        self.tokens = []
+        self.prefix_offset = 0
+        self.read_offset = 0
+
+    def _decode(self, tokens):
+        return self.tokenizer.decode(tokens, skip_special_tokens=self.skip_special_tokens)
+
+    def push(self, token):
+        """加入一个 token，返回可以确定输出的新增文本（可能为空）。"""
+        self.tokens.append(token)
+        prefix_text = self._decode(self.tokens[self.prefix_offset:self.read_offset])
+        new_text = self._decode(self.tokens[self.prefix_offset:])
+        if len(new_text) > len(prefix_text) and not new_text.endswith("�"):
+            self.prefix_offset = self.read_offset
+            self.read_offset = len(self.tokens)
+            return new_text[len(prefix_text):]
+        return ""
+
+    def flush(self):
+        """生成结束时输出剩余的文本。"""
+        prefix_text = self._decode(self.tokens[self.prefix_offset:self.read_offset])
+        new_text = self._decode(self.tokens[self.prefix_offset:])
+        self.prefix_offset = self.read_offset = len(self.tokens)
+        return new_text[len(prefix_text):]
+
+
+class ChatSession:
+    """一次对话请求在调度器中的状态，同时作为 token 的异步迭代器。"""
+    _DONE = object()
+
+    def __init__(self, model_name, model, prefill, loop, on_done=None):
+        self.model_name = model_name
+        self.model = model
+        self.prefill = prefill  # 在调度线程中执行，返回 (first_token, eos_list)
+        self.on_done = on_done  # 会话结束后在调度线程中调用
+        self.loop = loop
+        self.queue = asyncio.Queue()
+        self.eos = None
+        self.cancelled = False
+        self.submit_time = time.time()
+        self.start_time = None
+        self.ttft = None
+        self.last_token = None
+        self.decode_steps = 0
+
+    def put(self, item):
+        try:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, item)
+        except RuntimeError:
+            # 事件循环已关闭，请求方不再需要结果
+            self.cancelled = True
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            item = await self.queue.get()
+        except BaseException:
+            self.cancelled = True
+            raise
+        if item is self._DONE:
+            raise StopAsyncIteration
+        if isinstance(item, BaseException):
+            raise item
+        return item
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class PrefixCache:
+    """记录每个 pipeline 的 KV cache 中已有的 token，新请求以其为前缀时只 prefill 新增的部分。
+
+    增量 prefill 要求后端提供 forward_append(tokens)，即在现有 KV cache 之后继续 prefill
+    并返回下一个 token；不支持或前缀不一致时回退到 forward_first 全量 prefill。
+    只在调度线程中读写。
+    """
+    def __init__(self):
+        self.kv_tokens = {}  # model_name -> KV cache 中的 token 序列
+        self.hits = 0
+        self.misses = 0
+        self.prefill_tokens = 0
+        self.saved_tokens = 0
+        self.last_prefill_tokens = None  # 最近一次实际 prefill 的 token 数，供调度器统计吞吐
+
+    def prefill(self, model_name, model, tokens):
+        tokens = list(tokens)
+        cached = self.kv_tokens.pop(model_name, None)
+        forward_append = getattr(model, 'forward_append', None)
+        if forward_append is not None and cached and len(cached) < len(tokens) and tokens[:len(cached)] == cached:
+            try:
+                token = forward_append(tokens[len(cached):])
+            except Exception as e:
+                print(f"Incremental prefill failed on {model_name}, falling back to full prefill: {e}")
+            else:
+                self.hits += 1
+                self.saved_tokens += len(cached)
+                self.prefill_tokens += len(tokens) - len(cached)
+                self.last_prefill_tokens = len(tokens) - len(cached)
+                self.kv_tokens[model_name] = tokens
+                return token
+        token = model.forward_first(tokens)
+        self.misses += 1
+        self.prefill_tokens += len(tokens)
+        self.last_prefill_tokens = len(tokens)
+        self.kv_tokens[model_name] = tokens
+        return token
+
+    def extend(self, model_name, token):
+        # forward_next 把上一步输出的 token 写入了 KV cache
+        if model_name in self.kv_tokens:
+            self.kv_tokens[model_name].append(token)
+
+    def invalidate(self, model_name):
+        self.kv_tokens.pop(model_name, None)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else None,
+            "prefill_tokens": self.prefill_tokens,
+            "saved_tokens": self.saved_tokens,
+        }
+
+
+class LLMScheduler:
+    """按模型排队的 LLM 请求调度器。
+
+    同一个 pipeline 只有一份 KV cache，其上的会话按到达顺序串行执行；
+    不同 pipeline 的活跃会话在调度线程中按 decode step 轮转，交替推进。
+    """
+    def __init__(self, ttft_window=100):
+        self._cond = threading.Condition()
+        self._pending = {}  # model_name -> deque[ChatSession]
+        self._active = {}   # model_name -> ChatSession
+        self._thread = None
+        self.ttft_history = deque(maxlen=ttft_window)
+        self.completed = 0
+        self.prefix_cache = PrefixCache()
+
+    def submit(self, model_name, model, prefill, on_done=None):
+        session = ChatSession(model_name, model, prefill, asyncio.get_running_loop(), on_done)
+        with self._cond:
+            pending = self._pending.setdefault(model_name, deque())
+            pending.append(session)
+            LLM_QUEUE_DEPTH.set(len(pending), model=model_name)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="llm-scheduler", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return session
+
+    def queue_depth(self, model_name=None):
+        with self._cond:
+            if model_name is not None:
+                return len(self._pending.get(model_name, ()))
+            return sum(len(q) for q in self._pending.values())
+
+    def stats(self):
+        with self._cond:
+            queue_depth = {name: len(q) for name, q in self._pending.items() if q}
+            active = list(self._active.keys())
+            ttfts = list(self.ttft_history)
+        return {
+            "queue_depth": queue_depth,
+            "active": active,
+            "completed": self.completed,
+            "prefix_cache": self.prefix_cache.stats(),
+            "ttft": {
+                "last": ttfts[-1] if ttfts else None,
+                "avg": sum(ttfts) / len(ttfts) if ttfts else None,
+                "max": max(ttfts) if ttfts else None,
+            },
+        }
+
+    def _promote(self):
+        # 调用方需持有 self._cond；每个 pipeline 空闲时取出下一个排队会话
+        for name, pending in self._pending.items():
+            if name not in self._active and pending:
+                self._active[name] = pending.popleft()
+                LLM_QUEUE_DEPTH.set(len(pending), model=name)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._promote()
+                while not self._active:
+                    self._cond.wait()
+                    self._promote()
+                sessions = list(self._active.values())
+            for session in sessions:
+                if not self._step(session):
+                    with self._cond:
+                        del self._active[session.model_name]
+                        self.completed += 1
+                    if session.decode_steps:
+                        decode_seconds = time.time() - session.submit_time - session.ttft
+                        LLM_DECODE_TPS.observe(session.decode_steps / max(decode_seconds, 1e-6), model=session.model_name)
+                    if session.on_done is not None:
+                        session.on_done()
+                    session.put(ChatSession._DONE)
+
+    def _step(self, session):
+        """推进一个会话一步，返回该会话是否仍需继续。"""
+        if session.cancelled:
+            return False
+        model = session.model
+        try:
+            if session.start_time is None:
+                session.start_time = time.time()
+                self.prefix_cache.last_prefill_tokens = None
+                token, session.eos = session.prefill()
+                prefill_seconds = time.time() - session.start_time
+                prefill_tokens = self.prefix_cache.last_prefill_tokens or model.token_length
+                session.ttft = time.time() - session.submit_time
+                self.ttft_history.append(session.ttft)
+                LLM_TTFT.observe(session.ttft, model=session.model_name)
+                LLM_PREFILL_TPS.observe(prefill_tokens / max(prefill_seconds, 1e-6), model=session.model_name)
+            else:
+                token = model.forward_next()
+                session.decode_steps += 1
+                self.prefix_cache.extend(session.model_name, session.last_token)
+        except Exception as e:
+            self.prefix_cache.invalidate(session.model_name)
+            session.put(e)
+            return False
+        session.last_token = token
+        if token in session.eos or model.token_length >= model.SEQLEN:
+            return False
+        session.put(token)
+        return True
 
-        for root, dirs, files in os.walk('./llm_models'):
+
+def parse_seq_len(model_name, default=512):
+    match = re.search(r'seq(\d+)', model_name)
+    return int(match.group(1)) if match else default
+
+
+class LLMModelRegistry:
+    """索引 llm_bmodels 下的 bmodel 与 llm_models 下的 tokenizer，pipeline 在首次被请求时才构建。
+
+    同时驻留的 pipeline 不超过 max_resident 个，超出时按 LRU 释放未被请求占用的 pipeline。
+    get()/release() 需成对调用，get() 会阻塞加载，应在 router 的工作线程中执行。
+    """
+    def __init__(self, root, max_resident=LLM_MAX_RESIDENT, on_unload=None):
+        self.root = root
+        self.max_resident = max_resident
+        self.on_unload = on_unload
+        self.entries = {}  # bmodel 文件名 -> 元数据
+        self.pipelines = OrderedDict()  # bmodel 文件名 -> pipeline，最近使用的在末尾
+        self._pins = {}
+        self._lock = threading.RLock()  # 串行化加载与释放
+        self._pin_lock = threading.Condition()  # 会话结束、解除占用时通知 clear()
+        self.loads = 0
+        self.evictions = 0
+
+    def scan(self):
+        tokenizer_dict = {}
+        for root, dirs, files in os.walk(os.path.join(self.root, 'llm_models')):
             if 'token_config' in dirs:
-                full_path = os.path.join(root, 'token_config')
-                # 分割路径
-                parts = root.split(os.sep)
-                # 假设模型目录总是位于 './models' 目录下的第一级子目录
-                if len(parts) > 2 and parts[1] == 'models':
-                    model_name = parts[2]
-                else:
-                    model_name = os.path.basename(root)
-                tokenizer_dict[model_name] = full_path
+                # token_config 所在目录名即模型系列名，与 llm_models 下的 python 包名一致
+                tokenizer_dict[os.path.basename(root)] = os.path.join(root, 'token_config')
+        families = list(tokenizer_dict.keys())
+
+        entries = {}
+        bmodel_dir = os.path.join(self.root, 'llm_bmodels')
+        for model_name in sorted(os.listdir(bmodel_dir)):
+            id = match_model(model_name, families)
+            if id is None:
+                print(f"Model {model_name} does not match any available model.")
+                continue
+            model_path = os.path.join(bmodel_dir, model_name)
+            entries[model_name] = {
+                "family": families[id],
+                "seq_len": parse_seq_len(model_name),
+                "size": os.path.getsize(model_path),
+                "model_path": model_path,
+                "tokenizer_path": tokenizer_dict[families[id]],
+            }
+        self.entries = entries
 
+    def resolve(self, requested):
+        best_match = get_close_matches(requested, list(self.entries), n=1, cutoff=0.0)
+        if not best_match:
+            raise KeyError(f"No LLM bmodel available for {requested}")
+        return best_match[0]
+
+    def get(self, model_name):
+        with self._lock:
+            if model_name in self.pipelines:
+                self.pipelines.move_to_end(model_name)
+            else:
+                self._evict_for_new()
+                self.pipelines[model_name] = self._build(self.entries[model_name])
+                self.loads += 1
+            with self._pin_lock:
+                self._pins[model_name] = self._pins.get(model_name, 0) + 1
+            return self.pipelines[model_name]
+
+    def release(self, model_name):
+        with self._pin_lock:
+            self._pins[model_name] -= 1
+            self._pin_lock.notify_all()
+
+    def _evict_for_new(self):
+        while len(self.pipelines) >= self.max_resident:
+            with self._pin_lock:
+                victim = next((name for name in self.pipelines if not self._pins.get(name)), None)
+            if victim is None:
+                print(f"All {len(self.pipelines)} resident LLMs are busy, loading beyond LLM_MAX_RESIDENT.")
+                return
+            self._unload(victim)
+            self.evictions += 1
+
+    def _unload(self, model_name):
+        slm = self.pipelines.pop(model_name)
+        deinit = getattr(slm.model, 'deinit', None)
+        if deinit is not None:
+            deinit()
+        del slm
+        gc.collect()
+        if self.on_unload is not None:
+            self.on_unload(model_name)
+
+    def _build(self, entry):
         args = argparse.Namespace(
             devid='0',
             temperature=1.0,
@@ -54,128 +396,183 @@ class AppInitializationRouter(BaseAPIRouter):
             generation_mode="greedy",
             prompt_mode="prompted",
             enable_history=False,
-            lib_path=''
+            lib_path='',
+            model_path=entry["model_path"],
+            tokenizer_path=entry["tokenizer_path"],
         )
+        family = entry["family"]
+        # 与 init_app 相同，只在当前线程中从应用目录导入，不修改全局 sys.path
+        with app_imports(self.root):
+            module = importlib.import_module(f"llm_models.{family}.python_demo.pipeline")
+        model_class = getattr(module, family)
+        return model_class(args)
 
-        mm = list(tokenizer_dict.keys())
-        nn = list(tokenizer_dict.values())
+    def clear(self):
+        """释放全部 pipeline；仍被会话占用的，等调度线程结束这些会话后再释放。"""
+        with self._lock:
+            with self._pin_lock:
+                self._pin_lock.wait_for(lambda: not any(self._pins.get(name) for name in self.pipelines))
+            for model_name in list(self.pipelines):
+                self._unload(model_name)
 
-        for model_name in self.models_list:
-            id = match_model(model_name, mm)
-            if id is None:
-                print(f"Model {model_name} does not match any available model.")
-                continue
-            tokenizer_path = nn[id]
-            args.model_path = f"llm_bmodels/{model_name}"
-            args.tokenizer_path = tokenizer_path
+    def largest_mb(self, n):
+        sizes = sorted((entry["size"] for entry in self.entries.values()), reverse=True)
+        return sum(sizes[:n]) // (1024 * 1024)
 
-            module_name = f"llm_models.{mm[id]}.python_demo.pipeline"
-            module = importlib.import_module(module_name)
+    # 以下只读方法在事件循环中调用，不等待可能耗时很久的加载锁
+    def list_models(self):
+        resident = set(self.pipelines)
+        return [
+            {"id": name, "object": "model", "family": entry["family"], "seq_len": entry["seq_len"],
+             "size": entry["size"], "loaded": name in resident}
+            for name, entry in self.entries.items()
+        ]
 
-            model_class = getattr(module, mm[id])
+    def stats(self):
+        return {
+            "resident": list(self.pipelines),
+            "max_resident": self.max_resident,
+            "loads": self.loads,
+            "evictions": self.evictions,
+        }
 
-            self.models[f"{model_name}"] = model_class(args)
 
+class AppInitializationRouter(BaseAPIRouter):
+    dir = f"repo/{app_name}"
+    @init_helper(dir)
+    async def init_app(self):
+        # 只建立索引，pipeline 在首次被请求时由 registry 构建
+        self.registry = LLMModelRegistry(self.dir, on_unload=scheduler.prefix_cache.invalidate)
+        self.registry.scan()
         return {"message": f"应用 {self.app_name} 已成功初始化。"}
-    
+
+    @property
+    def memory_mb(self):
+        # 按同时驻留上限内最大的几个 bmodel 估计设备内存占用
+        registry = getattr(self, 'registry', None)
+        if registry is None or not registry.entries:
+            return 3000  # 视加载的 bmodel 在 1.5-5 GB 之间
+        return registry.largest_mb(registry.max_resident)
+
     async def destroy_app(self):
-        del self.models, self.models_list
+        # 在工作线程中释放，等正在使用 pipeline 的加载或调度步骤结束
+        await self.execute(self.registry.clear)
+        del self.registry
 
 router = AppInitializationRouter(app_name=app_name)
+scheduler = LLMScheduler()
 
 class ChatRequest(BaseModel):
     model: str = Field("minicpm3-4b_int4_seq512_1dev.bmodel", description="bmodel file name")
     messages: list = Field([{"role":"system","content":"You are a helpful assistant."},{"role":"user","content":"hello"}], description="Chat history")
     stream: bool = Field(False, description="Stream response")
 
+@router.get("/v1/scheduler/stats")
+async def scheduler_stats():
+    return JSONResponse({**scheduler.stats(), "registry": router.registry.stats()})
+
+
+@router.get("/v1/models")
+async def list_models():
+    return JSONResponse({"object": "list", "data": router.registry.list_models()})
+
+
 @router.post("/v1/chat/completions")
-@change_dir(router.dir)
 async def chat_completions(request: ChatRequest):
-    best_match = get_close_matches(request.model, router.models_list, n=1, cutoff=0.0)
-    if best_match:
-        m_name = best_match[0]
-        seq_len = int(m_name.split('seq')[1].split('_')[0].split('.')[0]) if 'seq' in m_name else 512
-        slm = router.models[best_match[0]]
-    else:
-        slm = router.models['minicpm3-4b_int4_seq512_1dev.bmodel']
-    
+    m_name = router.registry.resolve(request.model)
+    seq_len = router.registry.entries[m_name]["seq_len"]
+
+    # 只在本地变量中解析请求，slm 的状态由调度线程在 prefill 时统一设置，避免并发请求互相覆盖
+    input_str = ''
+    image_str = ''
+    # 下载的图片在 prefill 时才读取，临时目录随会话结束删除
+    scratch = None
     if isinstance(request.messages[-1]['content'], list):
         content = request.messages[-1]['content']
         for x in content:
             if x['type'] == 'text':
-                slm.input_str = x['text']
+                input_str = x['text']
             elif x['type'] == 'image_url':
-                image_data = x['image_url']['url']
-                if image_data.startswith("data:"):
-                    base64_data = image_data.split(",")[1]  # 去掉前缀
-                    image_bytes = base64.b64decode(base64_data)  # 解码
-                    image = Image.open(BytesIO(image_bytes))  # 读取图片
-                    image.save("/data/tmpdir/image.png", format='PNG')
-                    slm.image_str = "/data/tmpdir/image.png"
-                else:
-                    png = image_data.split('/')[-1]
-                    os.system(f"wget {image_data} -O /data/tmpdir/{png}")
-                    slm.image_str = f"/data/tmpdir/{png}"
+                scratch = scratch or temp_artifacts.scratch().bind()
+                try:
+                    image_str = await router.execute(fetch_image, x['image_url']['url'], scratch)
+                except BaseException:
+                    scratch.cleanup()
+                    raise
             elif x['type'] == 'image_path':
-                slm.image_str = x['image_path']['path'] if isinstance(x['image_path'], dict) else x['image_path']
+                image_str = x['image_path']['path'] if isinstance(x['image_path'], dict) else x['image_path']
             else:
-                slm.image_str = ''
+                image_str = ''
     else:
         if len(request.messages[-1]['content']) > seq_len:
             request.messages[-1]['content'] = request.messages[-1]['content'][:seq_len]
-        slm.input_str = request.messages[-1]['content']
+        input_str = request.messages[-1]['content']
 
     if "minicpmv" in request.model.lower():
-        try:
-            image_path = slm.image_str
-        except:
-            slm.image_str = ''
-
-        if slm.image_str:
-            if not os.path.exists(slm.image_str):
-                print("Can't find image: {}".format(slm.image_str))
-        
+        if image_str and not os.path.exists(image_str):
+            print("Can't find image: {}".format(image_str))
+
         if request.messages[0]['role'] == 'system':
             prompt = request.messages[0]['content']
         else:
             prompt = "You are a helpful assistant."
-        slm.system_prompt = f'<|im_start|>system\n{prompt}\n<|im_end|>\n<|im_start|>user\n'
-    
-        slm.encode()
-        token = slm.model.forward_first(slm.input_ids, slm.pixel_values, slm.image_offset)
-        EOS = [slm.ID_EOS, slm.ID_IM_END]
+
+        def prefill():
+            slm.input_str = input_str
+            slm.image_str = image_str
+            slm.system_prompt = f'<|im_start|>system\n{prompt}\n<|im_end|>\n<|im_start|>user\n'
+            slm.encode()
+            # 图像 token 无法与文本前缀比较，不参与前缀复用
+            scheduler.prefix_cache.invalidate(m_name)
+            token = slm.model.forward_first(slm.input_ids, slm.pixel_values, slm.image_offset)
+            return token, [slm.ID_EOS, slm.ID_IM_END]
     else:
-        slm.clear()
-        tokens = slm.tokenizer.apply_chat_template(request.messages, tokenize=True, add_generation_prompt=True)
-        token =  slm.model.forward_first(tokens)
-        EOS = slm.EOS if isinstance(slm.EOS, list) else [slm.EOS]
+        def prefill():
+            slm.input_str = input_str
+            slm.clear()
+            tokens = slm.tokenizer.apply_chat_template(request.messages, tokenize=True, add_generation_prompt=True)
+            token = scheduler.prefix_cache.prefill(m_name, slm.model, tokens)
+            return token, slm.EOS if isinstance(slm.EOS, list) else [slm.EOS]
+
+    def finish():
+        router.registry.release(m_name)
+        if scratch is not None:
+            scratch.cleanup()
+
+    try:
+        slm = await router.execute(router.registry.get, m_name)
+    except BaseException:
+        if scratch is not None:
+            scratch.cleanup()
+        raise
+    try:
+        # 会话在调度线程中结束后才解除占用，避免 pipeline 在推理过程中被释放
+        session = scheduler.submit(m_name, slm.model, prefill, on_done=finish)
+    except BaseException:
+        finish()
+        raise
 
     if request.stream:
-        def generate_responses(token):
-            output_tokens = []
-            while True:
-                output_tokens.append(token)
-                if token in EOS or slm.model.token_length >= slm.model.SEQLEN:
-                    break
-                word = slm.tokenizer.decode(output_tokens, skip_special_tokens=True)
-                if "�" not in word:
-                    if len(output_tokens) == 1:
-                        pre_word = word
-                        word = slm.tokenizer.decode([token, token], skip_special_tokens=True)[len(pre_word):]
+        async def generate_responses():
+            detokenizer = IncrementalDetokenizer(slm.tokenizer)
+            try:
+                async for token in session:
+                    word = detokenizer.push(token)
+                    if word:
+                        data = {"choices": [{"delta": {"role": "assistant", "content": word}}]}
+                        yield f"data:{json.dumps(data)}\n\n"
+                word = detokenizer.flush()
+                if word:
                     data = {"choices": [{"delta": {"role": "assistant", "content": word}}]}
                     yield f"data:{json.dumps(data)}\n\n"
-                    output_tokens = []
-                token = slm.model.forward_next()
-        return StreamingResponse(generate_responses(token), media_type="text/event-stream")
+            finally:
+                # 客户端断开时通知调度器尽快释放该 pipeline
+                session.cancel()
+        return StreamingResponse(generate_responses(), media_type="text/event-stream")
     else:
-        output_tokens = [token]
-        while True:
-            token = slm.model.forward_next()
-            if token in EOS or slm.model.token_length >= slm.model.SEQLEN:
-                break
-            output_tokens += [token]
-        slm.answer_cur = slm.tokenizer.decode(output_tokens)
-        return JSONResponse({"choices": [{"message": {"role": "assistant", "content": slm.answer_cur}}]})
+        output_tokens = [token async for token in session]
+        answer = slm.tokenizer.decode(output_tokens)
+        return JSONResponse({"choices": [{"message": {"role": "assistant", "content": answer}}]})
     
 ### 常规测试
 # curl --no-buffer -X 'POST' \
@@ -1,63 +1,145 @@
-import base64
+import asyncio
+import os
 from io import BytesIO
 from PIL import Image
 import numpy as np
-from api.base_api import BaseAPIRouter, change_dir, init_helper
-from fastapi import File, UploadFile
+from api.base_api import BaseAPIRouter, init_helper, ImageOutput, MicroBatcher
+from fastapi import File, Form, HTTPException, Request, UploadFile
 from fastapi.responses import JSONResponse
 from fastapi.encoders import jsonable_encoder
-from repo.rmbg.python.utilities import preprocess_image, postprocess_image
-import torch
-from repo.rmbg.python.npuengine import EngineOV
+from typing import List, Optional
 
 app_name = "rmbg"
+MODEL_INPUT_SIZE = (1024, 1024)
+# 一批最多合并的图片数，默认取 bmodel 编译时的批大小；等待凑批的最长时间（毫秒）
+RMBG_MAX_BATCH = int(os.environ.get('RMBG_MAX_BATCH', 0))
+RMBG_BATCH_WAIT_MS = float(os.environ.get('RMBG_BATCH_WAIT_MS', 5))
+
+
+def compiled_batch_size(engine):
+    """bmodel 按固定形状编译，批大小取输入形状的第 0 维；取不到时按 1 处理。"""
+    try:
+        return int(engine.model.get_input_shape(engine.graph_name, engine.input_name[0])[0])
+    except Exception:
+        return 1
+
 
 class AppInitializationRouter(BaseAPIRouter):
     dir = f"repo/{app_name}"
+    memory_mb = 256
     @init_helper(dir)
     async def init_app(self):
-        self.model = EngineOV("models/rmbg.bmodel", device_id=0)
+        from repo.rmbg.python.npuengine import EngineOV
+        self.model = EngineOV(self.path("models/rmbg.bmodel"), device_id=0)
+        self.batch_size = compiled_batch_size(self.model)
+        self.batcher = MicroBatcher(self, run_rmbg_batch, max_batch_size=RMBG_MAX_BATCH or self.batch_size,
+                                    max_wait_ms=RMBG_BATCH_WAIT_MS)
         return {"message": f"Application {self.app_name} has been initialized successfully."}
     
+    async def warmup(self):
+        await self.execute(run_engine, np.zeros((self.batch_size, 3) + MODEL_INPUT_SIZE, dtype=np.float32))
+
     async def destroy_app(self):
         del self.model
+        del self.batcher
     
 
 router = AppInitializationRouter(app_name=app_name)
 
 
+def preprocess_images(images):
+    """把已解码的 RGB 图像缩放到模型输入尺寸并归一化到 [-0.5, 0.5]，返回 [N, 3, H, W] float32。
+
+    与上游 utilities.preprocess_image 等价，但缩放在 uint8 上由 PIL 完成，整批只做一次类型转换，不依赖 torch。
+    """
+    batch = np.stack([np.asarray(image.resize(MODEL_INPUT_SIZE, Image.BILINEAR)) for image in images])
+    inputs = batch.transpose(0, 3, 1, 2).astype(np.float32, order='C')
+    inputs *= 1 / 255.0
+    inputs -= 0.5
+    return inputs
+
+
+def postprocess_mask(mask, size):
+    """模型输出的 [1, H, W] 按最值拉伸到 0-255，再缩放回原图尺寸，返回 L 模式的 PIL 图像。"""
+    mask = mask[0]
+    mi, ma = mask.min(), mask.max()
+    mask = (mask - mi) * (255.0 / max(ma - mi, 1e-6))
+    return Image.fromarray(mask.astype(np.uint8), mode='L').resize(size, Image.BILINEAR)
+
+
+def run_engine(inputs):
+    """按 bmodel 的静态批大小切分或补零后推理，返回与 inputs 等长的结果。"""
+    batch_size = router.batch_size
+    results = []
+    for start in range(0, len(inputs), batch_size):
+        chunk = inputs[start:start + batch_size]
+        n = len(chunk)
+        if n < batch_size:
+            chunk = np.concatenate([chunk, np.zeros((batch_size - n,) + chunk.shape[1:], dtype=chunk.dtype)])
+        results.append(router.model([chunk])[0][:n])
+    return np.concatenate(results)
+
+
+def decode_image(ori_image_bytes):
+    """解码上传的图片；无法识别时返回 400 的 HTTPException 实例（不抛出），只让这一张图片的请求失败。"""
+    try:
+        return Image.open(BytesIO(ori_image_bytes)).convert("RGB")
+    except Exception as e:
+        return HTTPException(status_code=400, detail=f"Invalid image: {e}")
+
+
+def run_rmbg_batch(items):
+    """MicroBatcher 的批处理函数：items 为 (图片字节, ImageOutput)，返回编码后的结果。
+
+    无法解码的图片对应位置返回异常实例，不影响同批的其他请求。
+    """
+    # 每张图只解码一次，预处理和贴 alpha 都复用这份图像
+    outputs = [decode_image(ori_image_bytes) for ori_image_bytes, _ in items]
+    valid = [i for i, image in enumerate(outputs) if isinstance(image, Image.Image)]
+    if not valid:
+        return outputs
+    images = [outputs[i] for i in valid]
+
+    # Inference
+    masks = run_engine(preprocess_images(images))
+
+    for i, image, mask in zip(valid, images, masks):
+        # 直接把 mask 写入原图的 alpha 通道
+        image.putalpha(postprocess_mask(mask, image.size))
+        outputs[i] = items[i][1].encode(image)
+    return outputs
+
+
 ### 图像去背景；兼容openai api，images/edit
 @router.post("/v1/images/edit")
-@change_dir(router.dir)
 async def remove_background(
-    image: UploadFile = File(...),
+    request: Request,
+    image: List[UploadFile] = File(...),
+    response_format: Optional[str] = Form(None),
+    output_format: Optional[str] = Form(None),
+    output_quality: Optional[int] = Form(None),
 ):
+    # 默认 PNG 以保留透明通道
+    output = ImageOutput(request, response_format, output_format, output_quality, default_format='png')
+    # 可一次上传多张图片（重复 image 字段），每张各返回一个结果
+    if output.binary and len(image) > 1:
+        raise HTTPException(status_code=400, detail="Binary responses support a single image; use b64_json for multiple images")
+    ori_images = [await upload.read() for upload in image]
 
-    ori_image_bytes = await image.read()
-    ori_image_data = BytesIO(ori_image_bytes)
-    ori_image = Image.open(ori_image_data)
-    image_np = np.array(ori_image)
-    orig_im_size = image_np.shape[:2]
-    model_input_size = [1024, 1024]
-    image = preprocess_image(image_np, model_input_size)
-    
-    # Inference
-    result = router.model([image.numpy()])[0]
-    result = torch.from_numpy(result).float()
-    
-    # Post-process
-    result_image = postprocess_image(result, orig_im_size)
-
-    # Creating no background image
-    pil_im = Image.fromarray(result_image)
-    no_bg_image = Image.new("RGBA", pil_im.size, (0, 0, 0, 0))
-    orig_image = Image.open(ori_image_data)
-    no_bg_image.paste(orig_image, mask=pil_im)
-    
-    # Convert to b64_json for output
-    buffer = BytesIO()
-    no_bg_image.save(buffer, format='PNG')
-    ret_img_b64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
-    content = {"data": [{"b64_json": ret_img_b64}]}
+    # 并发到达的请求由 batcher 合并成一次引擎调用
+    results = await asyncio.gather(*(router.batcher.submit((ori_image_bytes, output)) for ori_image_bytes in ori_images),
+                                   return_exceptions=True)
+    for result in results:
+        # 无法解码只影响对应的那一张，其他异常（如推理失败）仍使整个请求失败
+        if isinstance(result, BaseException) and (len(results) == 1 or not isinstance(result, HTTPException)):
+            raise result
+    if output.binary:
+        return output.response(results[0])
+    content = {"data": [{"error": result.detail} if isinstance(result, HTTPException) else {"b64_json": result}
+                        for result in results]}
     return JSONResponse(content=jsonable_encoder(content), media_type="application/json")
-    
\ No newline at end of file
+
+
+@router.get("/v1/batch/stats")
+async def batch_stats():
+    return JSONResponse(router.batcher.stats())
@@ -1,13 +1,21 @@
+import copy
 import io
-import base64
+import gc
+import asyncio
+import hashlib
 import random
+import threading
+import numpy as np
+from collections import OrderedDict
+from functools import wraps
 from PIL import Image
 from fastapi.encoders import jsonable_encoder
 from fastapi.responses import JSONResponse
-from api.base_api import BaseAPIRouter, change_dir, init_helper
+from api.base_api import BaseAPIRouter, init_helper, metrics, ImageOutput, ResultCache, encode_image
 import os, re
+import time
 from typing import Optional
-from fastapi import File, Form, UploadFile
+from fastapi import File, Form, HTTPException, Request, UploadFile
 
 
 TEST=False
@@ -15,6 +23,22 @@ DEVICE_ID=os.environ.get('DEVICE_ID', 0)
 BASENAME = os.environ.get('BASENAME', 'awportraitv14')
 CONTROLNET = os.environ.get('CONTROLNET', '')
 RETURN_BASE64 = bool(int(os.environ.get('RETURN_BASE64', 1)))
+# 固定 seed 的生成结果缓存：内存和磁盘两级的容量（MB）
+SD_CACHE_MEMORY_MB = int(os.environ.get('SD_CACHE_MEMORY_MB', 64))
+SD_CACHE_DISK_MB = int(os.environ.get('SD_CACHE_DISK_MB', 1024))
+# 提示词编码缓存的条目数和容量（MB）上限
+SD_PROMPT_CACHE_ENTRIES = int(os.environ.get('SD_PROMPT_CACHE_ENTRIES', 256))
+SD_PROMPT_CACHE_MB = int(os.environ.get('SD_PROMPT_CACHE_MB', 128))
+# 单个请求最多生成的图像数（n）
+SD_MAX_IMAGES = int(os.environ.get('SD_MAX_IMAGES', 8))
+# 同时保留的形状桶（各自设置好 unet/vae 形状的 pipeline）个数上限；各桶共用文本编码器、tokenizer 和调度器，
+# 每多一个桶只多占一份该分辨率的 unet/vae
+SD_SHAPE_BUCKETS = max(1, int(os.environ.get('SD_SHAPE_BUCKETS', 2)))
+# 设备内存估计值（MB）：完整 pipeline，以及其中与形状相关的 unet/vae 部分（即每多一个形状桶的增量）
+SD_PIPELINE_MB = 2048
+SD_BUCKET_MB = 1792
+# 加载基础模型时预先准备的形状桶，也是超分（512x512 分块）使用的形状
+DEFAULT_SHAPE = (512, 512)
 
 def handle_base64_image(controlnet_image):
     # 目前只支持一个controlnet_image, 不可以是list
@@ -25,11 +49,11 @@ def handle_base64_image(controlnet_image):
         
     return controlnet_image
 
-def handle_output_base64_image(image_base64):
+def handle_output_base64_image(image_base64, media_type="image/jpeg"):
     if not RETURN_BASE64:
         return image_base64
     if not image_base64.startswith("data:image"):
-        image_base64 = "data:image/jpeg;base64," + image_base64
+        image_base64 = f"data:{media_type};base64," + image_base64
     return image_base64
 
 def get_shape_by_ratio(width, height):
@@ -51,34 +75,277 @@ def get_shape_by_ratio(width, height):
     return nshape
 
 app_name = "sd_lcm_tpu"
+SD_STEPS_PER_SECOND = metrics.histogram('aigchub_sd_steps_per_second', 'Denoising steps per second of a Stable Diffusion call.',
+                                        (0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50))
+SD_PROMPT_CACHE_LOOKUPS = metrics.counter('aigchub_sd_prompt_cache_lookups_total', 'Prompt embedding cache lookups by result (hit or miss).')
+SD_PROMPT_CACHE_SAVED = metrics.histogram('aigchub_sd_prompt_cache_seconds_saved', 'Text encoder time skipped per prompt embedding cache hit.',
+                                          (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1))
+SD_SHAPE_SWITCH_SECONDS = metrics.histogram('aigchub_sd_shape_switch_seconds', 'Time to prepare a pipeline for a shape bucket that is not loaded.',
+                                            (0.01, 0.05, 0.1, 0.5, 1, 2, 5, 10, 30, 60))
+result_cache = ResultCache(app_name, memory_mb=SD_CACHE_MEMORY_MB, disk_mb=SD_CACHE_DISK_MB)
+
+
+def _nbytes(value):
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sum(_nbytes(v) for v in value)
+    return 0
+
+
+def _copy(value):
+    if isinstance(value, np.ndarray):
+        return value.copy()
+    if isinstance(value, (tuple, list)):
+        return type(value)(_copy(v) for v in value)
+    return value
+
+
+class PromptEmbeddingCache:
+    """提示词编码结果的 LRU 缓存，按条目数和字节数限制。
+
+    通过 wrap() 替换 pipeline 的 _encode_prompt，键为其全部参数（提示词、负向提示词、是否 CFG 等），
+    因此条件与无条件（负向）编码一起缓存；参数中有数组等不可哈希的值时直接调用原函数。
+    缓存与当前加载的基础模型绑定，切换模型时需调用 clear()。
+    """
+    def __init__(self, max_entries=SD_PROMPT_CACHE_ENTRIES, max_mb=SD_PROMPT_CACHE_MB):
+        self.max_entries = max_entries
+        self.max_bytes = max_mb * 1024 * 1024
+        self._entries = OrderedDict()  # key -> (编码结果, 编码耗时)
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.seconds_saved = 0.0
+
+    def wrap(self, pipeline):
+        encode = getattr(pipeline, '_encode_prompt', None)
+        if encode is None:
+            print(f"{type(pipeline).__name__} has no _encode_prompt, prompt embedding cache disabled.")
+            return pipeline
+
+        @wraps(encode)
+        def cached_encode(*args, **kwargs):
+            key = (args, tuple(sorted(kwargs.items())))
+            try:
+                hash(key)
+            except TypeError:
+                return encode(*args, **kwargs)
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    self.seconds_saved += entry[1]
+            if entry is not None:
+                SD_PROMPT_CACHE_LOOKUPS.inc(result='hit')
+                SD_PROMPT_CACHE_SAVED.observe(entry[1])
+                # 返回副本，避免调用方原地修改缓存内容
+                return _copy(entry[0])
+            SD_PROMPT_CACHE_LOOKUPS.inc(result='miss')
+            start = time.perf_counter()
+            value = encode(*args, **kwargs)
+            self._put(key, _copy(value), time.perf_counter() - start)
+            return value
+
+        pipeline._encode_prompt = cached_encode
+        return pipeline
+
+    def _put(self, key, value, seconds):
+        size = _nbytes(value)
+        with self._lock:
+            self.misses += 1
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (value, seconds)
+            self._size += size
+            while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self._size -= _nbytes(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0,
+                    "seconds_saved": self.seconds_saved, "entries": len(self._entries), "bytes": self._size}
 
 class AppInitializationRouter(BaseAPIRouter):
     dir = f"repo/{app_name}"
+    memory_mb = SD_PIPELINE_MB + SD_BUCKET_MB * (SD_SHAPE_BUCKETS - 1)  # 估计值，按形状桶全部加载计
+    requires_cwd = True  # StableDiffusionPipeline 按相对路径加载各分辨率的 unet/vae
     @init_helper(dir)
     async def init_app(self):
-        # ori_dir = os.getcwd()
-        # sys.path.append(os.path.join(ori_dir, self.dir))
-        # os.chdir(self.dir)
+        self.prompt_cache = PromptEmbeddingCache()
+        self.shape_stats = {}
+        self.bucket_components = []
+        self.load_pipeline("hellonijicute")
+        return {"message": f"Application {self.app_name} has been initialized successfully."}
+
+    def new_pipeline(self, base_model, shape):
         from repo.sd_lcm_tpu.sd import StableDiffusionPipeline
 
-        self.models['pipeline'] = StableDiffusionPipeline(basic_model="hellonijicute",
-                                                          controlnet_name="",
-                                                          scheduler="LCM")
-        # os.chdir(ori_dir)
-        return {"message": f"Application {self.app_name} has been initialized successfully."}
+        pipeline = StableDiffusionPipeline(basic_model=base_model,
+                                           controlnet_name="",
+                                           scheduler="LCM")
+        pipeline.set_height_width(*shape)
+        return self.prompt_cache.wrap(pipeline)
+
+    def new_bucket(self, shape):
+        """新建形状桶：浅拷贝一个已加载的 pipeline 再设置形状。
+
+        set_height_width 为新形状重新绑定 unet/vae，其余属性（文本编码器、tokenizer、调度器、已包装的提示词编码）
+        仍与原 pipeline 共用同一个对象。被重新绑定的属性记录在 bucket_components 中，见 /v1/shape_buckets/stats。
+        """
+        source = next(reversed(self.models['pipelines'].values()))
+        pipeline = copy.copy(source)
+        pipeline.set_height_width(*shape)
+        shared = getattr(source, '__dict__', {})
+        self.bucket_components = sorted(name for name, value in getattr(pipeline, '__dict__', {}).items()
+                                        if shared.get(name) is not value)
+        return pipeline
+
+    def load_pipeline(self, base_model):
+        """加载指定基础模型（只准备 DEFAULT_SHAPE 一个形状桶），并清空与旧模型绑定的提示词编码缓存。需在工作线程中调用。"""
+        # 先释放旧模型占用的设备内存，再加载新模型
+        self.models.pop('pipelines', None)
+        self.prompt_cache.clear()
+        gc.collect()
+        pipeline = self.new_pipeline(base_model, DEFAULT_SHAPE)
+        self.models['pipelines'] = OrderedDict([(DEFAULT_SHAPE, pipeline)])
+        self.base_model = base_model
+        # 结果缓存键中的 pipeline 标识：实现类和模型所在目录，不同实现（如 benchmark 的替身）的结果互不复用
+        cls = type(pipeline)
+        self.pipeline_id = f"{cls.__module__}.{cls.__qualname__}@{os.path.realpath(self.dir)}"
+
+    def bucket_pipeline(self, shape):
+        """返回已设置为 shape（get_shape_by_ratio 的结果）的 pipeline。需在工作线程中调用。
+
+        每个形状桶一个 pipeline，按 LRU 最多保留 SD_SHAPE_BUCKETS 个：未加载的形状在桶未满时新建形状桶（见 new_bucket），
+        桶已满时把最久未用的 pipeline 切换到该形状。
+        """
+        shape = tuple(shape)
+        pipelines = self.models['pipelines']
+        stats = self.shape_stats.setdefault(shape, {"requests": 0, "switches": 0, "switch_seconds": 0.0})
+        stats["requests"] += 1
+        pipeline = pipelines.get(shape)
+        if pipeline is not None:
+            pipelines.move_to_end(shape)
+            return pipeline
+
+        start = time.perf_counter()
+        if len(pipelines) >= SD_SHAPE_BUCKETS:
+            _, pipeline = pipelines.popitem(last=False)
+            pipeline.set_height_width(*shape)
+        else:
+            pipeline = self.new_bucket(shape)
+        pipelines[shape] = pipeline
+        elapsed = time.perf_counter() - start
+        stats["switches"] += 1
+        stats["switch_seconds"] += elapsed
+        SD_SHAPE_SWITCH_SECONDS.observe(elapsed, shape="%dx%d" % shape)
+        return pipeline
     
+    async def warmup(self):
+        def run():
+            # 默认形状桶上做一步推理
+            pipeline = self.bucket_pipeline(DEFAULT_SHAPE)
+            pipeline.scheduler = "LCM"
+            pipeline(prompt="warmup", negative_prompt=None, init_image=None, mask=None, strength=0.8,
+                     num_inference_steps=1, guidance_scale=1.0, controlnet_img=None, seeds=[0], subseeds=[0],
+                     subseed_strength=0.0, seed_resize_from_h=1, seed_resize_from_w=1, controlnet_args={},
+                     scheduler="LCM")
+        await self.execute_grouped(DEFAULT_SHAPE, run)
+
     async def destroy_app(self):
-        del self.models['pipeline']
+        del self.models['pipelines']
+        self.prompt_cache.clear()
         return {"message": f"Application {self.app_name} has been destroyed successfully."}
 
 
 router = AppInitializationRouter(app_name=app_name)
 
 
+def check_image_count(n, output):
+    if not 1 <= n <= SD_MAX_IMAGES:
+        raise HTTPException(status_code=400, detail=f"n must be between 1 and {SD_MAX_IMAGES}")
+    if output.binary and n > 1:
+        raise HTTPException(status_code=400, detail="Binary responses support a single image; use b64_json for n > 1")
+
+
+async def cached_generate(cache_keys, output, generate, shape):
+    """cache_keys 与要生成的各张图像一一对应，None 表示该图不走缓存。
+
+    先查缓存，未命中的图像在一次工作线程任务中生成并写入缓存：generate(indices) 在工作线程中执行，
+    按 indices 的顺序逐张产出 PIL 图像。缓存的是按 output 的格式编码后的字节。
+    任务以 shape 为分组键排队，同一形状的请求尽量连续执行。
+    """
+    results = [None] * len(cache_keys)
+    for i, cache_key in enumerate(cache_keys):
+        if cache_key is not None:
+            # 查缓存不经过工作线程，命中时无需等待正在进行的生成
+            data = await asyncio.to_thread(result_cache.get, cache_key)
+            if data is not None:
+                results[i] = output.wrap(data)
+    missing = [i for i, result in enumerate(results) if result is None]
+    if not missing:
+        return results
+
+    def run():
+        generated = []
+        for i, img_pil in zip(missing, generate(missing)):
+            data = encode_image(img_pil, output.format, output.quality)
+            if cache_keys[i] is not None:
+                result_cache.put(cache_keys[i], data)
+            generated.append(output.wrap(data))
+        return generated
+
+    for i, result in zip(missing, await router.execute_grouped(shape, run)):
+        results[i] = result
+    return results
+
+
+@router.get("/v1/shape_buckets/stats")
+async def shape_bucket_stats():
+    return JSONResponse({
+        "max_buckets": SD_SHAPE_BUCKETS,
+        "loaded": ["%dx%d" % shape for shape in router.models.get('pipelines', {})],
+        "bucket_components": router.bucket_components,
+        "buckets": {"%dx%d" % shape: stats for shape, stats in router.shape_stats.items()},
+    })
+
+
+@router.get("/v1/cache/stats")
+async def cache_stats():
+    return JSONResponse({**result_cache.stats(), "prompt_embeddings": router.prompt_cache.stats()})
+
+
+### 切换基础模型
+@router.post("/v1/switch_base_model")
+async def switch_base_model(basic_model: str = Form(...)):
+    def switch():
+        previous = router.base_model
+        if basic_model == previous:
+            return
+        try:
+            router.load_pipeline(basic_model)
+        except Exception as e:
+            # 新模型加载失败时恢复原模型，保证应用仍然可用
+            router.load_pipeline(previous)
+            raise HTTPException(status_code=400, detail=f"Failed to load base model {basic_model!r}: {e}")
+
+    await router.execute(switch)
+    return JSONResponse({"base_model": router.base_model})
+
+
 ### 00 文本转图像，兼容openai api，image/genrations
 @router.post("/v1/images/generations")
-@change_dir(router.dir)
 async def txt2img(
+    request: Request,
     prompt: str = Form(...),
     size: Optional[str] = Form("512x512"),
     negative_prompt: Optional[str] = Form(None),
@@ -86,11 +353,20 @@ async def txt2img(
     guidance_scale: Optional[float] = Form(1.0),
     strength: Optional[float] = Form(0.8),
     seed: Optional[int] = Form(-1),
-    sampler_index: Optional[str] = Form("LCM")
+    n: Optional[int] = Form(1),
+    sampler_index: Optional[str] = Form("LCM"),
+    response_format: Optional[str] = Form(None),
+    output_format: Optional[str] = Form(None),
+    output_quality: Optional[int] = Form(None),
 ):
+    output = ImageOutput(request, response_format, output_format, output_quality)
+    check_image_count(n, output)
+    # 固定 seed 的请求结果是确定的，可以复用缓存
+    deterministic = seed != -1
     if seed == -1:
         seed = random.randint(0, 2 ** 31 - 1)
-    subseed = seed # 不可以为-1
+    # n 张图像依次使用 seed, seed+1, ...
+    seeds = [(seed + i) % 2 ** 31 for i in range(n)]
     subseed_strength = 0.0
     seed_resize_from_h = 1
     seed_resize_from_w = 1
@@ -99,17 +375,28 @@ async def txt2img(
     height, width = map(int, match.groups()[0::2])
     
     nwidth, nheight = get_shape_by_ratio(width, height)
-    router.models['pipeline'].set_height_width(nwidth, nheight)
     controlnet_image = None
     init_image = None
+    image_sha256 = None
     mask = None
     controlnet_args = {}
 
     try:
         if sampler_index != "LCM":
             num_inference_steps = max(num_inference_steps, 20)
-        router.models['pipeline'].scheduler = sampler_index
-        img_pil = router.models['pipeline'](
+
+        def generate(indices):
+            # 调度器设置会修改共享的 pipeline，必须和推理一起在工作线程中串行执行；
+            # 提示词编码由 prompt_cache 在同一请求的各张图像之间共享
+            pipeline = router.bucket_pipeline((nwidth, nheight))
+            pipeline.scheduler = sampler_index
+            for i in indices:
+                yield generate_one(pipeline, seeds[i])
+
+        def generate_one(pipeline, seed):
+            subseed = seed # 不可以为-1
+            start = time.perf_counter()
+            img_pil = pipeline(
                 prompt=prompt,
                 negative_prompt=negative_prompt,
                 init_image=init_image,
@@ -126,14 +413,27 @@ async def txt2img(
                 controlnet_args = controlnet_args,
                 scheduler=sampler_index,
             )
-        buffer = io.BytesIO()
-        img_pil.save(buffer, format='JPEG')
-        ret_img_b64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
+            SD_STEPS_PER_SECOND.observe(num_inference_steps / (time.perf_counter() - start), route="txt2img" if init_image is None else "img2img")
+            return img_pil
+
+        # 每张图像按各自的 seed 单独缓存，n 不同的请求也能复用
+        cache_keys = [ResultCache.make_key(
+                route="txt2img" if init_image is None else "img2img", base_model=router.base_model,
+                pipeline=router.pipeline_id,
+                image_sha256=image_sha256, prompt=prompt, negative_prompt=negative_prompt,
+                size=(nwidth, nheight), num_inference_steps=num_inference_steps, guidance_scale=guidance_scale,
+                strength=strength, seed=image_seed, sampler_index=sampler_index,
+                output_format=output.format, output_quality=output.quality) if deterministic else None
+            for image_seed in seeds]
+        results = await cached_generate(cache_keys, output, generate, (nwidth, nheight))
+        if output.binary:
+            return output.response(results[0])
         content = {
             "data": [
                 {
                     "b64_json": ret_img_b64
                 }
+                for ret_img_b64 in results
                     ]
             }
         return JSONResponse(content=jsonable_encoder(content), media_type="application/json")
@@ -143,8 +443,8 @@ async def txt2img(
 
 ### 01 图生图，兼容openai api，images/edits
 @router.post("/v1/images/edits")
-@change_dir(router.dir)
 async def img2img(
+    request: Request,
     image: UploadFile = File(...),
     prompt: str = Form(...),
     size: str = Form("512x512"),
@@ -153,13 +453,22 @@ async def img2img(
     guidance_scale: Optional[float] = Form(1.0),
     strength: Optional[float] = Form(0.8),
     seed: Optional[int] = Form(-1),
-    sampler_index: Optional[str] = Form("LCM")  
+    n: Optional[int] = Form(1),
+    sampler_index: Optional[str] = Form("LCM"),
+    response_format: Optional[str] = Form(None),
+    output_format: Optional[str] = Form(None),
+    output_quality: Optional[int] = Form(None),
 ):
     """img2img"""
     # 从 JSON 数据中获取所需数据
+    output = ImageOutput(request, response_format, output_format, output_quality)
+    check_image_count(n, output)
+    # 固定 seed 的请求结果是确定的，可以复用缓存
+    deterministic = seed != -1
     if seed == -1:
         seed = random.randint(0, 2 ** 31 - 1)
-    subseed = seed # 不可以为-1
+    # n 张图像依次使用 seed, seed+1, ...
+    seeds = [(seed + i) % 2 ** 31 for i in range(n)]
     subseed_strength = 0.0
     seed_resize_from_h = 1
     seed_resize_from_w = 1
@@ -168,7 +477,6 @@ async def img2img(
     height, width = map(int, match.groups()[0::2])
     
     nwidth, nheight = get_shape_by_ratio(width, height)
-    router.models['pipeline'].set_height_width(nwidth, nheight)
     controlnet_image = None
     init_image = None
     mask = None
@@ -176,12 +484,24 @@ async def img2img(
 
     ori_image_bytes = await image.read()
     init_image = Image.open(io.BytesIO(ori_image_bytes))
+    image_sha256 = hashlib.sha256(ori_image_bytes).hexdigest()
 
     try:
         if sampler_index != "LCM":
             num_inference_steps = max(num_inference_steps, 20)
-        router.models['pipeline'].scheduler = sampler_index
-        img_pil = router.models['pipeline'](
+
+        def generate(indices):
+            # 调度器设置会修改共享的 pipeline，必须和推理一起在工作线程中串行执行；
+            # 提示词编码由 prompt_cache 在同一请求的各张图像之间共享
+            pipeline = router.bucket_pipeline((nwidth, nheight))
+            pipeline.scheduler = sampler_index
+            for i in indices:
+                yield generate_one(pipeline, seeds[i])
+
+        def generate_one(pipeline, seed):
+            subseed = seed # 不可以为-1
+            start = time.perf_counter()
+            img_pil = pipeline(
                 prompt=prompt,
                 negative_prompt=negative_prompt,
                 init_image=init_image,
@@ -198,14 +518,27 @@ async def img2img(
                 controlnet_args = controlnet_args,
                 scheduler=sampler_index,
             )
-        buffer = io.BytesIO()
-        img_pil.save(buffer, format='JPEG')
-        ret_img_b64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
+            SD_STEPS_PER_SECOND.observe(num_inference_steps / (time.perf_counter() - start), route="txt2img" if init_image is None else "img2img")
+            return img_pil
+
+        # 每张图像按各自的 seed 单独缓存，n 不同的请求也能复用
+        cache_keys = [ResultCache.make_key(
+                route="txt2img" if init_image is None else "img2img", base_model=router.base_model,
+                pipeline=router.pipeline_id,
+                image_sha256=image_sha256, prompt=prompt, negative_prompt=negative_prompt,
+                size=(nwidth, nheight), num_inference_steps=num_inference_steps, guidance_scale=guidance_scale,
+                strength=strength, seed=image_seed, sampler_index=sampler_index,
+                output_format=output.format, output_quality=output.quality) if deterministic else None
+            for image_seed in seeds]
+        results = await cached_generate(cache_keys, output, generate, (nwidth, nheight))
+        if output.binary:
+            return output.response(results[0])
         content = {
             "data": [
                 {
                     "b64_json": ret_img_b64
                 }
+                for ret_img_b64 in results
                     ]
             }
         return JSONResponse(content=jsonable_encoder(content), media_type="application/json")
@@ -215,8 +548,8 @@ async def img2img(
 
 #### 02 图像超分，兼容openai api，images/variations
 @router.post("/v1/images/variations")
-@change_dir(router.dir)
 async def upscale(
+    request: Request,
     image: UploadFile = File(...),
     prompt: Optional[str] = Form(None),
     negative_prompt: Optional[str] = Form(None),
@@ -225,8 +558,12 @@ async def upscale(
     strength: Optional[float] = Form(0.8),
     seed: Optional[int] = Form(-1),
     upscale_by: Optional[int] = Form(2),
-    sampler_index: Optional[str] = Form("LCM")
+    sampler_index: Optional[str] = Form("LCM"),
+    response_format: Optional[str] = Form(None),
+    output_format: Optional[str] = Form(None),
+    output_quality: Optional[int] = Form(None),
 ):
+    output = ImageOutput(request, response_format, output_format, output_quality)
     if seed == -1:
         seed = random.randint(0, 2 ** 31 - 1)
     mask = None
@@ -254,38 +591,43 @@ async def upscale(
     try:
         if sampler_index != "LCM":
             num_inference_steps = max(num_inference_steps, 20)
-        router.models['pipeline'].scheduler = sampler_index
-        image = router.models['pipeline'].wrap_upscale(
-            prompt=prompt,
-            negative_prompt=negative_prompt,
-            init_image=init_image,
-            mask=mask,
-            strength=strength,
-            num_inference_steps=num_inference_steps,
-            guidance_scale=guidance_scale,
-            controlnet_img = controlnet_image,
-            seeds = [seed],
-            subseeds = [subseed],
-            subseed_strength=subseed_strength,
-            seed_resize_from_h=seed_resize_from_h,
-            seed_resize_from_w=seed_resize_from_w,
-            controlnet_args = controlnet_args,
-            # upscale 参数
-            upscale_factor = upscale_factor,
-            upscale_type = upscale_type,
-            mask_blur = mask_blur,
-            tile_width = tile_width,
-            tile_height = tile_height,
-            padding   = padding,
-            seams_fix_enable = seams_fix_enable,
-            upscaler = upscaler,
-            seams_fix = seams_fix
-        )
-        img_pil = image
-        buffer = io.BytesIO()
-        img_pil.save(buffer, format='JPEG')
-        ret_img_b64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
-        ret_img_b64 = handle_output_base64_image(ret_img_b64)
+
+        def generate():
+            # 超分按 512x512 分块推理
+            pipeline = router.bucket_pipeline(DEFAULT_SHAPE)
+            pipeline.scheduler = sampler_index
+            img_pil = pipeline.wrap_upscale(
+                prompt=prompt,
+                negative_prompt=negative_prompt,
+                init_image=init_image,
+                mask=mask,
+                strength=strength,
+                num_inference_steps=num_inference_steps,
+                guidance_scale=guidance_scale,
+                controlnet_img = controlnet_image,
+                seeds = [seed],
+                subseeds = [subseed],
+                subseed_strength=subseed_strength,
+                seed_resize_from_h=seed_resize_from_h,
+                seed_resize_from_w=seed_resize_from_w,
+                controlnet_args = controlnet_args,
+                # upscale 参数
+                upscale_factor = upscale_factor,
+                upscale_type = upscale_type,
+                mask_blur = mask_blur,
+                tile_width = tile_width,
+                tile_height = tile_height,
+                padding   = padding,
+                seams_fix_enable = seams_fix_enable,
+                upscaler = upscaler,
+                seams_fix = seams_fix
+            )
+            return output.encode(img_pil)
+
+        ret_img_b64 = await router.execute_grouped(DEFAULT_SHAPE, generate)
+        if output.binary:
+            return output.response(ret_img_b64)
+        ret_img_b64 = handle_output_base64_image(ret_img_b64, output.media_type)
         content = {
             "data": [
                 {
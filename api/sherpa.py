@@ -1,14 +1,27 @@
 import subprocess
 import re
+import io
+import os
+import sys
 import json
 import time
-from api.base_api import BaseAPIRouter, change_dir, init_helper
+import wave
+import threading
+from api.base_api import BaseAPIRouter, init_helper, metrics, HUB_ROOT, ScratchDir, request_scratch
+from api.sherpa_worker import read_frame, write_frame
 from typing import Optional
-from fastapi import File, Form, UploadFile
+from fastapi import Depends, File, Form, HTTPException, UploadFile
 from fastapi.responses import JSONResponse, PlainTextResponse
 
 
 app_name = "sherpa"
+# 常驻识别进程加载模型、识别单个请求的最长时间（秒），超时后杀掉并重启进程
+SHERPA_STARTUP_TIMEOUT = float(os.environ.get('SHERPA_STARTUP_TIMEOUT', 300))
+SHERPA_REQUEST_TIMEOUT = float(os.environ.get('SHERPA_REQUEST_TIMEOUT', 60))
+ASR_RTF = metrics.histogram('aigchub_asr_real_time_factor', 'Transcription wall time divided by audio duration.',
+                            (0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5))
+SHERPA_CLI_FALLBACK = metrics.gauge('aigchub_sherpa_cli_fallback', 'Whether sherpa spawns the CLI per request (1) because the persistent worker failed to start.')
+SHERPA_WORKER_TIMEOUTS = metrics.counter('aigchub_sherpa_worker_timeouts_total', 'Requests whose persistent sherpa worker was killed after missing its deadline.')
 
 def run_shell_command(command):
     pattern = re.compile(r'\{.*?\}')
@@ -24,6 +37,117 @@ def run_shell_command(command):
                     print(f"Error decoding JSON from {match}")
     return dict_obj
 
+
+class SherpaWorker:
+    """常驻识别进程的客户端：模型只加载一次，进程崩溃后在下一次请求时自动重启并重试一次。
+
+    每次读取响应都有截止时间（启动 startup_timeout，识别 request_timeout）：超时的进程被杀掉并立即重启，
+    该请求以 TimeoutError 失败，不会让后续请求一直阻塞在锁上。
+    """
+    def __init__(self, cmd, cwd=None, env=None, startup_timeout=SHERPA_STARTUP_TIMEOUT, request_timeout=SHERPA_REQUEST_TIMEOUT):
+        self.cmd = cmd
+        self.cwd = cwd
+        self.env = env
+        self.startup_timeout = startup_timeout
+        self.request_timeout = request_timeout
+        self.proc = None
+        self.restarts = 0
+        self.timeouts = 0
+        self.lock = threading.Lock()
+
+    def start(self):
+        self.proc = subprocess.Popen(self.cmd, cwd=self.cwd, env=self.env, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        try:
+            ready = json.loads(self._read(self.startup_timeout))
+        except EOFError:
+            self.kill()
+            raise RuntimeError(f"sherpa worker exited during startup: {self.cmd}")
+        except TimeoutError:
+            self.kill()
+            raise RuntimeError(f"sherpa worker did not start within {self.startup_timeout} seconds: {self.cmd}")
+        if not ready.get("ready"):
+            self.kill()
+            raise RuntimeError(f"sherpa worker failed to start: {ready}")
+
+    def _read(self, timeout):
+        """读取一帧响应；timeout 秒内没有读完时杀掉进程并抛出 TimeoutError。"""
+        proc = self.proc
+        expired = threading.Event()
+
+        def expire():
+            expired.set()
+            proc.kill()
+
+        timer = threading.Timer(timeout, expire)
+        timer.daemon = True
+        timer.start()
+        try:
+            return read_frame(proc.stdout)
+        except EOFError:
+            if expired.is_set():
+                raise TimeoutError(f"sherpa worker did not respond within {timeout} seconds")
+            raise
+        finally:
+            timer.cancel()
+
+    def recognize(self, wav_bytes):
+        with self.lock:
+            for attempt in range(2):
+                if self.proc is None or self.proc.poll() is not None:
+                    if self.proc is not None:
+                        self.restarts += 1
+                        print(f"sherpa worker exited with code {self.proc.returncode}, restarting")
+                    self.start()
+                try:
+                    write_frame(self.proc.stdin, wav_bytes)
+                    result = json.loads(self._read(self.request_timeout))
+                    break
+                except TimeoutError:
+                    # 卡住的请求不重试，重启进程后直接失败
+                    self.timeouts += 1
+                    SHERPA_WORKER_TIMEOUTS.inc(app=app_name)
+                    self.kill()
+                    self.restarts += 1
+                    print(f"sherpa worker missed its {self.request_timeout} seconds deadline, restarting")
+                    try:
+                        self.start()
+                    except RuntimeError as e:
+                        # 下一次请求时再尝试启动
+                        print(e)
+                    raise
+                except (BrokenPipeError, EOFError):
+                    self.kill()
+                    if attempt:
+                        raise RuntimeError("sherpa worker crashed while recognizing")
+        if "error" in result:
+            raise RuntimeError(f"sherpa recognition failed: {result['error']}")
+        return result
+
+    def kill(self):
+        if self.proc is None:
+            return
+        if self.proc.poll() is None:
+            self.proc.kill()
+        self.proc.wait()
+        self.proc.stdin.close()
+        self.proc.stdout.close()
+
+    def close(self):
+        with self.lock:
+            if self.proc is not None and self.proc.poll() is None:
+                # 关闭 stdin 让 worker 正常退出
+                self.proc.stdin.close()
+                try:
+                    self.proc.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    pass
+            self.kill()
+            self.proc = None
+
+    def stats(self):
+        return {"running": self.proc is not None and self.proc.poll() is None,
+                "restarts": self.restarts, "timeouts": self.timeouts}
+
 # def run_shell_command_tofile(command, output_file):
 #     with open(output_file, "w") as file:
 #         try:
@@ -35,13 +159,34 @@ def run_shell_command(command):
 
 class AppInitializationRouter(BaseAPIRouter):
     dir = f"repo/{app_name}"
+    memory_mb = 255
     @init_helper(dir)
     async def init_app(self):
-        self.cmd = "build/bin/sherpa-onnx --tokens=./models/tokens.txt --zipformer2-ctc-model=./models/zipformer2_ctc_F32.bmodel "
+        self.cmd = f"{self.path('build/bin/sherpa-onnx')} --tokens={self.path('models/tokens.txt')} --zipformer2-ctc-model={self.path('models/zipformer2_ctc_F32.bmodel')} "
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [self.path('sherpa-onnx/python'), self.path('build/lib'), env.get("PYTHONPATH")]))
+        self.worker = SherpaWorker([sys.executable, os.path.join(HUB_ROOT, 'api', 'sherpa_worker.py'),
+                                    f"--tokens={self.path('models/tokens.txt')}",
+                                    f"--zipformer2-ctc-model={self.path('models/zipformer2_ctc_F32.bmodel')}"],
+                                   cwd=self.dir, env=env)
+        self.fallback_reason = None
+        try:
+            self.worker.start()
+        except RuntimeError as e:
+            # 未编译 sherpa_onnx python 绑定时退回到每次请求启动一次 sherpa-onnx，每个请求都要重新加载模型
+            self.fallback_reason = str(e)
+            self.worker = None
+            print(f"******** WARNING *********\nsherpa worker failed to start: {e}\n"
+                  f"Falling back to spawning sherpa-onnx per request, which reloads the model every time.\n"
+                  f"**************************")
+        SHERPA_CLI_FALLBACK.set(int(self.worker is None), app=app_name)
         return {"message": f"应用 {self.app_name} 已成功初始化。"}
     
     async def destroy_app(self):
-        del self.models
+        if self.worker is not None:
+            self.worker.close()
+        del self.worker
+        del self.cmd
 
 router = AppInitializationRouter(app_name=app_name)
 
@@ -49,27 +194,50 @@ router = AppInitializationRouter(app_name=app_name)
 
 ### ASR；兼容openai api，audio/transcriptions
 @router.post("/v1/audio/transcriptions")
-@change_dir(router.dir)
 async def sherpa(
     file: UploadFile = File(...),
     response_format: Optional[str] = Form("text"),
+    scratch: ScratchDir = Depends(request_scratch),
 ):
 
-    # save the audio file
-    file_tmp_path = "/data/tmpdir/sherpa.wav"
-    with open(file_tmp_path, "wb") as buffer:
-        buffer.write(file.file.read())
-        
-    audio_start_time = time.time()
-    result = run_shell_command(router.cmd + file_tmp_path)
-    total_time = time.time() - audio_start_time
-    print(f"Total time: {total_time}")
+    def recognize():
+        audio = file.file.read()
+        audio_start_time = time.time()
+        if router.worker is not None:
+            try:
+                result = router.worker.recognize(audio)
+            except TimeoutError as e:
+                raise HTTPException(status_code=504, detail=str(e))
+        else:
+            # save the audio file
+            file_tmp_path = scratch.write("sherpa.wav", audio)
+            result = run_shell_command(router.cmd + file_tmp_path)
+        total_time = time.time() - audio_start_time
+        try:
+            with wave.open(io.BytesIO(audio), 'rb') as wav:
+                audio_seconds = wav.getnframes() / wav.getframerate()
+        except (wave.Error, EOFError):
+            audio_seconds = 0
+        if audio_seconds:
+            ASR_RTF.observe(total_time / audio_seconds, app=app_name)
+        return result
+
+    result = await router.execute(recognize)
     if  response_format== "text":
         return PlainTextResponse(content=result["text"])
     else:
         return JSONResponse(content=result)
     
 
+@router.get("/v1/worker/stats")
+async def worker_stats():
+    """识别方式：worker 为常驻进程，cli 为每次请求启动 sherpa-onnx（fallback_reason 为常驻进程启动失败的原因）。"""
+    stats = {"mode": "worker" if router.worker is not None else "cli", "fallback_reason": router.fallback_reason}
+    if router.worker is not None:
+        stats.update(router.worker.stats())
+    return JSONResponse(stats)
+
+
 # #### 测试命令
 # curl http://localhost:8000/sherpa/v1/audio/transcriptions \
 #   -F 'file=@/data/TEST.wav;type=audio/wav' \
@@ -0,0 +1,99 @@
+"""常驻的 sherpa 识别进程。
+
+模型只在启动时加载一次，之后通过 stdin/stdout 上的长度前缀帧（4 字节大端长度 + 内容）收发请求：
+请求帧为 wav 文件内容，响应帧为 JSON（成功时含 text，失败时含 error）。
+启动完成后先发送一帧 {"ready": true}，调用方据此判断模型是否加载成功。
+
+该文件由 api/sherpa.py 以独立进程启动，不依赖 fastapi。
+"""
+import argparse
+import io
+import json
+import os
+import struct
+import sys
+import wave
+
+import numpy as np
+
+
+def write_frame(stream, payload: bytes):
+    stream.write(struct.pack('>I', len(payload)))
+    stream.write(payload)
+    stream.flush()
+
+
+def read_frame(stream) -> bytes:
+    header = stream.read(4)
+    if len(header) < 4:
+        raise EOFError("sherpa worker stream closed")
+    (size,) = struct.unpack('>I', header)
+    payload = stream.read(size)
+    if len(payload) < size:
+        raise EOFError("sherpa worker stream closed")
+    return payload
+
+
+def read_wav(data: bytes):
+    """返回 (float32 单声道采样, 采样率)，只支持 16 位 PCM wav。"""
+    with wave.open(io.BytesIO(data), 'rb') as wav:
+        if wav.getsampwidth() != 2:
+            raise ValueError("only 16-bit PCM wav is supported")
+        channels = wav.getnchannels()
+        samples = np.frombuffer(wav.readframes(wav.getnframes()), np.int16)
+        return samples[::channels].astype(np.float32) / 32768.0, wav.getframerate()
+
+
+def serve(decode):
+    """协议主循环；decode(wav_bytes) -> dict。"""
+    # 帧只能写到原 stdout，库自身的打印全部转到 stderr，避免破坏协议
+    out = os.fdopen(os.dup(sys.stdout.fileno()), 'wb')
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    stdin = sys.stdin.buffer
+
+    write_frame(out, json.dumps({"ready": True}).encode())
+    while True:
+        try:
+            payload = read_frame(stdin)
+        except EOFError:
+            break
+        try:
+            result = decode(payload)
+        except Exception as e:
+            result = {"error": str(e)}
+        write_frame(out, json.dumps(result, ensure_ascii=False).encode())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Persistent sherpa recognizer")
+    parser.add_argument('--tokens', type=str, required=True)
+    parser.add_argument('--zipformer2-ctc-model', type=str, required=True)
+    parser.add_argument('--num-threads', type=int, default=1)
+    args = parser.parse_args()
+
+    import sherpa_onnx
+    # 模型是流式的 zipformer2-CTC（与命令行的 --zipformer2-ctc-model 相同），只能用 OnlineRecognizer 加载
+    recognizer = sherpa_onnx.OnlineRecognizer.from_zipformer2_ctc(
+        tokens=args.tokens, model=args.zipformer2_ctc_model, num_threads=args.num_threads)
+
+    def decode(data):
+        samples, sample_rate = read_wav(data)
+        stream = recognizer.create_stream()
+        stream.accept_waveform(sample_rate, samples)
+        # 补一段静音，让流式模型输出最后几帧的结果
+        stream.accept_waveform(sample_rate, np.zeros(int(0.66 * sample_rate), dtype=np.float32))
+        stream.input_finished()
+        while recognizer.is_ready(stream):
+            recognizer.decode_stream(stream)
+        if hasattr(recognizer, "get_result_all"):
+            result = recognizer.get_result_all(stream)
+            return {"text": result.text,
+                    "timestamps": list(getattr(result, "timestamps", [])),
+                    "tokens": list(getattr(result, "tokens", []))}
+        return {"text": recognizer.get_result(stream), "timestamps": [], "tokens": []}
+
+    serve(decode)
+
+
+if __name__ == "__main__":
+    main()
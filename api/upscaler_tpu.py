@@ -1,24 +1,202 @@
-from fastapi import File, Form, UploadFile
-import base64
+from fastapi import File, Form, Request, UploadFile
+import os
+import queue
+import tempfile
+import threading
 from io import BytesIO
 from PIL import Image
-from api.base_api import BaseAPIRouter, change_dir, init_helper
+import numpy as np
+from api.base_api import BaseAPIRouter, init_helper, ImageOutput
 from fastapi.responses import JSONResponse
 from fastapi.encoders import jsonable_encoder
 from typing import Optional
 
 app_name = "upscaler_tpu"
+# 流水线各段之间队列的长度
+UPSCALER_QUEUE_SIZE = int(os.environ.get('UPSCALER_QUEUE_SIZE', 4))
+# 输出超过该大小（MB）时写入磁盘上的 memmap，而不是常驻内存的数组；
+# 未设置时取 64 MB 与当前可用内存的 1/8 中较小者（8K RGB 输出约 100 MB，总会落到 memmap 上）
+UPSCALER_MEMMAP_MB = os.environ.get('UPSCALER_MEMMAP_MB')
+UPSCALER_MEMMAP_DIR = os.environ.get('UPSCALER_MEMMAP_DIR') or None
+UPSCALER_MEMMAP_DEFAULT_MB = 64
+
+_DONE = object()
+
+
+def available_memory():
+    """当前可用内存（字节），取 /proc/meminfo 的 MemAvailable，取不到时为 None。"""
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+class TilePipeline:
+    """三段流水线的分块超分，各段之间由有界队列连接，互相重叠执行：
+
+    1. 切块线程：从边缘反射填充后的原图中切出带 padding 的块，归一化为 [1, 3, H, W] float32；
+    2. 调用 run() 的线程（应用工作线程）：逐块在 TPU 上推理；
+    3. 拼接线程：去掉 padding，按目标倍率缩放后写入预分配的输出数组。
+
+    块大小为模型输入尺寸减去两侧 padding，因此无需缩放输入块；模型的放大倍率由输出形状得到。
+    输出数组按 PIL 内部的 RGBX 布局（每像素 4 字节）分配，结果图像直接映射这块内存，编码 JPEG/WebP 时不再整体拷贝。
+    """
+    def __init__(self, engine, model_size=(200, 200), padding=20, queue_size=UPSCALER_QUEUE_SIZE,
+                 memmap_mb=UPSCALER_MEMMAP_MB, memmap_dir=UPSCALER_MEMMAP_DIR):
+        self.engine = engine
+        self.model_size = tuple(model_size)  # (宽, 高)
+        self.padding = padding
+        self.tile_size = (self.model_size[0] - 2 * padding, self.model_size[1] - 2 * padding)
+        self.queue_size = queue_size
+        self.memmap_bytes = int(memmap_mb) * 1024 * 1024 if memmap_mb is not None else None
+        self.memmap_dir = memmap_dir
+
+    def memmap_threshold(self):
+        if self.memmap_bytes is not None:
+            return self.memmap_bytes
+        available = available_memory()
+        default = UPSCALER_MEMMAP_DEFAULT_MB * 1024 * 1024
+        return min(default, available // 8) if available is not None else default
+
+    def tiles(self, image):
+        """按行优先生成 (x0, y0, 有效宽, 有效高, 输入张量)。"""
+        src = np.asarray(image.convert("RGB"))
+        height, width = src.shape[:2]
+        tw, th = self.tile_size
+        pad = self.padding
+        extra_h, extra_w = -height % th, -width % tw
+        mode = 'reflect' if min(height, width) > 1 else 'edge'
+        padded = np.pad(src, ((pad, pad + extra_h), (pad, pad + extra_w), (0, 0)), mode=mode)
+        for y0 in range(0, height, th):
+            for x0 in range(0, width, tw):
+                block = padded[y0:y0 + th + 2 * pad, x0:x0 + tw + 2 * pad]
+                tensor = block.transpose(2, 0, 1)[None].astype(np.float32, order='C')
+                tensor *= 1 / 255.0
+                yield x0, y0, min(tw, width - x0), min(th, height - y0), tensor
+
+    def infer(self, tensor):
+        return self.engine([tensor])[0][0]
+
+    def allocate(self, width, height):
+        # 第 4 个通道只为与 PIL 的内存布局对齐，不会被读取
+        shape = (height, width, 4)
+        if height * width * 4 > self.memmap_threshold():
+            # 匿名临时文件，关闭 memmap 后自动删除
+            return np.memmap(tempfile.TemporaryFile(dir=self.memmap_dir), dtype=np.uint8, mode='w+', shape=shape)
+        return np.empty(shape, dtype=np.uint8)
+
+    def blend(self, out, ratio, x0, y0, valid_w, valid_h, result):
+        scale = result.shape[-1] // self.model_size[0]
+        pad = self.padding * scale
+        block = result[:, pad:pad + valid_h * scale, pad:pad + valid_w * scale]
+        block = (np.clip(block, 0, 1) * 255).astype(np.uint8).transpose(1, 2, 0)
+        tx0, ty0 = round(x0 * ratio), round(y0 * ratio)
+        tx1 = min(round((x0 + valid_w) * ratio), out.shape[1])
+        ty1 = min(round((y0 + valid_h) * ratio), out.shape[0])
+        if block.shape[:2] != (ty1 - ty0, tx1 - tx0):
+            block = np.asarray(Image.fromarray(block).resize((tx1 - tx0, ty1 - ty0), Image.BICUBIC))
+        out[ty0:ty1, tx0:tx1, :3] = block
+
+    @staticmethod
+    def to_image(out):
+        """把 allocate() 的数组包装为 PIL 图像，与数组共享内存（模式为 RGBX，JPEG/WebP 可直接编码）。"""
+        height, width = out.shape[:2]
+        return Image.frombuffer("RGBX", (width, height), out, "raw", "RGBX", 0, 1)
+
+    def run(self, image, upscale_ratio):
+        width, height = image.size
+        out = self.allocate(round(width * upscale_ratio), round(height * upscale_ratio))
+        to_infer = queue.Queue(self.queue_size)
+        to_blend = queue.Queue(self.queue_size)
+        stop = threading.Event()
+        errors = []
+
+        def put(q, item):
+            # 下游出错退出后不再阻塞在满队列上
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def extract():
+            try:
+                for item in self.tiles(image):
+                    if not put(to_infer, item):
+                        return
+            except BaseException as e:
+                errors.append(e)
+                stop.set()
+            finally:
+                put(to_infer, _DONE)
+
+        def blend():
+            try:
+                while True:
+                    try:
+                        item = to_blend.get(timeout=0.1)
+                    except queue.Empty:
+                        if stop.is_set():
+                            return
+                        continue
+                    if item is _DONE:
+                        return
+                    self.blend(out, upscale_ratio, *item)
+            except BaseException as e:
+                errors.append(e)
+                stop.set()
+
+        workers = [threading.Thread(target=extract, name=f"{app_name}-extract", daemon=True),
+                   threading.Thread(target=blend, name=f"{app_name}-blend", daemon=True)]
+        for worker in workers:
+            worker.start()
+        try:
+            while not stop.is_set():
+                try:
+                    item = to_infer.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if item is _DONE:
+                    break
+                x0, y0, valid_w, valid_h, tensor = item
+                if not put(to_blend, (x0, y0, valid_w, valid_h, self.infer(tensor))):
+                    break
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            put(to_blend, _DONE)
+            for worker in workers:
+                worker.join()
+        if errors:
+            raise errors[0]
+        return self.to_image(out)
+
 
 class AppInitializationRouter(BaseAPIRouter):
     dir = f"repo/{app_name}"
+    memory_mb = 256  # 估计值
     @init_helper(dir)
     async def init_app(self):
         from repo.upscaler_tpu.pipeline import UpscaleModel
-        self.models = UpscaleModel(model='./resrgan4x.bmodel', padding=20)
+        self.models = UpscaleModel(model=self.path('resrgan4x.bmodel'), padding=20)
+        # 直接驱动 UpscaleModel 加载的引擎，用流水线替代其串行的 extract_and_enhance_tiles
+        self.pipeline = TilePipeline(self.models.model, model_size=getattr(self.models, 'model_size', (200, 200)),
+                                     padding=getattr(self.models, 'padding', 20))
         return {"message": f"Application {self.app_name} has been initialized successfully."}
     
+    async def warmup(self):
+        await self.execute(self.pipeline.run, Image.new("RGB", (64, 64)), 2.0)
+
     async def destroy_app(self):
         del self.models
+        del self.pipeline
     
 
 router = AppInitializationRouter(app_name=app_name)
@@ -26,18 +204,25 @@ router = AppInitializationRouter(app_name=app_name)
 
 ### 图像超分；兼容openai api，image/variations
 @router.post("/v1/images/variations")
-@change_dir(router.dir)
 async def upscale(
+    request: Request,
     image: UploadFile = File(...),
     upscale_ratio: Optional[float] = Form(1.0),
+    response_format: Optional[str] = Form(None),
+    output_format: Optional[str] = Form(None),
+    output_quality: Optional[int] = Form(None),
 ):
+    output = ImageOutput(request, response_format, output_format, output_quality)
     ori_image_bytes = await image.read()
-    src_image = Image.open(BytesIO(ori_image_bytes))
-    pil_res = router.models.extract_and_enhance_tiles(src_image, upscale_ratio=upscale_ratio)
-    # pil to base64
-    buffer = BytesIO()
-    pil_res.save(buffer, format='JPEG')
-    ret_img_b64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
+
+    def run_upscale():
+        src_image = Image.open(BytesIO(ori_image_bytes))
+        pil_res = router.pipeline.run(src_image, upscale_ratio)
+        return output.encode(pil_res)
+
+    ret_img_b64 = await router.execute(run_upscale)
+    if output.binary:
+        return output.response(ret_img_b64)
     content = {
                 "data": [
                     {
@@ -45,4 +230,4 @@ async def upscale(
                     }
                         ]
                 }
-    return JSONResponse(content=jsonable_encoder(content), media_type="application/json")
\ No newline at end of file
+    return JSONResponse(content=jsonable_encoder(content), media_type="application/json")
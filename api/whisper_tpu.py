@@ -1,12 +1,21 @@
+import json
+import time
+import asyncio
+import threading
 import numpy as np
-from subprocess import run, CalledProcessError
-from api.base_api import BaseAPIRouter, change_dir, init_helper
+from subprocess import run, CalledProcessError, Popen, PIPE
+from api.base_api import BaseAPIRouter, init_helper, metrics
 from typing import Optional
 from fastapi import File, Form, UploadFile
-from fastapi.responses import JSONResponse, PlainTextResponse
-from repo.whisper_tpu.python.bmwhisper.transcribe import transcribe
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 
 app_name = "whisper_tpu"
+SAMPLE_RATE = 16000
+# 流式转写的窗口长度，与 whisper 的 30 秒输入窗口一致
+WINDOW_SECONDS = 30
+UPLOAD_CHUNK = 1 << 20
+ASR_RTF = metrics.histogram('aigchub_asr_real_time_factor', 'Transcription wall time divided by audio duration.',
+                            (0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5))
 
 
 def load_audio(file: UploadFile, sr: int = 16000):
@@ -31,20 +40,76 @@ def load_audio(file: UploadFile, sr: int = 16000):
     return np.frombuffer(out, np.int16).astype(np.float32) / 32768.0
 
 
+class AudioStream:
+    """边解码边读取：上传文件分块写入 ffmpeg，按需读取 PCM，内存占用与音频总长度无关。"""
+    def __init__(self, file: UploadFile, sr: int = 16000):
+        self.file = file
+        self.sr = sr
+        self.proc = Popen(["ffmpeg", "-nostdin", "-loglevel", "error", "-threads", "0", "-i", "pipe:0",
+                           "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(sr), "pipe:1"],
+                          stdin=PIPE, stdout=PIPE, stderr=PIPE)
+        self.feeder = threading.Thread(target=self._feed, daemon=True)
+        self.feeder.start()
+
+    def _feed(self):
+        try:
+            while chunk := self.file.file.read(UPLOAD_CHUNK):
+                self.proc.stdin.write(chunk)
+        except (BrokenPipeError, ValueError):
+            pass  # ffmpeg 提前退出或流已关闭
+        finally:
+            try:
+                self.proc.stdin.close()
+            except BrokenPipeError:
+                pass
+            self.file.file.close()
+
+    def read(self, seconds: float):
+        """读取最多 seconds 秒的音频；返回空数组表示已到结尾。"""
+        data = self.proc.stdout.read(int(seconds * self.sr) * 2)
+        if not data:
+            self.proc.wait()
+            if self.proc.returncode:
+                raise RuntimeError(f"Failed to load audio: {self.proc.stderr.read().decode()}")
+        return np.frombuffer(data[:len(data) // 2 * 2], np.int16).astype(np.float32) / 32768.0
+
+    def close(self):
+        if self.proc.poll() is None:
+            self.proc.kill()
+        self.proc.wait()
+        self.feeder.join()
+        self.proc.stdout.close()
+        self.proc.stderr.close()
+
+
+def transcribe_args(language=None, prompt=None, verbose=True):
+    return {'verbose': verbose, 'task': 'transcribe', 'language': language, 'best_of': 5, 'beam_size': 5, 'patience': None, 'length_penalty': None,
+            'suppress_tokens': '-1', 'initial_prompt': prompt, 'condition_on_previous_text': True, 'compression_ratio_threshold': 2.4, 
+            'logprob_threshold': -1.0, 'no_speech_threshold': 0.6, 'word_timestamps': False, 'prepend_punctuations': '"\'“¿([{-', 'append_punctuations': '"\'.。,，!！?？:：”)]}、', 'padding_size': 448}
+
+
 class AppInitializationRouter(BaseAPIRouter):
     dir = f"repo/{app_name}"
+    memory_mb = 844
     @init_helper(dir)
     async def init_app(self):
         from repo.whisper_tpu.python.bmwhisper import load_model
+        from repo.whisper_tpu.python.bmwhisper.transcribe import transcribe
+        self.transcribe = transcribe
         args = {}
         args["model_name"]    = "base"
-        args["bmodel_dir"]    = "models/BM1684X"
+        args["bmodel_dir"]    = self.path("models/BM1684X")
         args["beam_size"]     = 5
         args["padding_size"]  = 448
         args["dev_id"]        = 0
         self.models = load_model(args)
         return {"message": f"应用 {self.app_name} 已成功初始化。"}
     
+    async def warmup(self):
+        # 一秒静音，走一遍编码器和解码器
+        await self.execute(lambda: self.transcribe(self.models, np.zeros(SAMPLE_RATE, dtype=np.float32), temperature=(0.0,),
+                                              **transcribe_args(language="en", verbose=False)))
+
     async def destroy_app(self):
         del self.models
 
@@ -53,7 +118,6 @@ router = AppInitializationRouter(app_name=app_name)
 
 ### ASR；兼容openai api，audio/transcriptions
 @router.post("/v1/audio/transcriptions")
-@change_dir(router.dir)
 async def whisper(
     file: UploadFile = File(...),
     model: Optional[str] = Form("base"),
@@ -61,7 +125,8 @@ async def whisper(
     prompt: Optional[str] = Form(None),
     response_format: Optional[str] = Form("json"),
     temperature: Optional[float] = Form(0.0),
-    timestamp_granularities: Optional[str] = Form(None)
+    timestamp_granularities: Optional[str] = Form(None),
+    stream: Optional[bool] = Form(False)
 ):
     # init whisper parameters
     language = None if language in ["", "string"] else language
@@ -73,15 +138,22 @@ async def whisper(
     else:
         temperature = [temperature]
 
-    # Load the audio
-    audio = load_audio(file)
-
-    args = {'verbose': True, 'task': 'transcribe', 'language': language, 'best_of': 5, 'beam_size': 5, 'patience': None, 'length_penalty': None,
-            'suppress_tokens': '-1', 'initial_prompt': prompt, 'condition_on_previous_text': True, 'compression_ratio_threshold': 2.4, 
-            'logprob_threshold': -1.0, 'no_speech_threshold': 0.6, 'word_timestamps': False, 'prepend_punctuations': '"\'“¿([{-', 'append_punctuations': '"\'.。,，!！?？:：”)]}、', 'padding_size': 448}
+    args = transcribe_args(language, prompt)
     
-    # Transcribe the audio
-    result = transcribe(router.models, audio, temperature=temperature, **args)
+    if stream:
+        return StreamingResponse(stream_transcribe(file, temperature, args), media_type="text/event-stream")
+
+    def run_transcribe():
+        # Load the audio
+        audio = load_audio(file)
+        # Transcribe the audio
+        start = time.perf_counter()
+        result = router.transcribe(router.models, audio, temperature=temperature, **args)
+        if len(audio):
+            ASR_RTF.observe((time.perf_counter() - start) / (len(audio) / SAMPLE_RATE), app=app_name)
+        return result
+
+    result = await router.execute(run_transcribe)
 
     # timestamp
     if timestamp_granularities is not None:
@@ -98,9 +170,62 @@ async def whisper(
         return PlainTextResponse(content=transcription_data["text"])
     else:
         return JSONResponse(content=transcription_data)
-    
+
+
+async def stream_transcribe(file: UploadFile, temperature, args):
+    """按 30 秒窗口转写，每个窗口定稿的 segment 立即以 SSE 事件发送。
+
+    窗口内最后一个 segment 可能被窗口边界截断，不立即定稿，而是从它的起点开始并入下一个窗口重新识别；
+    因此任何时刻内存中最多只有一个窗口的音频。
+    """
+    audio_stream = AudioStream(file, SAMPLE_RATE)
+    window_size = WINDOW_SECONDS * SAMPLE_RATE
+    carry = np.zeros(0, dtype=np.float32)
+    offset = 0.0  # carry 起点在整段音频中的时间
+    segment_id = 0
+    texts = []
+
+    def run_window(audio, prompt):
+        start = time.perf_counter()
+        result = router.transcribe(router.models, audio, temperature=temperature, **dict(args, initial_prompt=prompt))
+        ASR_RTF.observe((time.perf_counter() - start) / (len(audio) / SAMPLE_RATE), app=app_name)
+        return result
+
+    try:
+        finished = False
+        while not finished:
+            chunk = await asyncio.to_thread(audio_stream.read, (window_size - len(carry)) / SAMPLE_RATE)
+            finished = len(carry) + len(chunk) < window_size
+            window = np.concatenate([carry, chunk])
+            if not len(window):
+                break
+            # 以已定稿文本的末尾作为 prompt，对应 condition_on_previous_text
+            prompt = texts[-1] if texts and args['condition_on_previous_text'] else args['initial_prompt']
+            # 每个窗口单独排队，长音频不会长期独占模型线程
+            result = await router.execute(run_window, window, prompt)
+            segments = result["segments"]
+            cut = len(window)
+            if not finished and len(segments) > 1 and segments[-1]["start"] > 0:
+                cut = min(int(segments[-1]["start"] * SAMPLE_RATE), len(window)) or len(window)
+                segments = segments[:-1]
+            for segment in segments:
+                segment = dict(segment, id=segment_id, start=segment["start"] + offset, end=segment["end"] + offset)
+                segment_id += 1
+                texts.append(segment["text"])
+                yield f"data:{json.dumps({'type': 'transcript.text.delta', 'delta': segment['text'], 'segment': segment}, ensure_ascii=False)}\n\n"
+            offset += cut / SAMPLE_RATE
+            carry = window[cut:]
+        yield f"data:{json.dumps({'type': 'transcript.text.done', 'text': ''.join(texts)}, ensure_ascii=False)}\n\n"
+    finally:
+        audio_stream.close()
+
 
 #### 测试命令
 # curl http://localhost:8000/whisper_tpu/v1/audio/transcriptions \
 #   -F 'file=@/data/AigcHub-TPU/repo/whisper_tpu/datasets/test/demo.wav;type=audio/wav' \
 #   -F 'model=base'
+
+# 流式转写（SSE，每定稿一个 segment 推送一次）
+# curl -N http://localhost:8000/whisper_tpu/v1/audio/transcriptions \
+#   -F 'file=@/data/AigcHub-TPU/repo/whisper_tpu/datasets/test/demo.wav;type=audio/wav' \
+#   -F 'stream=true'
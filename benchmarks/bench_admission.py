@@ -0,0 +1,102 @@
+"""突发流量下的准入控制：一次并发发送大量请求，统计被接受与被 429 拒绝的请求数、
+被接受请求的延迟，以及 Retry-After 估计值与实际排空时间的对比。
+
+以 sd_lcm_tpu 文生图（mock 引擎）为例，每种限制配置在独立子进程中运行（配置通过环境变量在导入时读取）：
+    ADMISSION_MAX_CONCURRENCY  每个应用同时处理的请求数，0 表示不限制
+    ADMISSION_MAX_QUEUE        等待空位的请求数上限
+
+示例：
+    python benchmarks/bench_admission.py --burst 64 --limits 0:0 2:4 4:16 --output bench_admission.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import mock_engines
+
+PATH = "/sd_lcm_tpu/v1/images/generations"
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[int(round(q * (len(values) - 1)))]
+
+
+async def run_burst(burst, steps):
+    import httpx
+    import main_hub
+
+    app = main_hub.create_app(["sd_lcm_tpu"])
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://hub", timeout=600) as client:
+        async def post():
+            start = time.perf_counter()
+            response = await client.post(PATH, data={"prompt": "a cat", "seed": "-1", "num_inference_steps": str(steps)})
+            return response.status_code, response.headers.get("retry-after"), time.perf_counter() - start
+
+        # 预热：触发应用的懒加载，并让服务时间的滑动平均有初值
+        await post()
+        start = time.perf_counter()
+        results = await asyncio.gather(*(post() for _ in range(burst)))
+        drained = time.perf_counter() - start
+        stats = (await client.get("/admission")).json()["sd_lcm_tpu"]
+
+    accepted = [latency for status, _, latency in results if status == 200]
+    retry_after = [int(value) for status, value, _ in results if status == 429]
+    return {
+        "accepted": len(accepted),
+        "rejected": len(retry_after),
+        "other": sum(1 for status, _, _ in results if status not in (200, 429)),
+        "accepted_latency_p50": percentile(accepted, 0.5),
+        "accepted_latency_p99": percentile(accepted, 0.99),
+        "reject_latency_max": max((latency for status, _, latency in results if status == 429), default=None),
+        "retry_after_min": min(retry_after, default=None),
+        "retry_after_max": max(retry_after, default=None),
+        "drain_seconds": drained,
+        "service_seconds_ewma": stats["service_seconds"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Admission control under a request burst")
+    parser.add_argument('--burst', type=int, default=64, help='Concurrent requests in the burst')
+    parser.add_argument('--limits', nargs='+', default=["0:0", "2:4", "4:16"], help='max_concurrency:max_queue pairs')
+    parser.add_argument('--steps', type=int, default=4)
+    parser.add_argument('--latency', type=float, default=mock_engines.LATENCY, help='Simulated seconds per denoising step')
+    parser.add_argument('--output', type=str, default='bench_admission.json')
+    parser.add_argument('--run', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        mock_engines.install(tempfile.mkdtemp(prefix="aigchub_bench_"), latency=args.latency)
+        print(json.dumps(asyncio.run(run_burst(args.burst, args.steps))))
+        return
+
+    results = {}
+    for limits in args.limits:
+        concurrency, queue = limits.split(":")
+        env = dict(os.environ, ADMISSION_MAX_CONCURRENCY=concurrency, ADMISSION_MAX_QUEUE=queue)
+        out = subprocess.run([sys.executable, os.path.abspath(__file__), "--run", f"--burst={args.burst}",
+                              f"--steps={args.steps}", f"--latency={args.latency}"],
+                             env=env, check=True, capture_output=True, text=True).stdout
+        name = f"concurrency={concurrency},queue={queue}"
+        results[name] = json.loads(out.strip().splitlines()[-1])
+        print(name, json.dumps(results[name]))
+
+    report = {"config": {key: value for key, value in vars(args).items() if key not in ("output", "run")}, "results": results}
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
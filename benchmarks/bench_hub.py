@@ -0,0 +1,211 @@
+"""离线压测 hub 自身的开销：用 mock_engines 替换各应用的 TPU 引擎，经真实 HTTP 路由并发请求 main_hub。
+
+每个接口报告吞吐、p50/p99 延迟以及服务端事件循环的延迟（lag），结果写入 JSON，
+用于跟踪路由、编解码和中间件的性能回归。
+
+示例：
+    python benchmarks/bench_hub.py --apps rmbg llm_tpu --concurrency 8 --requests 200 --output bench_hub.json
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+import wave
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import mock_engines
+
+
+def png_bytes(width, height):
+    buffer = io.BytesIO()
+    Image.fromarray(np.random.RandomState(0).randint(0, 255, (height, width, 3), dtype=np.uint8)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def wav_bytes(seconds, sr=16000):
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sr)
+        t = np.arange(int(seconds * sr)) / sr
+        wav.writeframes((np.sin(2 * np.pi * 440 * t) * 8000).astype(np.int16).tobytes())
+    return buffer.getvalue()
+
+
+def chat_payload(stream):
+    return {"model": mock_engines.MOCK_LLM_BMODEL, "stream": stream,
+            "messages": [{"role": "system", "content": "You are a helpful assistant."},
+                         {"role": "user", "content": "hello"}]}
+
+
+# 每个应用要压测的接口：(名称, 路径, 构造 httpx 请求参数的函数)
+ENDPOINTS = {
+    "rmbg": [
+        ("rmbg.edit", "/rmbg/v1/images/edit",
+         lambda: {"files": {"image": ("image.png", png_bytes(512, 512), "image/png")}}),
+    ],
+    "sd_lcm_tpu": [
+        ("sd_lcm_tpu.generations", "/sd_lcm_tpu/v1/images/generations",
+         lambda: {"data": {"prompt": "a cat", "size": "512x512", "num_inference_steps": "4", "seed": "-1"}}),
+    ],
+    "llm_tpu": [
+        ("llm_tpu.chat", "/llm_tpu/v1/chat/completions", lambda: {"json": chat_payload(False)}),
+        ("llm_tpu.chat_stream", "/llm_tpu/v1/chat/completions", lambda: {"json": chat_payload(True)}),
+    ],
+    "whisper_tpu": [
+        ("whisper_tpu.transcriptions", "/whisper_tpu/v1/audio/transcriptions",
+         lambda: {"files": {"file": ("audio.wav", wav_bytes(5), "audio/wav")}}),
+    ],
+    "upscaler_tpu": [
+        ("upscaler_tpu.variations", "/upscaler_tpu/v1/images/variations",
+         lambda: {"files": {"image": ("image.png", png_bytes(256, 256), "image/png")}, "data": {"upscale_ratio": "2"}}),
+    ],
+}
+
+
+class LoopLagProbe:
+    """在服务端事件循环中周期性 sleep，记录实际唤醒时间比预期晚了多少。"""
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.samples = []
+        self.task = None
+
+    def wrap(self, app):
+        # 在服务端收到第一个 ASGI 事件（lifespan startup）时于其事件循环中启动探针
+        async def probed_app(scope, receive, send):
+            if self.task is None:
+                self.task = asyncio.get_running_loop().create_task(self.run())
+            await app(scope, receive, send)
+        return probed_app
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.samples.append(loop.time() - start - self.interval)
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[int(round(q * (len(values) - 1)))]
+
+
+def summarize(latencies, errors, elapsed, lag_samples):
+    return {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "throughput_rps": len(latencies) / elapsed if elapsed else None,
+        "latency_mean": sum(latencies) / len(latencies) if latencies else None,
+        "latency_p50": percentile(latencies, 0.5),
+        "latency_p99": percentile(latencies, 0.99),
+        "loop_lag_p50": percentile(lag_samples, 0.5),
+        "loop_lag_p99": percentile(lag_samples, 0.99),
+        "loop_lag_max": max(lag_samples) if lag_samples else None,
+    }
+
+
+async def drive(client, path, build, total, concurrency):
+    latencies, errors = [], 0
+    remaining = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for _ in remaining:
+            kwargs = build()
+            start = time.perf_counter()
+            try:
+                response = await client.post(path, **kwargs)
+                await response.aread()
+                ok = response.status_code == 200
+            except Exception:
+                ok = False
+            if ok:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, errors, time.perf_counter() - start
+
+
+async def run_benchmark(base_url, apps, total, concurrency, probe):
+    import httpx
+
+    results = {}
+    async with httpx.AsyncClient(base_url=base_url, timeout=600) as client:
+        for app in apps:
+            for name, path, build in ENDPOINTS[app]:
+                # 预热：触发应用的懒加载，不计入结果
+                await drive(client, path, build, 1, 1)
+                probe.samples.clear()
+                latencies, errors, elapsed = await drive(client, path, build, total, concurrency)
+                results[name] = summarize(latencies, errors, elapsed, list(probe.samples))
+                print(name, json.dumps(results[name]))
+    return results
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline AigcHub benchmark with mock TPU engines")
+    parser.add_argument('--apps', nargs='+', default=mock_engines.MOCK_APPS, choices=mock_engines.MOCK_APPS)
+    parser.add_argument('--requests', type=int, default=100, help='Requests per endpoint')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=mock_engines.LATENCY, help='Simulated seconds per engine call')
+    parser.add_argument('--token-latency', type=float, default=mock_engines.TOKEN_LATENCY, help='Simulated seconds per LLM decode step')
+    parser.add_argument('--output', type=str, default='bench_hub.json')
+    args = parser.parse_args()
+
+    import uvicorn
+
+    repo_dir = tempfile.mkdtemp(prefix="aigchub_bench_")
+    mock_engines.install(repo_dir, latency=args.latency, token_latency=args.token_latency)
+    import main_hub
+
+    app = main_hub.create_app(args.apps)
+    probe = LoopLagProbe()
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(probe.wrap(app), host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+
+    try:
+        results = asyncio.run(run_benchmark(f"http://127.0.0.1:{port}", args.apps, args.requests, args.concurrency, probe))
+    finally:
+        server.should_exit = True
+        thread.join(timeout=10)
+
+    report = {
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "endpoints": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""比较图像接口各输出方式的响应体积和单次请求的峰值内存。
+
+以 upscaler_tpu（mock 引擎，4 倍放大）为例，分别请求 b64_json 与 binary 下的 JPEG/PNG/WebP。
+每种方式在独立子进程中运行：先用小图预热，再记录一次大图请求前后进程 ru_maxrss 的增量，
+作为该请求的峰值 RSS 开销。
+
+示例：
+    python benchmarks/bench_image_response.py --size 512 --ratio 4 --output bench_image_response.json
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import mock_engines
+
+# (名称, 表单参数, 请求头)
+MODES = [
+    ("b64_json.jpeg", {}, {}),
+    ("binary.jpeg", {"response_format": "binary"}, {}),
+    ("binary.jpeg.q90", {"response_format": "binary", "output_quality": "90"}, {}),
+    ("binary.png", {"response_format": "binary", "output_format": "png"}, {}),
+    ("binary.webp", {"response_format": "binary", "output_format": "webp"}, {}),
+    ("accept.webp", {}, {"Accept": "image/webp"}),
+]
+
+
+def test_image(size):
+    # 平滑渐变加少量噪声，压缩率接近真实照片
+    y, x = np.mgrid[0:size, 0:size] / size
+    rgb = np.stack([x, y, (x + y) / 2], axis=-1) * 255
+    rgb += np.random.RandomState(0).normal(0, 8, rgb.shape)
+    buffer = io.BytesIO()
+    Image.fromarray(np.clip(rgb, 0, 255).astype(np.uint8)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def max_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+async def run_mode(mode, size, ratio):
+    import httpx
+    import main_hub
+
+    name, data, headers = next(m for m in MODES if m[0] == mode)
+    app = main_hub.create_app(["upscaler_tpu"])
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://hub") as client:
+        async def post(image):
+            response = await client.post("/upscaler_tpu/v1/images/variations", headers=headers,
+                                         files={"image": ("image.png", image, "image/png")},
+                                         data=dict(data, upscale_ratio=str(ratio)))
+            response.raise_for_status()
+            return response
+
+        await post(test_image(64))
+        image = test_image(size)
+        before = max_rss_kb()
+        response = await post(image)
+        peak = max_rss_kb() - before
+    return {"content_type": response.headers["content-type"], "bytes_on_wire": len(response.content), "peak_rss_delta_kb": peak}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Image response size and peak RSS per output mode")
+    parser.add_argument('--size', type=int, default=512, help='Input image side length')
+    parser.add_argument('--ratio', type=int, default=4, help='Upscale ratio')
+    parser.add_argument('--output', type=str, default='bench_image_response.json')
+    parser.add_argument('--mode', type=str, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        mock_engines.install(tempfile.mkdtemp(prefix="aigchub_bench_"), latency=0)
+        print(json.dumps(asyncio.run(run_mode(args.mode, args.size, args.ratio))))
+        return
+
+    results = {}
+    for name, _, _ in MODES:
+        out = subprocess.run([sys.executable, os.path.abspath(__file__), f"--mode={name}", f"--size={args.size}", f"--ratio={args.ratio}"],
+                             check=True, capture_output=True, text=True).stdout
+        results[name] = json.loads(out.strip().splitlines()[-1])
+        print(name, json.dumps(results[name]))
+
+    report = {"config": {"size": args.size, "ratio": args.ratio}, "modes": results}
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
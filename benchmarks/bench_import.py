@@ -0,0 +1,115 @@
+"""hub 启动的导入耗时分析：在子进程中用 `python -X importtime` 导入 main_hub 并为指定应用调用 create_app，
+再请求 `/`、`/docs` 和 `/openapi.json`，统计：
+    import_seconds / create_app_seconds   导入 main_hub 和注册应用路由的耗时（取多次运行的中位数）
+    packages                              按顶层包汇总的导入耗时（-X importtime 的 self 时间之和），取前 --top 个
+    heavy_modules_loaded                  启动并响应上述请求后已被导入的重型依赖（torch、模型库等）
+
+应用目录使用空的临时目录（AIGCHUB_REPO_DIR），不需要克隆应用仓库，也不加载任何模型；
+各应用的模型库只应在 init_app 或推理时才导入，因此这里不应出现在 heavy_modules_loaded 中。
+
+示例：
+    python benchmarks/bench_import.py --repeat 5 --output bench_import.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HUB_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, HUB_ROOT)
+
+# 模型推理相关的重型依赖；numpy、PIL 被各应用的预处理函数直接使用，不在此列，耗时见 packages
+HEAVY_MODULES = ["torch", "torchaudio", "transformers", "onnxruntime", "sophon", "sail", "cv2", "scipy",
+                 "librosa", "pydub", "soundfile", "sherpa_onnx", "repo"]
+IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+def all_apps():
+    with open(os.path.join(HUB_ROOT, "apps.txt")) as f:
+        return [line.split(",")[0].strip() for line in f if line.strip()]
+
+
+def run_child(apps):
+    start = time.perf_counter()
+    import main_hub
+    imported = time.perf_counter()
+    app = main_hub.create_app(apps)
+    created = time.perf_counter()
+
+    import httpx
+
+    async def serve_docs():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://hub") as client:
+            for path in ("/", "/docs", "/openapi.json"):
+                (await client.get(path)).raise_for_status()
+
+    asyncio.run(serve_docs())
+    print(json.dumps({
+        "import_seconds": imported - start,
+        "create_app_seconds": created - imported,
+        "heavy_modules_loaded": [name for name in HEAVY_MODULES if name in sys.modules],
+    }))
+
+
+def parse_importtime(stderr):
+    """按顶层包汇总 self 时间（微秒）。"""
+    packages = {}
+    for line in stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            package = match.group(4).split(".")[0]
+            packages[package] = packages.get(package, 0) + int(match.group(1))
+    return packages
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import-time profile of the hub startup")
+    parser.add_argument('--apps', nargs='+', default=None, help='Apps to register (default: all in apps.txt)')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--top', type=int, default=20)
+    parser.add_argument('--output', type=str, default='bench_import.json')
+    parser.add_argument('--run', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    apps = args.apps or all_apps()
+
+    if args.run:
+        run_child(apps)
+        return
+
+    repo_dir = tempfile.mkdtemp(prefix="aigchub_bench_")
+    for app in apps:
+        os.makedirs(os.path.join(repo_dir, app), exist_ok=True)
+    env = dict(os.environ, AIGCHUB_REPO_DIR=repo_dir, AIGCHUB_JOB_DB=os.path.join(repo_dir, "jobs.sqlite3"))
+
+    runs, packages = [], {}
+    for _ in range(args.repeat):
+        proc = subprocess.run([sys.executable, "-X", "importtime", os.path.abspath(__file__), "--run", "--apps", *apps],
+                              env=env, cwd=HUB_ROOT, capture_output=True, text=True)
+        if proc.returncode != 0:
+            sys.exit(proc.stderr[-2000:])
+        runs.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+        for package, us in parse_importtime(proc.stderr).items():
+            packages.setdefault(package, []).append(us)
+
+    ranked = sorted(((statistics.median(us) / 1e6, package) for package, us in packages.items()), reverse=True)
+    report = {
+        "config": {"apps": apps, "repeat": args.repeat},
+        "import_seconds": statistics.median(r["import_seconds"] for r in runs),
+        "create_app_seconds": statistics.median(r["create_app_seconds"] for r in runs),
+        "heavy_modules_loaded": runs[-1]["heavy_modules_loaded"],
+        "packages": {package: seconds for seconds, package in ranked[:args.top]},
+    }
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""测量 InitMiddleware 的单请求开销和 SSE 首包时间（TTFT）。
+
+用一个不加载任何模型的桩应用（BaseAPIRouter 子类）直接调用 ASGI 接口，不经过 HTTP 客户端，
+分别在不加中间件（none）和加 InitMiddleware（init）两种方式下测量：
+    ping     返回小 JSON 的接口，报告每个请求的平均/p50/p99 耗时
+    stream   StreamingResponse 的 SSE 接口，报告首个 body 块的到达时间（TTFT）、整个流的耗时，
+             以及收到的 body 块数（应等于事件数，说明流没有被缓冲合并）
+两种方式的差值即中间件的开销。
+
+示例：
+    python benchmarks/bench_middleware.py --requests 5000 --events 100 --output bench_middleware.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+APP_NAME = "stub"
+
+
+def build_app(with_middleware, events):
+    from fastapi import FastAPI
+    from fastapi.responses import StreamingResponse
+    from api.base_api import BaseAPIRouter, InitMiddleware, ModelResidencyManager
+
+    class StubRouter(BaseAPIRouter):
+        async def init_app(self):
+            return {}
+
+        async def destroy_app(self):
+            return {}
+
+    router = StubRouter(app_name=APP_NAME)
+
+    @router.get("/ping")
+    async def ping():
+        return {"ok": True}
+
+    @router.get("/stream")
+    async def stream():
+        async def events_iter():
+            for i in range(events):
+                yield f"data: {i}\n\n"
+                await asyncio.sleep(0)
+        return StreamingResponse(events_iter(), media_type="text/event-stream")
+
+    app = FastAPI()
+    if with_middleware:
+        app.add_middleware(InitMiddleware, residency=ModelResidencyManager([router]))
+    app.include_router(router, prefix="/" + APP_NAME)
+    return app
+
+
+async def call(app, path):
+    """直接调用 ASGI 应用，返回 (首个非空 body 块的耗时, 总耗时, 非空 body 块数)。"""
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+             "path": path, "raw_path": path.encode(), "root_path": "", "query_string": b"", "headers": [],
+             "client": ("127.0.0.1", 1234), "server": ("hub", 80)}
+    done = asyncio.Event()
+    request_sent = False
+    first, chunks = None, 0
+    start = time.perf_counter()
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal first, chunks
+        if message["type"] == "http.response.body":
+            if message.get("body"):
+                chunks += 1
+                if first is None:
+                    first = time.perf_counter() - start
+            if not message.get("more_body", False):
+                done.set()
+
+    await app(scope, receive, send)
+    done.set()
+    return first, time.perf_counter() - start, chunks
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[int(round(q * (len(values) - 1)))]
+
+
+async def measure(app, requests, streams):
+    # 预热：触发桩应用的初始化
+    await call(app, f"/{APP_NAME}/ping")
+    ping = [(await call(app, f"/{APP_NAME}/ping"))[1] for _ in range(requests)]
+    stream = [await call(app, f"/{APP_NAME}/stream") for _ in range(streams)]
+    return {
+        "ping_mean_us": sum(ping) / len(ping) * 1e6,
+        "ping_p50_us": percentile(ping, 0.5) * 1e6,
+        "ping_p99_us": percentile(ping, 0.99) * 1e6,
+        "stream_ttft_p50_us": percentile([s[0] for s in stream], 0.5) * 1e6,
+        "stream_total_p50_us": percentile([s[1] for s in stream], 0.5) * 1e6,
+        "stream_chunks": stream[-1][2],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="InitMiddleware per-request overhead and SSE TTFT")
+    parser.add_argument('--requests', type=int, default=5000, help='ping requests per mode')
+    parser.add_argument('--streams', type=int, default=200, help='SSE streams per mode')
+    parser.add_argument('--events', type=int, default=100, help='Events per SSE stream')
+    parser.add_argument('--output', type=str, default='bench_middleware.json')
+    args = parser.parse_args()
+
+    repo_dir = tempfile.mkdtemp(prefix="aigchub_bench_")
+    os.makedirs(os.path.join(repo_dir, APP_NAME))
+    os.environ['AIGCHUB_REPO_DIR'] = repo_dir
+
+    results = {}
+    for mode in ("none", "init"):
+        app = build_app(mode == "init", args.events)
+        results[mode] = asyncio.run(measure(app, args.requests, args.streams))
+        print(mode, json.dumps(results[mode]))
+    results["overhead"] = {
+        "ping_mean_us": results["init"]["ping_mean_us"] - results["none"]["ping_mean_us"],
+        "stream_ttft_p50_us": results["init"]["stream_ttft_p50_us"] - results["none"]["stream_ttft_p50_us"],
+        "stream_total_p50_us": results["init"]["stream_total_p50_us"] - results["none"]["stream_total_p50_us"],
+    }
+    print("overhead", json.dumps(results["overhead"]))
+
+    report = {"config": {key: value for key, value in vars(args).items() if key != "output"}, "results": results}
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
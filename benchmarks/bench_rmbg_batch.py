@@ -0,0 +1,96 @@
+"""测量 rmbg 微批处理的收益：mock 引擎按静态批大小计费（批越大单张越便宜），
+分别以不同的编译批大小并发请求 /rmbg/v1/images/edit，比较吞吐、延迟和引擎调用次数。
+
+每种配置在独立子进程中运行，保证引擎按该配置重新加载。
+
+示例：
+    python benchmarks/bench_rmbg_batch.py --batches 1 4 8 --requests 64 --concurrency 16 --output bench_rmbg_batch.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import mock_engines
+from bench_hub import percentile, png_bytes
+
+
+async def run_config(total, concurrency, images_per_request):
+    import httpx
+    import main_hub
+
+    app = main_hub.create_app(["rmbg"])
+    image = png_bytes(256, 256)
+    files = [("image", (f"image{i}.png", image, "image/png")) for i in range(images_per_request)]
+    latencies = []
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://hub", timeout=600) as client:
+        async def post():
+            start = time.perf_counter()
+            response = await client.post("/rmbg/v1/images/edit", files=files)
+            response.raise_for_status()
+            assert len(response.json()["data"]) == images_per_request
+            latencies.append(time.perf_counter() - start)
+
+        await post()  # 预热：加载模型
+        latencies.clear()
+        remaining = iter(range(total))
+
+        async def worker():
+            for _ in remaining:
+                await post()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        stats = (await client.get("/rmbg/v1/batch/stats")).json()
+
+    router = sys.modules["rmbg"].router  # main_hub 以模块名 rmbg 导入
+    return {"images_per_second": total * images_per_request / elapsed,
+            "latency_mean": sum(latencies) / len(latencies),
+            "latency_p50": percentile(latencies, 0.5), "latency_p99": percentile(latencies, 0.99),
+            "engine_calls": router.model.calls, "mean_batch_size": stats["mean_batch_size"]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="rmbg micro-batching speedup with a fake engine")
+    parser.add_argument('--batches', type=int, nargs='+', default=[1, 4, 8], help='Compiled batch sizes to compare')
+    parser.add_argument('--requests', type=int, default=64)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--images-per-request', type=int, default=1, help='Images per multi-image upload')
+    parser.add_argument('--latency', type=float, default=mock_engines.LATENCY)
+    parser.add_argument('--output', type=str, default='bench_rmbg_batch.json')
+    parser.add_argument('--batch', type=int, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.batch:
+        mock_engines.install(tempfile.mkdtemp(prefix="aigchub_bench_"), latency=args.latency, rmbg_batch=args.batch)
+        print(json.dumps(asyncio.run(run_config(args.requests, args.concurrency, args.images_per_request))))
+        return
+
+    results = {}
+    for batch in args.batches:
+        out = subprocess.run([sys.executable, os.path.abspath(__file__), f"--batch={batch}", f"--requests={args.requests}",
+                              f"--concurrency={args.concurrency}", f"--images-per-request={args.images_per_request}",
+                              f"--latency={args.latency}"], check=True, capture_output=True, text=True).stdout
+        results[f"batch_{batch}"] = json.loads(out.strip().splitlines()[-1])
+        print(f"batch_{batch}", json.dumps(results[f"batch_{batch}"]))
+
+    base = results.get(f"batch_{args.batches[0]}")
+    for result in results.values():
+        result["speedup"] = result["images_per_second"] / base["images_per_second"]
+
+    report = {"config": {key: value for key, value in vars(args).items() if key not in ("output", "batch")}, "results": results}
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
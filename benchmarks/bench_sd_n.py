@@ -0,0 +1,88 @@
+"""比较 sd_lcm_tpu 文生图一次请求生成 n 张与 n 次单张请求的单张摊销延迟。
+
+每轮使用新的提示词（避免命中上一轮的提示词编码缓存），seed 固定为 -1（不走结果缓存）。
+分别测量：
+    batched      一次 n=N 的请求
+    sequential   N 次 n=1 的请求，依次发送
+    concurrent   N 次 n=1 的请求，同时发送
+报告每种方式的总耗时和单张摊销延迟（总耗时 / N）。
+
+示例：
+    python benchmarks/bench_sd_n.py --n 1 2 4 8 --steps 4 --rounds 5 --output bench_sd_n.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import mock_engines
+
+PATH = "/sd_lcm_tpu/v1/images/generations"
+
+
+async def run_benchmark(counts, steps, rounds):
+    import httpx
+    import main_hub
+
+    app = main_hub.create_app(["sd_lcm_tpu"])
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://hub", timeout=600) as client:
+        async def post(prompt, n):
+            response = await client.post(PATH, data={"prompt": prompt, "size": "512x512", "seed": "-1",
+                                                     "num_inference_steps": str(steps), "n": str(n)})
+            response.raise_for_status()
+            assert len(response.json()["data"]) == n, response.text
+            return response
+
+        async def batched(prompt, n):
+            await post(prompt, n)
+
+        async def sequential(prompt, n):
+            for _ in range(n):
+                await post(prompt, 1)
+
+        async def concurrent(prompt, n):
+            await asyncio.gather(*(post(prompt, 1) for _ in range(n)))
+
+        # 预热：触发应用的懒加载
+        await post("warmup", 1)
+        results = {}
+        for n in counts:
+            results[n] = {}
+            for name, run in (("batched", batched), ("sequential", sequential), ("concurrent", concurrent)):
+                elapsed = []
+                for r in range(rounds):
+                    start = time.perf_counter()
+                    await run(f"a cat, {name} n={n} round {r}", n)
+                    elapsed.append(time.perf_counter() - start)
+                mean = sum(elapsed) / len(elapsed)
+                results[n][name] = {"total_mean": mean, "per_image": mean / n}
+            print(f"n={n}", json.dumps(results[n]))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Amortized per-image latency of n>1 image generation")
+    parser.add_argument('--n', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--steps', type=int, default=4, help='num_inference_steps per image')
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=mock_engines.LATENCY, help='Simulated seconds per denoising step / text encode')
+    parser.add_argument('--output', type=str, default='bench_sd_n.json')
+    args = parser.parse_args()
+
+    mock_engines.install(tempfile.mkdtemp(prefix="aigchub_bench_"), latency=args.latency)
+    results = asyncio.run(run_benchmark(args.n, args.steps, args.rounds))
+
+    report = {"config": {key: value for key, value in vars(args).items() if key != "output"}, "results": results}
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""测量 sd_lcm_tpu 在多种宽高比交替请求下的形状切换开销。
+
+多个客户端并发发送文生图请求，尺寸在 --sizes 之间轮换（seed=-1，不走结果缓存）。
+分别在以下配置下运行（每种配置一个子进程，因为配置通过环境变量在导入时读取）：
+    SD_SHAPE_BUCKETS      同时保留的形状桶个数
+    EXECUTOR_GROUP_BURST  同形状任务最多连续插队的个数，0 表示按到达顺序执行
+报告吞吐、平均/p99 延迟，以及 /v1/shape_buckets/stats 中各形状桶的切换次数和平均切换耗时。
+
+示例：
+    python benchmarks/bench_sd_shapes.py --requests 48 --concurrency 8 --output bench_sd_shapes.json
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import mock_engines
+
+PATH = "/sd_lcm_tpu/v1/images/generations"
+# (SD_SHAPE_BUCKETS, EXECUTOR_GROUP_BURST)
+CONFIGS = [(1, 0), (1, 4), (3, 0), (3, 4)]
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[int(round(q * (len(values) - 1)))]
+
+
+async def run_config(sizes, total, concurrency, steps):
+    import httpx
+    import main_hub
+
+    app = main_hub.create_app(["sd_lcm_tpu"])
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://hub", timeout=600) as client:
+        async def post(size):
+            response = await client.post(PATH, data={"prompt": "a cat", "size": size, "seed": "-1",
+                                                     "num_inference_steps": str(steps)})
+            response.raise_for_status()
+
+        # 预热：触发应用的懒加载
+        await post("512x512")
+        requests = itertools.islice(itertools.cycle(sizes), total)
+        latencies = []
+
+        async def worker():
+            for size in requests:
+                start = time.perf_counter()
+                await post(size)
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        stats = (await client.get("/sd_lcm_tpu/v1/shape_buckets/stats")).json()
+
+    buckets = {shape: {"requests": s["requests"], "switches": s["switches"],
+                       "switch_seconds_mean": s["switch_seconds"] / s["switches"] if s["switches"] else 0.0}
+               for shape, s in stats["buckets"].items()}
+    return {"throughput_rps": total / elapsed, "latency_mean": sum(latencies) / len(latencies),
+            "latency_p99": percentile(latencies, 0.99), "buckets": buckets}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shape bucket switching cost of sd_lcm_tpu")
+    parser.add_argument('--sizes', nargs='+', default=["512x512", "640x960", "960x640"])
+    parser.add_argument('--requests', type=int, default=48)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--steps', type=int, default=4)
+    parser.add_argument('--latency', type=float, default=mock_engines.LATENCY, help='Simulated seconds per denoising step')
+    parser.add_argument('--output', type=str, default='bench_sd_shapes.json')
+    parser.add_argument('--run', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        mock_engines.install(tempfile.mkdtemp(prefix="aigchub_bench_"), latency=args.latency)
+        print(json.dumps(asyncio.run(run_config(args.sizes, args.requests, args.concurrency, args.steps))))
+        return
+
+    results = {}
+    for buckets, burst in CONFIGS:
+        env = dict(os.environ, SD_SHAPE_BUCKETS=str(buckets), EXECUTOR_GROUP_BURST=str(burst))
+        out = subprocess.run([sys.executable, os.path.abspath(__file__), "--run", "--sizes", *args.sizes,
+                              f"--requests={args.requests}", f"--concurrency={args.concurrency}",
+                              f"--steps={args.steps}", f"--latency={args.latency}"],
+                             env=env, check=True, capture_output=True, text=True).stdout
+        name = f"buckets={buckets},burst={burst}"
+        results[name] = json.loads(out.strip().splitlines()[-1])
+        print(name, json.dumps(results[name]))
+
+    report = {"config": {key: value for key, value in vars(args).items() if key not in ("output", "run")}, "results": results}
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
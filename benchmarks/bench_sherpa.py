@@ -0,0 +1,120 @@
+"""对比 sherpa 的两种调用方式：每次请求启动一次 sherpa-onnx，与常驻的 SherpaWorker。
+
+两者都使用 stub_sherpa.py 模拟模型加载和识别耗时，因此无需 TPU 设备；
+此外会让 worker 中途崩溃一次、卡住一次，确认其能自动重启，且卡住的请求在截止时间后失败。
+
+示例：
+    python benchmarks/bench_sherpa.py --requests 20 --load-seconds 1.0 --output bench_sherpa.json
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import wave
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_hub import percentile
+
+STUB = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stub_sherpa.py")
+
+
+def wav_bytes(seconds, sr=16000):
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sr)
+        wav.writeframes(np.zeros(int(seconds * sr), np.int16).tobytes())
+    return buffer.getvalue()
+
+
+def measure(fn, total):
+    latencies = []
+    for _ in range(total):
+        start = time.perf_counter()
+        result = fn()
+        latencies.append(time.perf_counter() - start)
+        assert result["text"].startswith("stub"), result
+    return {"requests": total, "latency_mean": sum(latencies) / total,
+            "latency_p50": percentile(latencies, 0.5), "latency_p99": percentile(latencies, 0.99)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-request sherpa-onnx spawn vs persistent worker")
+    parser.add_argument('--requests', type=int, default=20)
+    parser.add_argument('--seconds', type=float, default=5.0, help='Audio length per request')
+    parser.add_argument('--load-seconds', type=float, default=1.0, help='Simulated model load time')
+    parser.add_argument('--decode-seconds', type=float, default=0.02, help='Simulated decode time')
+    parser.add_argument('--output', type=str, default='bench_sherpa.json')
+    args = parser.parse_args()
+
+    # api.sherpa 导入时会检查应用目录，这里给它一个空目录
+    repo_dir = tempfile.mkdtemp(prefix="aigchub_bench_")
+    os.makedirs(os.path.join(repo_dir, "sherpa"))
+    os.environ['AIGCHUB_REPO_DIR'] = repo_dir
+    from api.sherpa import SherpaWorker, run_shell_command
+
+    audio = wav_bytes(args.seconds)
+    stub = [sys.executable, STUB, f"--load-seconds={args.load_seconds}", f"--decode-seconds={args.decode_seconds}"]
+    results = {}
+
+    with tempfile.NamedTemporaryFile(suffix=".wav") as tmp:
+        tmp.write(audio)
+        tmp.flush()
+        results["spawn"] = measure(lambda: run_shell_command(" ".join(stub + [tmp.name])), args.requests)
+    print("spawn", json.dumps(results["spawn"]))
+
+    worker = SherpaWorker(stub + ["--worker"])
+    start = time.perf_counter()
+    worker.start()
+    startup = time.perf_counter() - start
+    try:
+        results["worker"] = measure(lambda: worker.recognize(audio), args.requests)
+    finally:
+        worker.close()
+    results["worker"]["startup_seconds"] = startup
+    print("worker", json.dumps(results["worker"]))
+
+    # worker 处理 2 个请求后崩溃，第 3 个请求应触发重启并成功返回
+    worker = SherpaWorker(stub + ["--worker", "--crash-after=2"])
+    worker.start()
+    try:
+        for _ in range(3):
+            worker.recognize(audio)
+        results["worker_restarts"] = worker.restarts
+    finally:
+        worker.close()
+    print("worker restarts after crash:", results["worker_restarts"])
+
+    # worker 处理 1 个请求后卡住：第 2 个请求应在截止时间后超时，进程被重启，第 3 个请求正常返回
+    worker = SherpaWorker(stub + ["--worker", "--hang-after=1"], request_timeout=args.load_seconds + 1)
+    worker.start()
+    try:
+        worker.recognize(audio)
+        start = time.perf_counter()
+        try:
+            worker.recognize(audio)
+            raise AssertionError("hung worker did not time out")
+        except TimeoutError:
+            results["worker_timeout_seconds"] = time.perf_counter() - start
+        assert worker.recognize(audio)["text"].startswith("stub")
+        results["worker_timeouts"] = worker.timeouts
+    finally:
+        worker.close()
+    print("worker timeout after hang:", results["worker_timeout_seconds"])
+
+    report = {"config": {key: value for key, value in vars(args).items() if key != "output"}, "results": results}
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+"""离线 benchmark 用的 TPU 引擎替身。
+
+install() 在 sys.modules 中注册各应用上游模块的桩实现，并在 repo_dir 下创建
+BaseAPIRouter 需要的应用目录；之后再导入 main_hub，就可以在没有 Sophon 设备、
+也没有克隆应用仓库的机器上跑通 hub 自身的路由、编解码和中间件。
+所有替身的输出都是确定的，每次推理固定 sleep 一段时间模拟 TPU 耗时。
+"""
+import os
+import sys
+import time
+import types
+
+import numpy as np
+from PIL import Image
+
+MOCK_APPS = ["rmbg", "sd_lcm_tpu", "llm_tpu", "whisper_tpu", "upscaler_tpu"]
+
+# 每次引擎调用的模拟耗时（秒）；LLM 为每个 token 的耗时
+LATENCY = 0.05
+TOKEN_LATENCY = 0.005
+# 静态批 bmodel 的批大小，以及批内每多一个样本增加的耗时（相对 LATENCY 的比例）
+RMBG_BATCH = 1
+BATCH_ITEM_COST = 0.25
+# SD pipeline 加载模型、切换 unet/vae 形状的耗时（相对 LATENCY 的倍数）
+SD_LOAD_COST = 20
+SD_SHAPE_SWITCH_COST = 10
+
+MOCK_LLM_BMODEL = "mock-1b_int4_seq512_1dev.bmodel"
+MOCK_LLM_REPLY = "你好，这是离线 benchmark 的固定回复。Hello from the mock pipeline! 🚀✨"
+
+
+class _MockSailEngine:
+    # 只提供 compiled_batch_size 用到的 sail.Engine.get_input_shape
+    def __init__(self, batch):
+        self.batch = batch
+
+    def get_input_shape(self, graph_name, input_name):
+        return [self.batch, 3, 1024, 1024]
+
+
+class MockEngineOV:
+    """rmbg / upscaler 使用的 EngineOV 替身：输入 [NCHW]，输出同尺寸的单通道结果。
+
+    按静态批大小 batch 编译：每次调用的耗时为 LATENCY * (1 + BATCH_ITEM_COST * (batch - 1))。
+    """
+    def __init__(self, model_path, device_id=0, batch=None):
+        self.model_path = model_path
+        self.device_id = device_id
+        self.batch = batch or RMBG_BATCH
+        self.model = _MockSailEngine(self.batch)
+        self.graph_name = "mock"
+        self.input_name = ["input"]
+        self.calls = 0
+
+    def __call__(self, inputs):
+        self.calls += 1
+        time.sleep(LATENCY * (1 + BATCH_ITEM_COST * (self.batch - 1)))
+        x = inputs[0]
+        return [np.full((x.shape[0], 1) + tuple(x.shape[2:]), 0.5, dtype=np.float32)]
+
+
+class MockStableDiffusionPipeline:
+    def __init__(self, basic_model=None, controlnet_name=None, scheduler=None):
+        self.basic_model = basic_model
+        self.scheduler = scheduler
+        self.width, self.height = 512, 512
+        # 与上游一样：文本编码器与分辨率无关，unet/vae 按分辨率各加载一份
+        self.text_encoder = MockEngineOV(f"{basic_model}/text_encoder.bmodel")
+        self.unet = MockEngineOV(f"{basic_model}/unet_512_512.bmodel")
+        time.sleep(LATENCY * SD_LOAD_COST)
+
+    def set_height_width(self, width, height):
+        if (width, height) != (self.width, self.height):
+            time.sleep(LATENCY * SD_SHAPE_SWITCH_COST)
+            self.unet = MockEngineOV(f"{self.basic_model}/unet_{width}_{height}.bmodel")
+        self.width, self.height = width, height
+
+    def _encode_prompt(self, prompt, do_classifier_free_guidance=True, negative_prompt=None):
+        # 文本编码器耗时按一个去噪步计
+        time.sleep(LATENCY)
+        rng = np.random.RandomState(len(prompt or '') + len(negative_prompt or ''))
+        return rng.rand(2 if do_classifier_free_guidance else 1, 77, 768).astype(np.float32)
+
+    def __call__(self, prompt=None, negative_prompt=None, num_inference_steps=4, guidance_scale=1.0, seeds=None, **kwargs):
+        self._encode_prompt(prompt, guidance_scale > 1.0, negative_prompt)
+        time.sleep(LATENCY * num_inference_steps)
+        seed = seeds[0] if seeds else 0
+        color = (seed % 256, (seed // 256) % 256, len(prompt or '') % 256)
+        return Image.new("RGB", (self.width, self.height), color)
+
+    def wrap_upscale(self, init_image=None, upscale_factor=2, num_inference_steps=4, **kwargs):
+        time.sleep(LATENCY * num_inference_steps)
+        image = init_image.convert("RGB")
+        return image.resize((image.width * upscale_factor, image.height * upscale_factor))
+
+
+class MockTokenizer:
+    """按 UTF-8 字节切分的分词器，多字节字符会被拆成多个 token。"""
+    EOS = 256
+
+    def apply_chat_template(self, messages, tokenize=True, add_generation_prompt=True):
+        text = "".join(m["content"] for m in messages if isinstance(m.get("content"), str))
+        return list(text.encode("utf-8"))[-256:] or [0]
+
+    def decode(self, tokens, skip_special_tokens=False):
+        return bytes(t for t in tokens if t < 256).decode("utf-8", errors="replace")
+
+
+class MockChatModel:
+    SEQLEN = 512
+
+    def __init__(self, reply_tokens, eos):
+        self.reply_tokens = reply_tokens
+        self.eos = eos
+        self.token_length = 0
+        self._step = 0
+
+    def _next(self):
+        if self._step >= len(self.reply_tokens):
+            return self.eos
+        token = self.reply_tokens[self._step]
+        self._step += 1
+        return token
+
+    def forward_first(self, tokens):
+        time.sleep(LATENCY)
+        self.token_length = len(tokens)
+        self._step = 0
+        return self._next()
+
+    def forward_next(self):
+        time.sleep(TOKEN_LATENCY)
+        self.token_length += 1
+        return self._next()
+
+
+class MockLLMPipeline:
+    def __init__(self, args):
+        self.args = args
+        self.tokenizer = MockTokenizer()
+        self.EOS = MockTokenizer.EOS
+        self.model = MockChatModel(list(MOCK_LLM_REPLY.encode("utf-8")), self.EOS)
+
+    def clear(self):
+        pass
+
+
+class MockWhisperModel:
+    pass
+
+
+def mock_load_model(args):
+    return MockWhisperModel()
+
+
+def mock_transcribe(model, audio, temperature=None, **kwargs):
+    seconds = len(audio) / 16000
+    # 按 whisper 的 30 秒窗口计费
+    time.sleep(LATENCY * max(1, int(np.ceil(seconds / 30))))
+    text = f"mock transcription of {seconds:.1f} seconds"
+    return {"text": text, "segments": [{"id": 0, "start": 0.0, "end": seconds, "text": text}], "language": "en"}
+
+
+class MockESRGANEngine:
+    """RealESRGAN 替身：输入 [1, 3, H, W]，输出最近邻放大 4 倍的 [1, 3, 4H, 4W]。"""
+    def __init__(self, model_path=None):
+        self.model_path = model_path
+        self.calls = 0
+
+    def __call__(self, inputs):
+        self.calls += 1
+        time.sleep(LATENCY)
+        x = inputs[0]
+        return [x.repeat(4, axis=2).repeat(4, axis=3)]
+
+
+class MockUpscaleModel:
+    def __init__(self, model=None, padding=20, tile_size=(196, 196), model_size=(200, 200), upscale_rate=4):
+        self.model = MockESRGANEngine(model)
+        self.padding = padding
+        self.tile_size = tile_size
+        self.model_size = model_size
+        self.upscale_rate = upscale_rate
+
+    def extract_and_enhance_tiles(self, image, upscale_ratio=2.0):
+        image = image.convert("RGB")
+        tiles = int(np.ceil(image.width / self.tile_size[0]) * np.ceil(image.height / self.tile_size[1]))
+        time.sleep(LATENCY * tiles)
+        return image.resize((int(image.width * upscale_ratio), int(image.height * upscale_ratio)))
+
+
+def _register(name, **attrs):
+    parts = name.split('.')
+    for i in range(1, len(parts)):
+        parent_name = '.'.join(parts[:i])
+        if parent_name not in sys.modules:
+            parent = types.ModuleType(parent_name)
+            parent.__path__ = []
+            sys.modules[parent_name] = parent
+    module = types.ModuleType(name)
+    module.__path__ = []
+    module.__dict__.update(attrs)
+    sys.modules[name] = module
+    if len(parts) > 1:
+        setattr(sys.modules['.'.join(parts[:-1])], parts[-1], module)
+    return module
+
+
+def install(repo_dir, latency=LATENCY, token_latency=TOKEN_LATENCY, rmbg_batch=RMBG_BATCH):
+    """注册所有替身模块并在 repo_dir 下准备应用目录。需在导入 api.base_api 之前调用。
+
+    异步任务数据库和结果缓存也放在 repo_dir 下，benchmark 不会写入生产环境的 jobs.sqlite3 和 cache/。
+    """
+    global LATENCY, TOKEN_LATENCY, RMBG_BATCH
+    LATENCY = latency
+    TOKEN_LATENCY = token_latency
+    RMBG_BATCH = rmbg_batch
+    os.environ['AIGCHUB_REPO_DIR'] = repo_dir
+    os.environ['AIGCHUB_JOB_DB'] = os.path.join(repo_dir, 'jobs.sqlite3')
+    os.environ['AIGCHUB_CACHE_DIR'] = os.path.join(repo_dir, 'cache')
+
+    for app in MOCK_APPS:
+        os.makedirs(os.path.join(repo_dir, app), exist_ok=True)
+    os.makedirs(os.path.join(repo_dir, "llm_tpu", "llm_bmodels"), exist_ok=True)
+    os.makedirs(os.path.join(repo_dir, "llm_tpu", "llm_models", "mock", "token_config"), exist_ok=True)
+    with open(os.path.join(repo_dir, "llm_tpu", "llm_bmodels", MOCK_LLM_BMODEL), "wb") as f:
+        f.write(b"\0" * 1024)
+
+    _register("repo.rmbg.python.npuengine", EngineOV=MockEngineOV)
+    _register("repo.sd_lcm_tpu.sd", StableDiffusionPipeline=MockStableDiffusionPipeline)
+    _register("llm_models.mock.python_demo.pipeline", mock=MockLLMPipeline)
+    _register("repo.whisper_tpu.python.bmwhisper", load_model=mock_load_model)
+    _register("repo.whisper_tpu.python.bmwhisper.transcribe", transcribe=mock_transcribe)
+    _register("repo.upscaler_tpu.pipeline", UpscaleModel=MockUpscaleModel)
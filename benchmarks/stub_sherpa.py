@@ -0,0 +1,54 @@
+"""sherpa-onnx 的替身可执行文件，供 bench_sherpa.py 和 tests/test_sherpa_worker.py 使用。
+
+不带 --worker 时模拟 build/bin/sherpa-onnx 命令行：每次启动都要“加载模型”，识别一个 wav 后打印日志和 JSON 结果；
+带 --worker 时通过 api/sherpa_worker.py 的帧协议常驻运行，只加载一次模型。
+--crash-after N 让 worker 处理 N 个请求后异常退出，--hang-after N 让其处理 N 个请求后不再响应，用于验证自动重启和超时。
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.sherpa_worker import read_wav, serve
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tokens', type=str, default=None)
+    parser.add_argument('--zipformer2-ctc-model', type=str, default=None)
+    parser.add_argument('--load-seconds', type=float, default=1.0)
+    parser.add_argument('--decode-seconds', type=float, default=0.02)
+    parser.add_argument('--worker', action='store_true')
+    parser.add_argument('--crash-after', type=int, default=0)
+    parser.add_argument('--hang-after', type=int, default=0)
+    parser.add_argument('wav', nargs='?')
+    args = parser.parse_args()
+
+    time.sleep(args.load_seconds)
+    handled = 0
+
+    def decode(data):
+        nonlocal handled
+        handled += 1
+        if args.crash_after and handled > args.crash_after:
+            os._exit(1)
+        if args.hang_after and handled > args.hang_after:
+            time.sleep(3600)
+        samples, sample_rate = read_wav(data)
+        time.sleep(args.decode_seconds)
+        return {"text": f"stub {len(samples) / sample_rate:.1f}s", "timestamps": [], "tokens": []}
+
+    if args.worker:
+        serve(decode)
+    else:
+        with open(args.wav, 'rb') as f:
+            result = decode(f.read())
+        print("Started", flush=True)
+        print(json.dumps(result, ensure_ascii=False), flush=True)
+
+
+if __name__ == "__main__":
+    main()
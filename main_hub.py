@@ -1,9 +1,10 @@
-from fastapi import FastAPI
-from api.base_api import InitMiddleware
+from fastapi import FastAPI, HTTPException
+from api.base_api import HUB_ROOT, AdmissionController, InitMiddleware, JobManager, JobMiddleware, ModelResidencyManager, metrics, temp_artifacts
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
+from contextlib import asynccontextmanager
 import asyncio
 import os
 import sys
-from fastapi import FastAPI, HTTPException
 import importlib
 
 import argparse
@@ -11,10 +12,13 @@ import argparse
 parser = argparse.ArgumentParser(description="Run AigcHub API")
 parser.add_argument('--host', type=str, default='0.0.0.0', help='Host on which to run the API')
 parser.add_argument('--port', type=int, default=8000, help='Port on which to run the API')
+parser.add_argument('--memory-budget', type=int, default=os.environ.get('TPU_MEMORY_BUDGET_MB'),
+                    help='Device memory budget in MB; least recently used idle apps are unloaded to stay within it')
+parser.add_argument('--eager', action='store_true', default=bool(int(os.environ.get('AIGCHUB_EAGER_INIT', 0))),
+                    help='Initialize all apps at startup instead of on first request')
+parser.add_argument('--warmup', action='store_true', default=bool(int(os.environ.get('AIGCHUB_WARMUP', 0))),
+                    help='With --eager, run one warmup inference per app after it is initialized')
 parser.add_argument('module_names', nargs='+', help='List of App module names to load')
-args = parser.parse_args()
-
-app = FastAPI()
 
 tags_metadata = [
     {
@@ -33,49 +37,130 @@ tags_metadata = [
         "name": "Text",
         "description": "文本处理与生成"
     },
+    {
+        "name": "Jobs",
+        "description": "异步任务（请求带 async=true 时返回的任务）"
+    },
 ]
 
-# 保存当前工作目录
-original_dir = os.getcwd()
-
-# 假设所有模块都在一个父目录下
-parent_dir = "./api"
+# 所有应用模块都在 api 目录下
+parent_dir = os.path.join(HUB_ROOT, "api")
 sys.path.append(parent_dir)
-module_names = args.module_names
 
-routers = []
 
-# 动态导入模块
-for module_name in module_names:
-    module_dir = os.path.join(parent_dir, module_name+'.py')
-    if not os.path.exists(module_dir):
-        print('No repository / module named', module_name)
-        raise ValueError
-    module = importlib.import_module(module_name)
-    if hasattr(module, 'router'):
-        routers.append(module.router)
+def create_app(module_names, memory_budget=None, eager=False, warmup=False):
+    @asynccontextmanager
+    async def lifespan(app):
+        # 清理已退出的 hub 进程遗留的临时文件，本进程的临时目录在关闭时删除
+        temp_artifacts.remove_stale()
+        # 预加载在后台进行，服务启动后即可响应 /healthz，全部完成前 /readyz 返回 503
+        task = None
+        if eager:
+            residency.startup_complete = False
+            task = asyncio.create_task(residency.warm_start(warmup=warmup))
+        yield
+        if task is not None:
+            task.cancel()
+        temp_artifacts.shutdown()
+
+    app = FastAPI(lifespan=lifespan)
+    routers = []
+
+    # 动态导入模块
+    for module_name in module_names:
+        module_dir = os.path.join(parent_dir, module_name+'.py')
+        if not os.path.exists(module_dir):
+            print('No repository / module named', module_name)
+            raise ValueError
+        module = importlib.import_module(module_name)
+        if hasattr(module, 'router'):
+            routers.append(module.router)
+
+    # 添加中间件，各应用在其路由首次被访问时才初始化
+    residency = ModelResidencyManager(routers, budget_mb=memory_budget)
+    # 各应用的并发与排队上限，超出时直接返回 429
+    admission = AdmissionController(routers)
+    app.add_middleware(InitMiddleware, residency=residency, admission=admission)
+    # 异步任务在最外层接收，重放时经过初始化中间件；提交时只检查排队任务数，执行时与同步请求一样经过准入控制
+    jobs = JobManager(routers, admission=admission)
+    app.add_middleware(JobMiddleware, jobs=jobs)
+
+    # 从apps.txt获取应用信息
+    app_meta_info = {}
+
+    apps_file = os.path.join(HUB_ROOT, "apps.txt")
+    with open(apps_file, "r") as file:
+        lines = file.readlines()
+        for line in lines:
+            name, _, tag = line.strip().split(", ")
+            app_meta_info[name] = tag
+
+    # 注册路由
+    for router in routers:
+        app.include_router(router, prefix='/'+router.app_name, tags=[app_meta_info[router.app_name]])
+
+    @app.get("/")
+    def read_root():
+        return {"message": "Hello, enjoy the services supported by Airbox on http://0.0.0.0:8000/docs !"}
+
+    @app.get("/healthz", tags=["Init"])
+    def read_healthz():
+        return {"status": "ok"}
+
+    @app.get("/readyz", tags=["Init"])
+    def read_readyz():
+        ready, apps = residency.readiness()
+        return JSONResponse(status_code=200 if ready else 503, content={"ready": ready, "apps": apps})
+
+    @app.get("/residency", tags=["Init"])
+    def read_residency():
+        return residency.stats()
+
+    @app.get("/admission", tags=["Init"])
+    def read_admission():
+        return admission.stats()
+
+    @app.get("/metrics", tags=["Init"])
+    def read_metrics():
+        return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+    @app.get("/jobs", tags=["Jobs"])
+    async def read_jobs():
+        return await jobs.stats()
 
-# 添加中间件，传入所有需要初始化的 routers
-app.add_middleware(InitMiddleware, routers=routers)
+    @app.get("/jobs/{job_id}", tags=["Jobs"])
+    async def read_job(job_id: str):
+        job = await jobs.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="Job not found or expired")
+        return job
 
-# 从apps.txt获取应用信息
-app_meta_info = {}
+    @app.get("/jobs/{job_id}/result", tags=["Jobs"])
+    async def read_job_result(job_id: str):
+        result = await jobs.result(job_id)
+        if result is None:
+            job = await jobs.get(job_id)
+            if job is None:
+                raise HTTPException(status_code=404, detail="Job not found or expired")
+            raise HTTPException(status_code=409, detail=f"Job is {job['status']}, no result available")
+        status_code, headers, body = result
+        # 原样返回任务的响应，长度按实际内容重新计算
+        headers = {k: v for k, v in headers if k.lower() != 'content-length'}
+        return Response(content=body, status_code=status_code, headers=headers)
 
-apps_file = "apps.txt"
-with open(apps_file, "r") as file:
-    lines = file.readlines()
-    for line in lines:
-        name, _, tag = line.strip().split(", ")
-        app_meta_info[name] = tag
+    @app.delete("/jobs/{job_id}", tags=["Jobs"])
+    async def cancel_job(job_id: str):
+        previous = await jobs.cancel(job_id)
+        if previous is None:
+            raise HTTPException(status_code=404, detail="Job not found or expired")
+        return {"id": job_id, "previous_status": previous,
+                "status": "cancelled" if previous in ("queued", "running") else previous}
 
-# 注册路由
-for router in routers:
-    app.include_router(router, prefix='/'+router.app_name, tags=[app_meta_info[router.app_name]])
+    return app
 
-@app.get("/")
-def read_root():
-    return {"message": "Hello, enjoy the services supported by Airbox on http://0.0.0.0:8000/docs !"}
 
 if __name__ == "__main__":
     import uvicorn
+    args = parser.parse_args()
+    app = create_app(args.module_names, memory_budget=args.memory_budget, eager=args.eager, warmup=args.warmup)
     uvicorn.run(app, host=args.host, port=args.port)
@@ -0,0 +1,15 @@
+"""测试共用的设置：用 benchmarks/mock_engines.py 的替身代替 TPU 引擎和应用仓库，不需要 Sophon 设备。
+
+api.base_api 在导入时读取 AIGCHUB_* 环境变量，因此替身在任何测试模块导入 hub 代码之前安装；
+应用目录、任务数据库、结果缓存和临时文件都放在一个临时目录下。
+"""
+import os
+import sys
+import tempfile
+
+HUB_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [HUB_ROOT, os.path.join(HUB_ROOT, "benchmarks")]
+
+import mock_engines
+
+mock_engines.install(tempfile.mkdtemp(prefix="aigchub_test_"), latency=0.01, token_latency=0.001)
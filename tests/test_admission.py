@@ -0,0 +1,133 @@
+"""准入控制：突发流量超出并发和排队上限的请求立即返回 429，Retry-After 按服务时间的滑动平均估算；
+异步任务在提交时同样受每个应用排队任务数的限制。"""
+import asyncio
+import math
+import threading
+import time
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+import mock_engines
+from api.base_api import AdmissionController, AdmissionRejected
+
+PATH = "/sd_lcm_tpu/v1/images/generations"
+FORM = {"prompt": "a cat", "seed": "-1", "num_inference_steps": "10"}
+
+
+@pytest.fixture
+def sd_router(monkeypatch):
+    import main_hub  # noqa: F401  把 api/ 加入 sys.path，应用模块按 main_hub 的方式导入
+    import sd_lcm_tpu
+
+    monkeypatch.setattr(sd_lcm_tpu.router, "max_concurrency", 1)
+    monkeypatch.setattr(sd_lcm_tpu.router, "max_queue", 2)
+    monkeypatch.setattr(sd_lcm_tpu.router, "max_queued_jobs", 2)
+    return sd_lcm_tpu.router
+
+
+def client_for(app):
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://hub", timeout=60)
+
+
+def test_retry_after_follows_service_time_average():
+    admission = AdmissionController([SimpleNamespace(app_name="stub", max_concurrency=2, max_queue=1)], alpha=0.5)
+
+    async def run():
+        # 滑动平均：第一个样本 4.0，再加一个 8.0 的样本后为 6.0
+        await admission.acquire("stub")
+        admission.release("stub", 4.0)
+        await admission.acquire("stub")
+        admission.release("stub", 8.0)
+        assert admission.service_seconds("stub") == 6.0
+
+        await admission.acquire("stub")
+        await admission.acquire("stub")
+        waiter = asyncio.ensure_future(admission.acquire("stub"))
+        await asyncio.sleep(0)
+        # 两个名额都被占用、排队已满：第 4 个请求被拒绝，需要等前面 1 个排队请求和自己各一轮服务时间
+        with pytest.raises(AdmissionRejected) as rejected:
+            await admission.acquire("stub")
+        assert rejected.value.retry_after == math.ceil(6.0 * 2 / 2)
+        # 后台任务（wait=True）不受排队长度限制
+        job = asyncio.ensure_future(admission.acquire("stub", wait=True))
+        await asyncio.sleep(0)
+        assert admission.stats()["stub"]["waiting"] == 2
+        for _ in range(3):
+            admission.release("stub")
+        await asyncio.gather(waiter, job)
+
+    asyncio.run(run())
+
+
+def test_burst_is_limited_to_concurrency_plus_queue(sd_router):
+    import main_hub
+
+    app = main_hub.create_app(["sd_lcm_tpu"])
+
+    async def run():
+        async with client_for(app) as client:
+            # 预热：加载模型，并给服务时间的滑动平均一个初值
+            assert (await client.post(PATH, data=FORM)).status_code == 200
+            responses = await asyncio.gather(*(client.post(PATH, data=FORM) for _ in range(8)))
+            stats = (await client.get("/admission")).json()["sd_lcm_tpu"]
+        return responses, stats
+
+    responses, stats = asyncio.run(run())
+    statuses = sorted(response.status_code for response in responses)
+    # 1 个正在处理 + 2 个排队，其余立即拒绝
+    assert statuses == [200] * 3 + [429] * 5
+    for response in responses:
+        if response.status_code == 429:
+            assert int(response.headers["Retry-After"]) >= 1
+    assert stats["rejected"] == 5
+    assert stats["service_seconds"] > 0
+
+
+def test_async_submissions_are_capped_per_app(sd_router, monkeypatch):
+    import main_hub
+
+    # 让第一个任务卡在引擎里，之后提交的任务都停留在排队状态
+    release = threading.Event()
+    generate = mock_engines.MockStableDiffusionPipeline.__call__
+
+    def blocked(self, *args, **kwargs):
+        assert release.wait(timeout=30)
+        return generate(self, *args, **kwargs)
+
+    monkeypatch.setattr(mock_engines.MockStableDiffusionPipeline, "__call__", blocked)
+    app = main_hub.create_app(["sd_lcm_tpu"])
+
+    async def wait_for(client, job_id, statuses):
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            job = (await client.get(f"/jobs/{job_id}")).json()
+            if job["status"] in statuses:
+                return job
+            await asyncio.sleep(0.02)
+        raise AssertionError(f"job {job_id} did not reach {statuses}")
+
+    async def run():
+        async with client_for(app) as client:
+            first = await client.post(PATH + "?async=true", data=FORM)
+            assert first.status_code == 202
+            await wait_for(client, first.json()["id"], ("running",))
+
+            accepted = [await client.post(PATH + "?async=true", data=FORM) for _ in range(2)]
+            assert [response.status_code for response in accepted] == [202, 202]
+            rejected = await client.post(PATH + "?async=true", data=FORM)
+            assert rejected.status_code == 429
+            assert int(rejected.headers["Retry-After"]) >= 1
+            stats = (await client.get("/jobs")).json()
+            assert stats["rejected"]["sd_lcm_tpu"] == 1
+            assert stats["apps"]["sd_lcm_tpu"]["queued"] == 2
+
+            release.set()
+            for response in [first] + accepted:
+                job = await wait_for(client, response.json()["id"], ("succeeded", "failed"))
+                assert job["status"] == "succeeded"
+            # 排队的任务执行完后可以再次提交
+            assert (await client.post(PATH + "?async=true", data=FORM)).status_code == 202
+
+    asyncio.run(run())
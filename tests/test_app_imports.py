@@ -0,0 +1,70 @@
+"""init_helper：并行初始化的应用各自导入自己目录下的顶层模块，不修改全局 sys.path。"""
+import asyncio
+import sys
+import threading
+
+from api.base_api import init_helper
+
+
+class FakeApp:
+    def __init__(self, app_dir):
+        self.dir = str(app_dir)
+
+    async def execute(self, func):
+        return await asyncio.to_thread(func)
+
+    @init_helper(None)
+    async def init_app(self, before_import=None):
+        if before_import is not None:
+            before_import()
+        import helper
+        from pkg import value
+        return helper.NAME, value.NAME
+
+
+def make_app(tmp_path, name):
+    app_dir = tmp_path / name
+    (app_dir / "pkg").mkdir(parents=True)
+    (app_dir / "helper.py").write_text(f"NAME = {name!r}\n")
+    (app_dir / "pkg" / "__init__.py").write_text("")
+    (app_dir / "pkg" / "value.py").write_text(f"NAME = {name!r}\n")
+    return FakeApp(app_dir)
+
+
+def test_same_named_modules_stay_per_app(tmp_path):
+    apps = [make_app(tmp_path, name) for name in ("app_a", "app_b")]
+    path = list(sys.path)
+
+    async def run():
+        return await asyncio.gather(*(app.init_app() for app in apps))
+
+    assert asyncio.run(run()) == [("app_a", "app_a"), ("app_b", "app_b")]
+    assert sys.path == path
+    # 先初始化的应用保留全局名字；再次初始化后者仍导入自己的模块
+    assert asyncio.run(apps[1].init_app()) == ("app_b", "app_b")
+    for key in ("helper", "pkg", "pkg.value"):
+        sys.modules.pop(key, None)
+
+
+class OtherApp(FakeApp):
+    @init_helper(None)
+    async def init_app(self, before_import):
+        before_import()
+        import other
+        return other.NAME
+
+
+def test_apps_without_shared_names_init_in_parallel(tmp_path):
+    first = make_app(tmp_path, "app_c")
+    (tmp_path / "app_d").mkdir()
+    (tmp_path / "app_d" / "other.py").write_text("NAME = 'app_d'\n")
+    second = OtherApp(tmp_path / "app_d")
+    # 两个应用都在初始化中时才能通过 barrier，串行执行会超时
+    barrier = threading.Barrier(2, timeout=5)
+
+    async def run():
+        return await asyncio.gather(first.init_app(barrier.wait), second.init_app(barrier.wait))
+
+    assert asyncio.run(run()) == [("app_c", "app_c"), "app_d"]
+    for key in ("helper", "pkg", "pkg.value", "other"):
+        sys.modules.pop(key, None)
@@ -0,0 +1,56 @@
+"""不同应用的请求在各自的工作线程中并行执行，互不阻塞，也不切换进程的工作目录。"""
+import asyncio
+import io
+import os
+import threading
+
+import httpx
+from PIL import Image
+
+import mock_engines
+
+APPS = ["rmbg", "upscaler_tpu"]
+
+
+def png_bytes(width=64, height=64):
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), (120, 80, 40)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def test_two_apps_run_concurrently(monkeypatch):
+    import main_hub
+
+    # 每个应用的引擎调用先报到，再等另一个应用报到：两者串行执行时后者永远等不到前者，请求会失败
+    arrived = {name: threading.Event() for name in APPS}
+    cwds = []
+
+    def gated(name, call):
+        other = next(app for app in APPS if app != name)
+
+        def wrapper(self, inputs):
+            arrived[name].set()
+            assert arrived[other].wait(timeout=10), f"{name} ran while {other} was blocked"
+            cwds.append(os.getcwd())
+            return call(self, inputs)
+        return wrapper
+
+    monkeypatch.setattr(mock_engines.MockEngineOV, "__call__", gated("rmbg", mock_engines.MockEngineOV.__call__))
+    monkeypatch.setattr(mock_engines.MockESRGANEngine, "__call__",
+                        gated("upscaler_tpu", mock_engines.MockESRGANEngine.__call__))
+    app = main_hub.create_app(APPS)
+    cwd = os.getcwd()
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://hub", timeout=30) as client:
+            image = ("image.png", png_bytes(), "image/png")
+            return await asyncio.gather(
+                client.post("/rmbg/v1/images/edit", files={"image": image}),
+                client.post("/upscaler_tpu/v1/images/variations", files={"image": image}, data={"upscale_ratio": "2"}),
+            )
+
+    responses = asyncio.run(run())
+    assert [response.status_code for response in responses] == [200, 200], [r.text for r in responses]
+    assert all(event.is_set() for event in arrived.values())
+    # 两个应用都不需要 cwd_lease，推理期间进程的工作目录保持不变
+    assert cwds and set(cwds) == {cwd}
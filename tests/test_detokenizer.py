@@ -0,0 +1,90 @@
+"""IncrementalDetokenizer：逐 token 流式输出的文本拼接后应与整段解码一致，且不输出不完整的 UTF-8 序列。"""
+import pytest
+
+from mock_engines import MockTokenizer
+from api.llm_tpu import IncrementalDetokenizer
+
+TEXTS = [
+    "你好，世界！今天天气怎么样？",
+    "北京是中华人民共和国的首都，有三千多年的建城史。",
+    "🚀✨🔥 launch 🎉🎉 done 👍🏽",
+    "家庭：👨‍👩‍👧‍👦，国旗：🇨🇳🇺🇸，肤色：👋🏻👋🏿",
+    "Mixed 中文 and English，还有 emoji 😀😃😄 和标点……",
+    "  leading spaces 和 trailing   ",
+]
+CORPUS = TEXTS * 4 + ["the quick brown fox jumps over the lazy dog", "中文分词测试语料，用于训练一个小词表。"]
+
+
+def byte_level_bpe():
+    """GPT-2 / Qwen 风格的字节级 BPE：一个汉字或 emoji 常被拆成多个 token。"""
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers
+    from transformers import PreTrainedTokenizerFast
+
+    tokenizer = Tokenizer(models.BPE())
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    trainer = trainers.BpeTrainer(vocab_size=400, initial_alphabet=pre_tokenizers.ByteLevel.alphabet(),
+                                  special_tokens=["<|endoftext|>"])
+    tokenizer.train_from_iterator(CORPUS, trainer)
+    return PreTrainedTokenizerFast(tokenizer_object=tokenizer, eos_token="<|endoftext|>")
+
+
+def sentencepiece_byte_fallback():
+    """Llama 风格的 sentencepiece：词首空格记为 ▁，词表外的字符（emoji 等）回退为 <0xXX> 字节 token。"""
+    from tokenizers import Tokenizer, decoders, models, normalizers
+    from transformers import PreTrainedTokenizerFast
+
+    vocab = {"<unk>": 0, "<s>": 1, "</s>": 2}
+    for byte in range(256):
+        vocab[f"<0x{byte:02X}>"] = len(vocab)
+    for char in sorted(set("".join(CORPUS).replace(" ", "▁")) | {"▁"}):
+        if not 0x1F000 <= ord(char) <= 0x1FFFF:  # emoji 不进词表，走字节回退
+            vocab.setdefault(char, len(vocab))
+    tokenizer = Tokenizer(models.BPE(vocab=vocab, merges=[], unk_token="<unk>", byte_fallback=True))
+    tokenizer.normalizer = normalizers.Sequence([normalizers.Prepend("▁"), normalizers.Replace(" ", "▁")])
+    tokenizer.decoder = decoders.Sequence([decoders.Replace("▁", " "), decoders.ByteFallback(), decoders.Fuse(),
+                                           decoders.Strip(" ", 1, 0)])
+    return PreTrainedTokenizerFast(tokenizer_object=tokenizer, unk_token="<unk>", bos_token="<s>", eos_token="</s>")
+
+
+@pytest.fixture(scope="module", params=["byte_level_bpe", "sentencepiece_byte_fallback"])
+def tokenizer(request):
+    pytest.importorskip("transformers")
+    return globals()[request.param]()
+
+
+def stream(tokenizer, tokens):
+    detokenizer = IncrementalDetokenizer(tokenizer)
+    pieces = [detokenizer.push(token) for token in tokens]
+    pieces.append(detokenizer.flush())
+    return pieces
+
+
+@pytest.mark.parametrize("text", TEXTS)
+def test_streamed_text_matches_one_shot_decode(tokenizer, text):
+    tokens = tokenizer.encode(text, add_special_tokens=False)
+    pieces = stream(tokenizer, tokens)
+    assert "".join(pieces) == tokenizer.decode(tokens, skip_special_tokens=True)
+    # 不完整的 UTF-8 序列要等补全后再输出
+    assert not any("�" in piece for piece in pieces)
+
+
+def test_multibyte_characters_are_split_across_tokens(tokenizer):
+    # 确认测试覆盖到“一个字符跨多个 token”的情况，否则上面的用例测不到 UTF-8 补全
+    tokens = tokenizer.encode("🚀👨‍👩‍👧‍👦", add_special_tokens=False)
+    assert any("�" in tokenizer.decode([token]) for token in tokens)
+
+
+def test_special_tokens_are_skipped(tokenizer):
+    tokens = tokenizer.encode("你好 🚀", add_special_tokens=False) + [tokenizer.eos_token_id]
+    assert "".join(stream(tokenizer, tokens)) == tokenizer.decode(tokens, skip_special_tokens=True)
+
+
+@pytest.mark.parametrize("text", TEXTS)
+def test_byte_tokenizer_without_transformers(text):
+    # benchmark 用的按字节切分的分词器，每个多字节字符都跨多个 token
+    tokenizer = MockTokenizer()
+    tokens = list(text.encode("utf-8"))
+    pieces = stream(tokenizer, tokens)
+    assert "".join(pieces) == text
+    assert not any("�" in piece for piece in pieces)
@@ -0,0 +1,77 @@
+"""LLMModelRegistry：从应用目录导入 pipeline 时不修改 sys.path，clear() 等占用中的 pipeline 被释放后才卸载。"""
+import sys
+import threading
+
+import pytest
+
+from api.llm_tpu import LLMModelRegistry
+
+PIPELINE = '''
+from .helper import SUFFIX
+
+
+class Model:
+    def __init__(self):
+        self.deinit_calls = 0
+
+    def deinit(self):
+        self.deinit_calls += 1
+
+
+class fakefam:
+    def __init__(self, args):
+        self.model_path = args.model_path + SUFFIX
+        self.model = Model()
+'''
+
+
+@pytest.fixture(autouse=True)
+def real_llm_models(monkeypatch):
+    """暂时移出 mock_engines 注册的 llm_models 替身包，从磁盘导入；结束后删除导入的模块并恢复替身。"""
+    for key in [key for key in sys.modules if key.partition(".")[0] == "llm_models"]:
+        monkeypatch.delitem(sys.modules, key)
+    yield
+    for key in [key for key in sys.modules if key.partition(".")[0] == "llm_models"]:
+        del sys.modules[key]
+
+
+def make_registry(tmp_path):
+    demo = tmp_path / "llm_models" / "fakefam" / "python_demo"
+    (tmp_path / "llm_models" / "fakefam" / "token_config").mkdir(parents=True)
+    demo.mkdir()
+    (demo / "pipeline.py").write_text(PIPELINE)
+    (demo / "helper.py").write_text("SUFFIX = '#loaded'\n")
+    (tmp_path / "llm_bmodels").mkdir()
+    (tmp_path / "llm_bmodels" / "fakefam_int4_seq1024.bmodel").write_bytes(b"\0" * 16)
+    registry = LLMModelRegistry(str(tmp_path))
+    registry.scan()
+    return registry
+
+
+def test_pipeline_is_imported_without_touching_sys_path(tmp_path):
+    registry = make_registry(tmp_path)
+    path = list(sys.path)
+    name = "fakefam_int4_seq1024.bmodel"
+    slm = registry.get(name)
+    assert sys.path == path
+    assert slm.model_path.endswith(name + "#loaded")
+    assert registry.entries[name]["seq_len"] == 1024
+    registry.release(name)
+    registry.clear()
+    assert slm.model.deinit_calls == 1 and registry.pipelines == {}
+
+
+def test_clear_waits_for_pinned_pipeline(tmp_path):
+    registry = make_registry(tmp_path)
+    name = "fakefam_int4_seq1024.bmodel"
+    slm = registry.get(name)
+    cleared = threading.Event()
+    thread = threading.Thread(target=lambda: (registry.clear(), cleared.set()))
+    thread.start()
+    # 会话仍在使用 pipeline 时不卸载
+    assert not cleared.wait(0.1)
+    assert slm.model.deinit_calls == 0
+    registry.release(name)
+    assert cleared.wait(5)
+    thread.join()
+    assert slm.model.deinit_calls == 1
@@ -0,0 +1,144 @@
+"""LLMScheduler：同一 pipeline 上的会话串行执行，不同 pipeline 的会话交替推进，取消后不再推进，并记录排队和首 token 统计。"""
+import asyncio
+import threading
+import time
+
+from api.llm_tpu import LLM_QUEUE_DEPTH, LLMScheduler
+
+EOS = -1
+
+
+class FakePipeline:
+    """只提供调度器用到的接口：forward_first/forward_next、token_length 和 SEQLEN。"""
+    SEQLEN = 10000
+
+    def __init__(self, name, log, tokens=5, step_seconds=0.0):
+        self.name = name
+        self.log = log  # 所有 pipeline 共用，按调度顺序记录 (name, 会话标记)
+        self.tokens = tokens
+        self.step_seconds = step_seconds
+        self.token_length = 0
+        self.current = None
+        self.generated = 0
+
+    def forward_first(self, tokens):
+        self.token_length = len(tokens)
+        self.generated = 0
+        return self._emit()
+
+    def forward_next(self):
+        self.token_length += 1
+        return self._emit()
+
+    def _emit(self):
+        time.sleep(self.step_seconds)
+        self.log.append((self.name, self.current))
+        self.generated += 1
+        return EOS if self.tokens and self.generated > self.tokens else self.generated
+
+
+def submit(scheduler, model, tag, gate=None):
+    def prefill():
+        if gate is not None:
+            assert gate.wait(5)
+        model.current = tag
+        return model.forward_first([1, 2, 3]), [EOS]
+    return scheduler.submit(model.name, model, prefill)
+
+
+async def collect(session):
+    return [token async for token in session]
+
+
+def test_same_model_requests_run_one_at_a_time():
+    log = []
+    model = FakePipeline("qwen", log)
+
+    async def run():
+        scheduler = LLMScheduler()
+        sessions = [submit(scheduler, model, tag) for tag in ("first", "second", "third")]
+        return await asyncio.gather(*(collect(session) for session in sessions))
+
+    assert asyncio.run(run()) == [[1, 2, 3, 4, 5]] * 3
+    # 共用一份 KV cache，后一个会话在前一个结束后才开始
+    assert [tag for _, tag in log] == ["first"] * 6 + ["second"] * 6 + ["third"] * 6
+
+
+def test_different_models_interleave():
+    log = []
+    first, second = FakePipeline("qwen", log), FakePipeline("llama", log)
+    gate = threading.Event()
+
+    async def run():
+        scheduler = LLMScheduler()
+        # 第一个会话在 prefill 中等待，确保两个会话都已提交后才开始推进
+        sessions = [submit(scheduler, first, "a", gate), submit(scheduler, second, "b")]
+        gate.set()
+        return await asyncio.gather(*(collect(session) for session in sessions))
+
+    assert asyncio.run(run()) == [[1, 2, 3, 4, 5]] * 2
+    names = [name for name, _ in log]
+    assert names.index("llama") < len(names) - 1 - names[::-1].index("qwen")
+    switches = sum(1 for a, b in zip(names, names[1:]) if a != b)
+    assert switches >= 8
+
+
+def test_cancelled_or_disconnected_session_stops_being_stepped():
+    log = []
+    cancelled, disconnected = FakePipeline("qwen", log, tokens=0), FakePipeline("llama", log, tokens=0)
+
+    async def run():
+        scheduler = LLMScheduler()
+        session = submit(scheduler, cancelled, "cancel")
+        async for token in session:
+            if token == 3:
+                session.cancel()
+                break
+
+        # 客户端断开时，等待 token 的任务被取消
+        other = submit(scheduler, disconnected, "disconnect")
+        reader = asyncio.create_task(collect(other))
+        while len([1 for name, _ in log if name == "llama"]) < 3:
+            await asyncio.sleep(0.001)
+        reader.cancel()
+        await asyncio.gather(reader, return_exceptions=True)
+
+        await asyncio.sleep(0.05)
+        steps = len(log)
+        await asyncio.sleep(0.05)
+        return scheduler, steps
+
+    scheduler, steps = asyncio.run(run())
+    assert len(log) == steps
+    assert scheduler.stats()["active"] == []
+    assert scheduler.completed == 2
+
+
+def test_queue_depth_and_ttft_stats():
+    log = []
+    model = FakePipeline("qwen", log, tokens=2, step_seconds=0.01)
+    gate = threading.Event()
+
+    def gauge():
+        return dict((dict(labels)["model"], value) for _, labels, value in LLM_QUEUE_DEPTH.samples())["qwen"]
+
+    async def run():
+        scheduler = LLMScheduler()
+        sessions = [submit(scheduler, model, "blocked", gate)]
+        while not scheduler.stats()["active"]:
+            await asyncio.sleep(0.001)
+        sessions += [submit(scheduler, model, tag) for tag in ("queued1", "queued2")]
+        queued = scheduler.stats()["queue_depth"], scheduler.queue_depth("qwen"), gauge()
+        await asyncio.sleep(0.02)
+        gate.set()
+        await asyncio.gather(*(collect(session) for session in sessions))
+        return scheduler, queued
+
+    scheduler, queued = asyncio.run(run())
+    assert queued == ({"qwen": 2}, 2, 2)
+    stats = scheduler.stats()
+    assert stats["queue_depth"] == {} and gauge() == 0
+    assert stats["completed"] == 3 and len(scheduler.ttft_history) == 3
+    # 第一个会话在 prefill 前等待了约 20ms，排队的会话还要等前面的会话生成完
+    assert stats["ttft"]["max"] >= 0.02
+    assert stats["ttft"]["last"] == scheduler.ttft_history[-1] > 0
@@ -0,0 +1,41 @@
+"""rmbg 多图上传：无法解码的图片只让对应的那一项返回错误，其他图片的结果照常返回。"""
+import asyncio
+import base64
+import io
+
+import httpx
+from PIL import Image
+
+
+def png_bytes(width=64, height=48):
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), (120, 80, 40)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def post_images(images):
+    import main_hub
+
+    app = main_hub.create_app(["rmbg"])
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://hub", timeout=30) as client:
+            files = [("image", (f"{i}.png", data, "image/png")) for i, data in enumerate(images)]
+            return await client.post("/rmbg/v1/images/edit", files=files)
+
+    return asyncio.run(run())
+
+
+def test_invalid_image_fails_only_its_own_entry():
+    response = post_images([png_bytes(), b"not an image", png_bytes(32, 32)])
+    assert response.status_code == 200, response.text
+    data = response.json()["data"]
+    assert "Invalid image" in data[1]["error"] and "b64_json" not in data[1]
+    sizes = [Image.open(io.BytesIO(base64.b64decode(data[i]["b64_json"]))).size for i in (0, 2)]
+    assert sizes == [(64, 48), (32, 32)]
+
+
+def test_single_invalid_image_is_a_400():
+    response = post_images([b"not an image"])
+    assert response.status_code == 400
+    assert "Invalid image" in response.json()["detail"]
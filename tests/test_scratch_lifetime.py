@@ -0,0 +1,72 @@
+"""请求的临时目录在该请求提交到工作线程的任务结束后才删除，客户端提前断开时任务仍可写入。"""
+import asyncio
+import os
+import threading
+
+import httpx
+from fastapi import Depends, FastAPI
+
+from api.base_api import AppExecutor, ScratchDir, TempArtifactManager, request_scratch, temp_artifacts
+
+
+def test_cleanup_waits_for_running_job(tmp_path):
+    manager = TempArtifactManager(root=str(tmp_path))
+    executor = AppExecutor("scratch_test")
+    started, proceed = threading.Event(), threading.Event()
+
+    async def run():
+        scratch = manager.scratch().bind()
+
+        def job():
+            started.set()
+            assert proceed.wait(5)
+            return scratch.write("late.bin", b"x" * 10)
+
+        waiter = asyncio.ensure_future(executor.run(job))
+        assert await asyncio.to_thread(started.wait, 5)
+        # 等待方被取消、请求结束，但任务仍在执行
+        waiter.cancel()
+        scratch.cleanup()
+        assert os.path.isdir(scratch.dir)
+        proceed.set()
+        for _ in range(500):
+            if not os.path.exists(scratch.dir):
+                break
+            await asyncio.sleep(0.01)
+        return scratch
+
+    scratch = asyncio.run(run())
+    assert not os.path.exists(scratch.dir)
+    assert manager.used_bytes() == 0
+
+
+def test_request_scratch_outlives_disconnected_client():
+    executor = AppExecutor("scratch_endpoint")
+    started, proceed, written = threading.Event(), threading.Event(), []
+    app = FastAPI()
+
+    @app.post("/work")
+    async def work(scratch: ScratchDir = Depends(request_scratch)):
+        def job():
+            started.set()
+            assert proceed.wait(5)
+            written.append(scratch.write("result.bin", b"done"))
+        await executor.run(job)
+        return {}
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://hub") as client:
+            request = asyncio.ensure_future(client.post("/work"))
+            assert await asyncio.to_thread(started.wait, 5)
+            request.cancel()  # 客户端断开
+            await asyncio.gather(request, return_exceptions=True)
+        proceed.set()
+        for _ in range(500):
+            if written and not os.path.exists(os.path.dirname(written[0])):
+                break
+            await asyncio.sleep(0.01)
+
+    asyncio.run(run())
+    # 任务在目录删除前完成写入，之后目录随最后一个任务结束而删除
+    assert written and not os.path.exists(os.path.dirname(written[0]))
+    assert temp_artifacts.used_bytes() == 0
@@ -0,0 +1,32 @@
+"""sd_lcm_tpu 形状桶：每个桶只有自己的 unet/vae，文本编码器和提示词编码缓存在各桶之间共用。"""
+import asyncio
+
+import httpx
+
+PATH = "/sd_lcm_tpu/v1/images/generations"
+
+
+def test_buckets_share_the_text_encoder():
+    import main_hub
+    import sd_lcm_tpu
+
+    app = main_hub.create_app(["sd_lcm_tpu"])
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://hub", timeout=30) as client:
+            for size in ("512x512", "640x960"):
+                response = await client.post(PATH, data={"prompt": "a cat", "size": size, "seed": "-1"})
+                assert response.status_code == 200, response.text
+            return (await client.get("/sd_lcm_tpu/v1/shape_buckets/stats")).json()
+
+    stats = asyncio.run(run())
+    router = sd_lcm_tpu.router
+    pipelines = list(router.models["pipelines"].values())
+    assert len(pipelines) == 2 == sd_lcm_tpu.SD_SHAPE_BUCKETS
+    assert pipelines[0].text_encoder is pipelines[1].text_encoder
+    assert pipelines[0].unet is not pipelines[1].unet
+    assert pipelines[0]._encode_prompt is pipelines[1]._encode_prompt
+    # 第二个桶的文本编码命中第一个桶写入的提示词缓存
+    assert router.prompt_cache.stats()["hits"] >= 1
+    assert stats["bucket_components"] == ["height", "unet", "width"]
+    assert router.memory_mb == sd_lcm_tpu.SD_PIPELINE_MB + sd_lcm_tpu.SD_BUCKET_MB
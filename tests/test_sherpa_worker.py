@@ -0,0 +1,88 @@
+"""SherpaWorker：用 benchmarks/stub_sherpa.py 作常驻进程，验证帧协议往返、崩溃后重启和卡住时的超时重启。"""
+import io
+import os
+import sys
+import wave
+
+import numpy as np
+import pytest
+
+# sherpa 没有替身引擎，api.sherpa 导入时只检查应用目录存在
+os.makedirs(os.path.join(os.environ["AIGCHUB_REPO_DIR"], "sherpa"), exist_ok=True)
+
+from api.sherpa import SherpaWorker  # noqa: E402
+from api.sherpa_worker import read_frame, write_frame  # noqa: E402
+
+STUB = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks", "stub_sherpa.py")
+
+
+def wav_bytes(seconds, sr=16000):
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sr)
+        wav.writeframes(np.zeros(int(seconds * sr), np.int16).tobytes())
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def start_worker():
+    workers = []
+
+    def start(*options, **kwargs):
+        worker = SherpaWorker([sys.executable, STUB, "--worker", "--load-seconds=0", "--decode-seconds=0", *options], **kwargs)
+        worker.start()
+        workers.append(worker)
+        return worker
+
+    yield start
+    for worker in workers:
+        worker.close()
+
+
+def test_frames_round_trip():
+    buffer = io.BytesIO()
+    for payload in (b"", b"\x00\xff" * 70000, "识别结果".encode()):
+        write_frame(buffer, payload)
+    buffer.seek(0)
+    assert [read_frame(buffer) for _ in range(3)] == [b"", b"\x00\xff" * 70000, "识别结果".encode()]
+    with pytest.raises(EOFError):
+        read_frame(buffer)
+
+
+def test_request_response_round_trip(start_worker):
+    worker = start_worker()
+    pid = worker.proc.pid
+    assert worker.recognize(wav_bytes(1.0))["text"] == "stub 1.0s"
+    assert worker.recognize(wav_bytes(2.5))["text"] == "stub 2.5s"
+    # 同一个进程处理所有请求
+    assert worker.proc.pid == pid
+    assert worker.stats() == {"running": True, "restarts": 0, "timeouts": 0}
+
+
+def test_worker_restarts_after_crash(start_worker):
+    worker = start_worker("--crash-after=1")
+    pid = worker.proc.pid
+    assert worker.recognize(wav_bytes(1.0))["text"] == "stub 1.0s"
+    # 第二个请求时进程退出，请求在重启后的进程上重试
+    assert worker.recognize(wav_bytes(2.0))["text"] == "stub 2.0s"
+    assert worker.proc.pid != pid
+    assert worker.stats()["restarts"] == 1
+
+    # 两次请求之间进程退出时，下一个请求先重启
+    worker.proc.kill()
+    worker.proc.wait()
+    assert worker.recognize(wav_bytes(1.0))["text"] == "stub 1.0s"
+    assert worker.stats() == {"running": True, "restarts": 2, "timeouts": 0}
+
+
+def test_hung_worker_hits_deadline_and_recovers(start_worker):
+    worker = start_worker("--hang-after=1", request_timeout=0.5)
+    assert worker.recognize(wav_bytes(1.0))["text"] == "stub 1.0s"
+    hung = worker.proc
+    with pytest.raises(TimeoutError):
+        worker.recognize(wav_bytes(1.0))
+    assert hung.poll() is not None  # 卡住的进程已被杀掉
+    assert worker.stats() == {"running": True, "restarts": 1, "timeouts": 1}
+    assert worker.recognize(wav_bytes(3.0))["text"] == "stub 3.0s"
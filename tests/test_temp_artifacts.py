@@ -0,0 +1,46 @@
+"""TempArtifactManager：按进程分目录，配额按 hub 写入的字节数累计，超出时先删除最旧的产物。"""
+import os
+import subprocess
+import sys
+
+import pytest
+from fastapi import HTTPException
+
+from api.base_api import TempArtifactManager
+
+
+def test_scratch_bytes_are_released_on_cleanup(tmp_path):
+    manager = TempArtifactManager(root=str(tmp_path), quota_mb=1)
+    scratch = manager.scratch()
+    assert os.path.dirname(scratch.dir) == os.path.join(str(tmp_path), str(os.getpid()))
+    scratch.write("a.bin", b"x" * 600 * 1024)
+    assert manager.used_bytes() == 600 * 1024
+    with pytest.raises(HTTPException) as e:
+        manager.scratch().write("b.bin", b"x" * 600 * 1024)
+    assert e.value.status_code == 507
+    scratch.cleanup()
+    assert manager.used_bytes() == 0 and not os.path.exists(scratch.dir)
+
+
+def test_oldest_outputs_are_evicted(tmp_path):
+    manager = TempArtifactManager(root=str(tmp_path), quota_mb=1)
+    paths = []
+    for _ in range(3):
+        path = manager.output_path(".wav", 400 * 1024)
+        open(path, "wb").close()
+        paths.append(path)
+    assert [os.path.exists(path) for path in paths] == [False, True, True]
+    assert manager.used_bytes() == 800 * 1024
+
+
+def test_only_exited_processes_are_cleaned(tmp_path):
+    exited = subprocess.run([sys.executable, "-c", "import os; print(os.getpid())"],
+                            capture_output=True, text=True).stdout.strip()
+    for name in (exited, str(os.getppid()), "shared"):
+        os.makedirs(os.path.join(str(tmp_path), name, "outputs"))
+    manager = TempArtifactManager(root=str(tmp_path))
+    manager.scratch()
+    manager.remove_stale()
+    assert sorted(os.listdir(str(tmp_path))) == sorted([str(os.getppid()), str(os.getpid()), "shared"])
+    manager.shutdown()
+    assert not os.path.exists(manager.dir)
@@ -0,0 +1,94 @@
+"""TilePipeline 分块超分：尺寸不是块大小整数倍时，块边缘、右下角的补齐和拼接位置都应正确；
+大输出写入 memmap，结果图像与输出数组共享内存。"""
+import importlib
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import mock_engines
+from api.base_api import HUB_ROOT, encode_image
+from api.upscaler_tpu import TilePipeline
+
+# 块大小为 200 - 2 * 20 = 160，这些尺寸都不是 160 的整数倍
+SIZES = [(161, 161), (197, 203), (350, 123), (480, 1), (1, 170)]
+UPSTREAM = os.path.join(HUB_ROOT, "repo", "upscaler_tpu", "pipeline.py")
+
+
+@pytest.fixture(autouse=True)
+def no_latency(monkeypatch):
+    monkeypatch.setattr(mock_engines, "LATENCY", 0)
+
+
+def random_image(width, height, seed=0):
+    return Image.fromarray(np.random.RandomState(seed).randint(0, 256, (height, width, 3), dtype=np.uint8))
+
+
+def rgb(image):
+    return np.asarray(image)[..., :3]
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_tiles_match_whole_image_upscale(size):
+    # mock 引擎是最近邻 4 倍放大，与分块无关，所以分块拼接的结果应与整图放大逐像素一致
+    image = random_image(*size)
+    result = TilePipeline(mock_engines.MockESRGANEngine()).run(image, 4)
+    expected = np.asarray(image).repeat(4, axis=0).repeat(4, axis=1)
+    assert result.size == (size[0] * 4, size[1] * 4)
+    assert np.array_equal(rgb(result), expected)
+
+
+@pytest.mark.parametrize("size", SIZES[:3])
+def test_fractional_ratio_stays_close_to_whole_image_resize(size):
+    image = random_image(*size)
+    result = TilePipeline(mock_engines.MockESRGANEngine()).run(image, 2)
+    expected = Image.fromarray(np.asarray(image).repeat(4, axis=0).repeat(4, axis=1)).resize(result.size, Image.BICUBIC)
+    assert result.size == (size[0] * 2, size[1] * 2)
+    # 每块单独缩放，只在块边界的几个像素上与整图缩放有差异
+    assert np.abs(rgb(result).astype(int) - np.asarray(expected).astype(int)).mean() < 2
+
+
+def test_large_output_goes_to_memmap_and_is_encoded_without_copy():
+    pipeline = TilePipeline(mock_engines.MockESRGANEngine())
+    # 8K RGB 输出约 100 MB，默认阈值不超过 64 MB
+    out = pipeline.allocate(7680, 4320)
+    assert isinstance(out, np.memmap)
+    del out
+
+    out = pipeline.allocate(64, 48)
+    out[..., :3] = np.random.RandomState(1).randint(0, 256, (48, 64, 3), dtype=np.uint8)
+    image = pipeline.to_image(out)
+    out[0, 0, :3] = (1, 2, 3)
+    assert image.getpixel((0, 0))[:3] == (1, 2, 3)  # 共享内存，而非拷贝
+    copy = Image.fromarray(np.ascontiguousarray(out[..., :3]))
+    for output_format in ("jpeg", "webp", "png"):
+        assert encode_image(image, output_format) == encode_image(copy, output_format)
+
+
+@pytest.fixture
+def upstream_model(monkeypatch):
+    """已安装的上游 UpscaleModel，引擎换成 mock 的最近邻 4 倍放大；未安装 upscaler_tpu 时跳过。"""
+    if not os.path.exists(UPSTREAM):
+        pytest.skip("upscaler_tpu is not installed, run scripts/init_app.sh upscaler_tpu")
+    # 与应用相同的导入方式，上游包内的相对导入才能生效
+    monkeypatch.syspath_prepend(HUB_ROOT)
+    try:
+        module = importlib.import_module("repo.upscaler_tpu.pipeline")
+    except ImportError as e:
+        pytest.skip(f"upstream upscaler pipeline cannot be imported here: {e}")
+    monkeypatch.setattr(module, "EngineOV", lambda *args, **kwargs: mock_engines.MockESRGANEngine(), raising=False)
+    model = module.UpscaleModel(model=os.path.join(os.path.dirname(UPSTREAM), "resrgan4x.bmodel"), padding=20)
+    model.model = mock_engines.MockESRGANEngine()
+    return model
+
+
+@pytest.mark.parametrize("size", SIZES[:3])
+@pytest.mark.parametrize("ratio", [2, 4])
+def test_matches_upstream_extract_and_enhance_tiles(upstream_model, size, ratio):
+    image = random_image(*size)
+    pipeline = TilePipeline(upstream_model.model, model_size=upstream_model.model_size, padding=upstream_model.padding)
+    expected = upstream_model.extract_and_enhance_tiles(image, upscale_ratio=ratio)
+    result = pipeline.run(image, ratio)
+    assert result.size == expected.size
+    assert np.abs(rgb(result).astype(int) - np.asarray(expected.convert("RGB")).astype(int)).mean() < 2